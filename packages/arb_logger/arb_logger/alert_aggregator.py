@@ -0,0 +1,140 @@
+import time
+import threading
+
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from arb_logger.alert_message import AlertMessage
+
+# (logger name, message template, level)
+BurstKey = Tuple[str, str, int]
+
+
+@dataclass
+class AlertBurst:
+    first: AlertMessage
+    opened: float
+    count: int = 0
+    first_created: Optional[float] = None
+    last_created: Optional[float] = None
+    processes: Set[str] = field(default_factory=set)
+    # acks of the collapsed alerts, handed to on_flush with the burst
+    acks: List[Any] = field(default_factory=list)
+
+    def add(self, alert_message: AlertMessage, ack: Any = None):
+        self.count += 1
+        if ack is not None:
+            self.acks.append(ack)
+        created = alert_message.created
+        if created is not None:
+            if self.first_created is None or created < self.first_created:
+                self.first_created = created
+            if self.last_created is None or created > self.last_created:
+                self.last_created = created
+        process = alert_message.processName or ''
+        if alert_message.process is not None:
+            process = f'{process}:{alert_message.process}'
+        if process:
+            self.processes.add(process)
+
+    def to_alert_message(self) -> AlertMessage:
+        if self.count == 1:
+            return self.first
+        return replace(self.first,
+                       msg=f'{self.first.msg} (x{self.count})',
+                       created=self.last_created,
+                       extra={
+                           **self.first.extra,
+                           'count': self.count,
+                           'first_created': self.first_created,
+                           'last_created': self.last_created,
+                           'processes': sorted(self.processes),
+                       })
+
+
+class AlertAggregator:
+    # Collapse the same alert sent by many processes in a short time
+    # into a single alert, flushed when its window closes or when it
+    # reaches MAX_COUNT alerts
+    # on_flush gets the alert and the acks of the alerts it collapses, so
+    # the sources are only acked once the burst was handled
+    WINDOW = 5
+    MAX_COUNT = 100
+
+    def __init__(self,
+                 on_flush: Callable[[AlertMessage, List[Any]], None],
+                 window: Optional[float] = None,
+                 max_count: Optional[int] = None):
+        self.on_flush = on_flush
+        # window=0 disables the aggregation
+        self.window = self.WINDOW if window is None else window
+        self.max_count = max_count or self.MAX_COUNT
+
+        # kept in opening order, the expired bursts are at the front
+        self._bursts: Dict[BurstKey, AlertBurst] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher = None
+        if self.window:
+            self._flusher = threading.Thread(target=self._flusher_loop,
+                                             name='AlertAggregator',
+                                             daemon=True)
+            self._flusher.start()
+
+    def __len__(self):
+        return len(self._bursts)
+
+    def add(self,
+            alert_message: AlertMessage,
+            now: Optional[float] = None,
+            ack: Any = None):
+        if not self.window:
+            self.on_flush(alert_message, [] if ack is None else [ack])
+            return
+
+        now = time.monotonic() if now is None else now
+        key = (alert_message.name, alert_message.msg, alert_message.levelno)
+        with self._lock:
+            burst = self._bursts.get(key)
+            if burst is None:
+                burst = self._bursts[key] = AlertBurst(alert_message, now)
+            burst.add(alert_message, ack)
+            if burst.count < self.max_count:
+                return
+            del self._bursts[key]
+
+        self._flush(burst)
+
+    def _flush(self, burst: AlertBurst):
+        self.on_flush(burst.to_alert_message(), burst.acks)
+
+    def flush_expired(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        expired: List[AlertBurst] = []
+        with self._lock:
+            while self._bursts:
+                key = next(iter(self._bursts))
+                if now - self._bursts[key].opened < self.window:
+                    break
+                expired.append(self._bursts.pop(key))
+
+        for burst in expired:
+            self._flush(burst)
+
+    def flush_all(self):
+        with self._lock:
+            bursts = list(self._bursts.values())
+            self._bursts.clear()
+        for burst in bursts:
+            self._flush(burst)
+
+    def _flusher_loop(self):
+        # check twice per window, an alert waits at most 1.5 window
+        while not self._stopped.wait(self.window / 2):
+            self.flush_expired()
+
+    def stop(self):
+        self._stopped.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush_all()
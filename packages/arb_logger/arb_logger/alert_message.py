@@ -3,10 +3,11 @@ import json
 from numbers import Number
 from logging import LogRecord
 from dataclasses import dataclass, field, fields
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
+from json.encoder import c_make_encoder, encode_basestring_ascii
 
 
-@dataclass
+@dataclass(slots=True)
 class AlertMessage:
     name: str
     msg: str
@@ -20,6 +21,7 @@ class AlertMessage:
     funcName: Optional[str] = None
     created: Optional[float] = None
     processName: Optional[str] = None
+    process: Optional[int] = None
     extra: Dict[str, Any] = field(default_factory=dict)
 
     @classmethod
@@ -44,26 +46,70 @@ class AlertMessage:
         return log_message
 
     @classmethod
-    def log_record_to_dict(cls, log_record: LogRecord) -> Dict[str, Any]:
-
-        def jsonify_value(value: Any) -> Any:
-            if isinstance(value, (str, Number)):
-                return value
-            return json.dumps(value, separators=(',', ':'), default=str)
+    def from_stream_entry(cls, entry: Dict[str, str]) -> 'AlertMessage':
+        # Stream entries fields are all strings, restore the numeric ones
+        record_dict = dict(entry)
+        for k, k_type in NUMERIC_FIELDS.items():
+            if k in record_dict:
+                record_dict[k] = k_type(record_dict[k])
+        return cls.from_dict(record_dict)
 
-        record_dict = {
-            k: jsonify_value(v)
+    @classmethod
+    def log_record_to_dict(cls, log_record: LogRecord) -> Dict[str, Any]:
+        # Single pass over the record, exact type check first to skip
+        # the slow Number ABC check for the common values
+        return {
+            k: v if type(v) in PLAIN_TYPES else jsonify_value(v)
             for k, v in log_record.__dict__.items()
-            if (k not in LOG_RECORD_EXC_FIELDS and not k.startswith('_')
-                and v is not None)
+            if (v is not None and k not in LOG_RECORD_EXC_FIELDS
+                and not k.startswith('_'))
         }
 
-        return record_dict
+    @classmethod
+    def log_record_to_json(cls,
+                           log_record: LogRecord) -> Tuple[Dict[str, Any], str]:
+        # Return the record dict for the stream entry and its json payload
+        record_dict = cls.log_record_to_dict(log_record)
+        return record_dict, encode_json(record_dict)
+
+
+def jsonify_value(value: Any) -> Any:
+    if isinstance(value, (str, Number)):
+        return value
+    return encode_json(value)
 
 
 # Process constants only one time
 FIELD_NAMES = {f.name for f in fields(AlertMessage)}
 LOG_RECORD_EXC_FIELDS = {
-    'args', 'msecs', 'process', 'relativeCreated', 'thread', 'threadName',
-    'exc_info'
+    'args', 'msecs', 'relativeCreated', 'thread', 'threadName', 'exc_info'
 }
+PLAIN_TYPES = {str, int, float, bool}
+NUMERIC_FIELDS = {
+    'levelno': int,
+    'lineno': int,
+    'created': float,
+    'process': int
+}
+
+
+def _make_json_encoder():
+    # Same output as json.dumps(value, separators=(',', ':'), default=str)
+    # JSONEncoder.encode builds a new C encoder on every call, build it once
+    if c_make_encoder is None:
+        return json.JSONEncoder(separators=(',', ':'), default=str).encode
+
+    #? no circular reference check (markers=None), a circular value
+    #? raises a RecursionError instead of a ValueError
+    _iterencode = c_make_encoder(None, str, encode_basestring_ascii, None,
+                                 ':', ',', False, False, True)
+
+    def _encode_json(value: Any) -> str:
+        if isinstance(value, str):
+            return encode_basestring_ascii(value)
+        return ''.join(_iterencode(value, 0))
+
+    return _encode_json
+
+
+encode_json = _make_json_encoder()
@@ -0,0 +1,209 @@
+import time
+import queue
+import logging
+import platform
+import threading
+import urllib.request
+
+from pathlib import Path
+from dataclasses import asdict
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+
+from arb_logger.latency import LatencyWindow
+from arb_logger.alert_message import AlertMessage, encode_json
+
+if platform.system() == 'Darwin':
+    import pync
+
+
+class AlertSink(ABC):
+    # Alerts below this level are not sent to the sink
+    LEVEL = logging.ERROR
+    # Alerts are dropped when the sink queue is full
+    MAX_QUEUE_SIZE = 1000
+    WORKERS = 1
+
+    @property
+    def name(self):
+        return self.__class__.__name__
+
+    @abstractmethod
+    def send(self, alert_message: AlertMessage):
+        """
+        Deliver the alert, called from the sink worker threads
+        """
+        pass
+
+
+class MacosNotificationSink(AlertSink):
+
+    def send(self, alert_message: AlertMessage):
+        if platform.system() == 'Darwin':
+            title = f"{alert_message.levelname} - {alert_message.name}"
+            subtitle = f"{alert_message.filename}:{alert_message.lineno}"
+            message = alert_message.msg
+            pync.notify(message, title=title, subtitle=subtitle, wait=True)
+
+
+class FileSink(AlertSink):
+    # Append the alerts as json lines
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def send(self, alert_message: AlertMessage):
+        line = encode_json(asdict(alert_message)) + '\n'
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line)
+
+
+class WebhookSink(AlertSink):
+    # POST the alerts as json
+    TIMEOUT = 5
+    WORKERS = 2
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def send(self, alert_message: AlertMessage):
+        data = encode_json(asdict(alert_message)).encode()
+        request = urllib.request.Request(
+            self.url,
+            data=data,
+            headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.TIMEOUT):
+            pass
+
+
+class SinkStats:
+
+    def __init__(self, sink_queue: queue.Queue):
+        self.queue = sink_queue
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.max_queue_depth = 0
+        self.latency = LatencyWindow()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            **self.latency.to_dict(),
+        }
+
+
+class DispatchTracker:
+    # Calls on_done once every sink handled (sent, failed or dropped) an alert
+
+    def __init__(self, count: int, on_done: Callable[[], None]):
+        self.count = count
+        self.on_done = on_done
+        self._lock = threading.Lock()
+
+    def done(self):
+        with self._lock:
+            self.count -= 1
+            if self.count:
+                return
+        self.on_done()
+
+
+class SinkDispatcher:
+    # Each sink has its own bounded queue and worker threads
+    # a slow sink only fills its own queue, dispatch never blocks
+
+    def __init__(self,
+                 sinks: List[AlertSink],
+                 logger: Optional[logging.Logger] = None):
+        self.sinks = sinks
+        self.logger = logger or logging.getLogger(__name__)
+        self._queues: Dict[str, queue.Queue] = {}
+        self._stats: Dict[str, SinkStats] = {}
+        self._workers: List[threading.Thread] = []
+
+        for sink in sinks:
+            sink_queue = queue.Queue(maxsize=sink.MAX_QUEUE_SIZE)
+            self._queues[sink.name] = sink_queue
+            self._stats[sink.name] = SinkStats(sink_queue)
+            for i in range(sink.WORKERS):
+                worker = threading.Thread(target=self._worker,
+                                          args=(sink, sink_queue),
+                                          name=f'{sink.name}-{i}',
+                                          daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def dispatch(self,
+                 alert_message: AlertMessage,
+                 on_done: Optional[Callable[[], None]] = None):
+        # on_done is called once every sink handled the alert
+        sinks = [s for s in self.sinks if alert_message.levelno >= s.LEVEL]
+        tracker = None
+        if on_done is not None:
+            if not sinks:
+                self._call_done(on_done)
+                return
+            tracker = DispatchTracker(len(sinks), on_done)
+
+        for sink in sinks:
+            sink_queue = self._queues[sink.name]
+            stats = self._stats[sink.name]
+            try:
+                sink_queue.put_nowait((alert_message, tracker))
+            except queue.Full:
+                stats.dropped += 1
+                self._done(tracker)
+                continue
+            stats.max_queue_depth = max(stats.max_queue_depth,
+                                        sink_queue.qsize())
+
+    def _call_done(self, on_done: Callable[[], None]):
+        try:
+            on_done()
+        except Exception as e:
+            self.logger.warning(f'Error after dispatching alert: {e}')
+
+    def _done(self, tracker: Optional[DispatchTracker]):
+        if tracker is not None:
+            self._call_done(tracker.done)
+
+    def _worker(self, sink: AlertSink, sink_queue: queue.Queue):
+        stats = self._stats[sink.name]
+        while True:
+            item = sink_queue.get()
+            if item is None:
+                sink_queue.task_done()
+                return
+            alert_message, tracker = item
+            start = time.perf_counter()
+            try:
+                sink.send(alert_message)
+                stats.sent += 1
+            except Exception as e:
+                stats.failed += 1
+                self.logger.warning(f'{sink.name} failed to send alert: {e}')
+            finally:
+                stats.latency.add(time.perf_counter() - start)
+                self._done(tracker)
+                sink_queue.task_done()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: stats.to_dict() for name, stats in self._stats.items()}
+
+    def join(self):
+        # Wait until every queued alert is handled
+        for sink_queue in self._queues.values():
+            sink_queue.join()
+
+    def stop(self):
+        for sink in self.sinks:
+            for _ in range(sink.WORKERS):
+                self._queues[sink.name].put(None)
+        for worker in self._workers:
+            worker.join()
@@ -1,20 +1,64 @@
 import json
+import time
+import socket
 import logging
+import threading
 import platform
 
-from arb_logger.alert_message import AlertMessage
-from arb_logger.logger import get_logger, get_redis_log_client, get_redis_log_key
+from functools import partial
+from pathlib import Path
+from argparse import ArgumentParser
+from typing import Any, Dict, List, Optional, Tuple
+
+from redis import Redis, RedisError, ResponseError
 
-if platform.system() == 'Darwin':
-    import pync
+from arb_logger.alert_message import AlertMessage
+from arb_logger.alert_aggregator import AlertAggregator
+from arb_logger.logger import (get_logger, get_redis_log_client,
+                               get_redis_log_key, REDIS_LOG_STREAM)
+from arb_logger.alert_sinks import (AlertSink, FileSink, MacosNotificationSink,
+                                    SinkDispatcher, WebhookSink)
 
 LOGGER = get_logger('arb_alerts', short=True, redis_handler=False)
 
+# (stream, group, entry id) of a stream entry read through a consumer group
+StreamAck = Tuple[str, str, str]
+
 
 class ArbAlerts:
+    GROUP_NAME = 'arb_alerts'
+    # max entries read (and acked) per XREADGROUP
+    BATCH_SIZE = 100
+    BLOCK_MS = 5000
+    # pending entries of other consumers idle for longer are claimed at start
+    CLAIM_IDLE_MS = 60000
+    # sinks stats are logged at most every STATS_INTERVAL seconds
+    STATS_INTERVAL = 300
+
+    def __init__(self,
+                 redis_client: Optional[Redis] = None,
+                 sinks: Optional[List[AlertSink]] = None,
+                 aggregate_window: Optional[float] = None):
+        self.redis_client = redis_client or get_redis_log_client()
+
+        if sinks is None:
+            sinks = get_default_sinks()
+        self.dispatcher = SinkDispatcher(sinks, logger=LOGGER)
+        # aggregate_window=0 forwards every alert individually
+        self.aggregator = AlertAggregator(self.log_alert_message,
+                                          window=aggregate_window)
+        self._last_stats_ts = time.monotonic()
+        # handled entries waiting to be acked, see flush_acks
+        self._acks: List[StreamAck] = []
+        self._acks_lock = threading.Lock()
 
-    def __init__(self):
-        self.redis_client = get_redis_log_client()
+    def log_sinks_stats(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_stats_ts < self.STATS_INTERVAL:
+            return
+        self._last_stats_ts = now
+        for name, stats in self.dispatcher.stats().items():
+            LOGGER.info(f'Sink {name} stats: {stats}')
 
     def listen(self):
         self.pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
@@ -29,12 +73,164 @@ class ArbAlerts:
                 try:
                     record_dict = json.loads(message['data'])
                     log_message = AlertMessage.from_dict(record_dict)
-                    self.log_alert_message(log_message)
+                    self.aggregator.add(log_message)
                 except Exception as e:
                     LOGGER.exception(
                         f"Error while processing log message: {e}")
+                self.log_sinks_stats()
+
+    def listen_group(self,
+                     streams: Optional[List[str]] = None,
+                     group: str = GROUP_NAME,
+                     consumer: Optional[str] = None):
+        # Read the log streams through a consumer group, entries are acked
+        # once their alert went through the aggregator and the sinks so
+        # nothing is lost while arb_alerts is down or restarting
+        # several arb_alerts with different consumer names share the load
+        streams = streams or [REDIS_LOG_STREAM]
+        consumer = consumer or socket.gethostname()
+
+        for stream in streams:
+            self.create_group(stream, group)
+
+        # Replay entries read but not acked before a crash or a restart
+        self.claim_pending(streams, group, consumer)
+        self.replay_pending(streams, group, consumer)
+
+        LOGGER.info(f'Reading {streams} as {consumer} in group {group}')
+        while True:
+            self.read_group_batch(streams,
+                                  group,
+                                  consumer,
+                                  block=self.BLOCK_MS)
+            self.log_sinks_stats()
+
+    def create_group(self, stream: str, group: str):
+        try:
+            # Only new entries are read by a new group
+            self.redis_client.xgroup_create(stream,
+                                            group,
+                                            id='$',
+                                            mkstream=True)
+            LOGGER.info(f'Created consumer group {group} on {stream}')
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
 
-    def log_alert_message(self, alert_message: AlertMessage):
+    def claim_pending(self, streams: List[str], group: str, consumer: str):
+        # Take over the entries left pending by dead consumers
+        for stream in streams:
+            start_id = '0-0'
+            try:
+                while True:
+                    response = self.redis_client.xautoclaim(
+                        stream,
+                        group,
+                        consumer,
+                        self.CLAIM_IDLE_MS,
+                        start_id=start_id,
+                        count=self.BATCH_SIZE)
+                    # [next start id, claimed entries, deleted ids]
+                    start_id = response[0]
+                    if start_id == '0-0':
+                        break
+            except ResponseError as e:
+                LOGGER.warning(f'Could not claim pending entries: {e}')
+
+    def read_group_batch(self,
+                         streams: List[str],
+                         group: str,
+                         consumer: str,
+                         last_id: str = '>',
+                         block: Optional[int] = None) -> int:
+        # last_id '>' reads new entries, '0' the pending ones of the consumer
+        response = self.read_group(group,
+                                   consumer,
+                                   {stream: last_id
+                                    for stream in streams},
+                                   block=block)
+        return sum(len(entries) for _, entries in response)
+
+    def replay_pending(self, streams: List[str], group: str,
+                       consumer: str) -> int:
+        # Pending entries stay pending until their alert is handled, page
+        # through them once from the last id read instead of from '0'
+        last_ids = {stream: '0' for stream in streams}
+        count = 0
+        while last_ids:
+            response = self.read_group(group, consumer, last_ids)
+            last_ids = {
+                stream: entries[-1][0]
+                for stream, entries in response if entries
+            }
+            count += sum(len(entries) for _, entries in response)
+        return count
+
+    def read_group(self,
+                   group: str,
+                   consumer: str,
+                   stream_ids: Dict[str, str],
+                   block: Optional[int] = None) -> List[Any]:
+        response = self.redis_client.xreadgroup(group,
+                                                consumer,
+                                                stream_ids,
+                                                count=self.BATCH_SIZE,
+                                                block=block)
+
+        for stream, entries in response or []:
+            # entries without an alert are acked with this batch, the others
+            # once their alert was handled, see ack_entries
+            for entry_id, entry in entries:
+                ack = (stream, group, entry_id)
+                # entry is None when it was trimmed before being acked
+                if not entry or not self.process_stream_entry(entry, ack=ack):
+                    self.ack_entries([ack])
+        # also sends the acks of the alerts handled by the sinks workers and
+        # the aggregator flusher since the last batch
+        self.flush_acks()
+        return response or []
+
+    def process_stream_entry(self,
+                             entry: Dict[str, Any],
+                             ack: Optional[StreamAck] = None) -> bool:
+        # False when the entry is not an alert to send
+        if entry.get('name', '').split('.')[0] == 'arb_alerts':
+            # Prevent recursive logging of arb_alerts's messages
+            return False
+        try:
+            log_message = AlertMessage.from_stream_entry(entry)
+            self.aggregator.add(log_message, ack=ack)
+        except Exception as e:
+            LOGGER.exception(f"Error while processing log message: {e}")
+            return False
+        return True
+
+    def ack_entries(self, acks: List[StreamAck]):
+        # called once the alert was handled (inline or by the sinks workers),
+        # acked with the next batch instead of one XACK per entry
+        with self._acks_lock:
+            self._acks.extend(acks)
+            flush = len(self._acks) >= self.BATCH_SIZE
+        if flush:
+            self.flush_acks()
+
+    def flush_acks(self):
+        # one XACK per stream for all the handled entries
+        with self._acks_lock:
+            acks, self._acks = self._acks, []
+        entry_ids: Dict[Tuple[str, str], List[str]] = {}
+        for stream, group, entry_id in acks:
+            entry_ids.setdefault((stream, group), []).append(entry_id)
+        for (stream, group), ids in entry_ids.items():
+            try:
+                self.redis_client.xack(stream, group, *ids)
+            except RedisError as e:
+                # replayed on the next start
+                LOGGER.error(f'Could not ack {len(ids)} entries: {e}')
+
+    def log_alert_message(self,
+                          alert_message: AlertMessage,
+                          acks: Optional[List[StreamAck]] = None):
         # Convert back AlertMessage to LogRecord to be handled by local logger easily
         msg = alert_message.msg
         if alert_message.extra:
@@ -49,25 +245,57 @@ class ArbAlerts:
                                        exc_info=None)
         LOGGER.handle(log_record)
 
-        if alert_message.levelno >= logging.ERROR:
-            """
-            make this async
-            """
-            self.send_macos_notification(alert_message)
+        # Sinks are slow (notifications wait to be dismissed), they are
+        # handled by the dispatcher worker threads
+        on_done = partial(self.ack_entries, acks) if acks else None
+        self.dispatcher.dispatch(alert_message, on_done=on_done)
+
 
-    def send_macos_notification(self, log_message: AlertMessage):
-        if platform.system() == 'Darwin':
-            title = f"{log_message.levelname} - {log_message.name}"
-            subtitle = f"{log_message.filename}:{log_message.lineno}"
-            message = log_message.msg
-            pync.notify(message, title=title, subtitle=subtitle, wait=True)
+def get_default_sinks() -> List[AlertSink]:
+    if platform.system() == 'Darwin':
+        return [MacosNotificationSink()]
+    return []
 
 
 def main():
+    parser = ArgumentParser(description='Listen to the logs and send alerts')
+    parser.add_argument('--group',
+                        action='store_true',
+                        help='Read the log streams through a consumer group '
+                        'instead of the pub/sub channels')
+    parser.add_argument('--streams',
+                        nargs='+',
+                        default=[REDIS_LOG_STREAM],
+                        help='Streams to read in group mode')
+    parser.add_argument('--consumer',
+                        help='Consumer name in group mode, defaults to the '
+                        'hostname')
+    parser.add_argument('--aggregate-window',
+                        type=float,
+                        default=AlertAggregator.WINDOW,
+                        help='Seconds during which identical alerts are '
+                        'collapsed into one, 0 to disable')
+    parser.add_argument('--file-sink',
+                        type=Path,
+                        help='Also append the alerts to this file')
+    parser.add_argument('--webhook-sink',
+                        help='Also POST the alerts to this url')
+    args = parser.parse_args()
+
+    sinks = get_default_sinks()
+    if args.file_sink:
+        sinks.append(FileSink(args.file_sink))
+    if args.webhook_sink:
+        sinks.append(WebhookSink(args.webhook_sink))
+
     LOGGER.info('Starting arb_alerts')
-    arb_alerts = ArbAlerts()
+    arb_alerts = ArbAlerts(sinks=sinks,
+                           aggregate_window=args.aggregate_window)
     LOGGER.info('Listening for log messages...')
-    arb_alerts.listen()
+    if args.group:
+        arb_alerts.listen_group(args.streams, consumer=args.consumer)
+    else:
+        arb_alerts.listen()
 
 
 if __name__ == '__main__':
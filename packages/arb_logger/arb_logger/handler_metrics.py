@@ -0,0 +1,220 @@
+import os
+import time
+import socket
+import logging
+import weakref
+import threading
+
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from arb_logger.alert_message import encode_json
+from arb_logger.logger import RedisHandler
+
+if TYPE_CHECKING:
+    from redis import Redis
+
+# Time spent in each handler of the instrumented loggers, read in process
+# with get_logging_metrics or published to redis by a MetricsPublisher
+
+METRICS_KEY = 'arb_logger:metrics'
+
+
+class LatencyHistogram:
+    # log2 buckets in microseconds, bucket i counts the latencies below 2**i us
+    # the last bucket counts everything above
+    # no lock, a concurrent add can at worst be lost
+    BUCKETS = 21
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts: List[int] = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, latency: float):
+        bucket = int(latency * 1e6).bit_length()
+        if bucket >= self.BUCKETS:
+            bucket = self.BUCKETS - 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def percentile(self, p: float) -> Optional[float]:
+        # upper bound of the bucket holding the percentile
+        if not self.count:
+            return None
+        target = p * self.count
+        cumulative = 0
+        for bucket, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(2**bucket / 1e6, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'latency_avg': self.total / self.count if self.count else None,
+            'latency_p50': self.percentile(0.5),
+            'latency_p99': self.percentile(0.99),
+            'latency_max': self.max if self.count else None,
+            'buckets': self.counts,
+        }
+
+
+class HandlerMetrics:
+
+    def __init__(self, name: str, handler: logging.Handler):
+        self.name = name
+        self.handler_ref = weakref.ref(handler)
+        self.histogram = LatencyHistogram()
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        handler = self.handler_ref()
+        if handler is None:
+            return None
+        stats = getattr(handler, 'stats', None)
+        return {
+            **self.histogram.to_dict(),
+            **(stats() if stats is not None else {}),
+        }
+
+
+_handler_metrics: Dict[str, HandlerMetrics] = {}
+
+
+def get_handler_kind(handler: logging.Handler) -> str:
+    if isinstance(handler, RedisHandler):
+        return 'redis'
+    if isinstance(handler, logging.FileHandler):
+        return 'file'
+    if isinstance(handler, logging.StreamHandler):
+        return 'stream'
+    return handler.__class__.__name__
+
+
+def instrument_handler(handler: logging.Handler, name: str) -> HandlerMetrics:
+    # Time Handler.handle (filters, lock and emit) of this handler instance
+    metrics = HandlerMetrics(name, handler)
+    histogram = metrics.histogram
+    handle = handler.handle
+    perf_counter = time.perf_counter
+
+    def timed_handle(record: logging.LogRecord):
+        start = perf_counter()
+        try:
+            return handle(record)
+        finally:
+            histogram.add(perf_counter() - start)
+
+    handler.handle = timed_handle  # type: ignore
+    _handler_metrics[name] = metrics
+    return metrics
+
+
+def instrument_logger(logger: logging.Logger):
+    for handler in logger.handlers:
+        name = f'{logger.name}:{get_handler_kind(handler)}'
+        if name in _handler_metrics:
+            # several handlers of the same kind
+            name = f'{name}:{len(_handler_metrics)}'
+        instrument_handler(handler, name)
+
+
+def get_logging_metrics() -> Dict[str, Dict[str, Any]]:
+    metrics = {}
+    for name, handler_metrics in list(_handler_metrics.items()):
+        handler_dict = handler_metrics.to_dict()
+        if handler_dict is None:
+            # handler garbage collected
+            _handler_metrics.pop(name, None)
+            continue
+        metrics[name] = handler_dict
+    return metrics
+
+
+def get_metrics_key() -> str:
+    return f'{METRICS_KEY}:{socket.gethostname()}:{os.getpid()}'
+
+
+class MetricsPublisher:
+    # Publish the metrics in a redis hash (one json field per handler)
+    # expiring when the process stops publishing
+    INTERVAL = 10
+
+    def __init__(self,
+                 redis_client: Optional['Redis'] = None,
+                 interval: Optional[float] = None):
+        if redis_client is None:
+            from arb_logger.redis_connection import get_redis_client
+            redis_client = get_redis_client()
+        self.redis_client = redis_client
+        self.interval = interval or self.INTERVAL
+        self.key = get_metrics_key()
+        self._failing = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop,
+                                        name='MetricsPublisher',
+                                        daemon=True)
+        self._thread.start()
+
+    def publish(self):
+        metrics = get_logging_metrics()
+        if not metrics:
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hset(self.key,
+                  mapping={
+                      name: encode_json(handler_dict)
+                      for name, handler_dict in metrics.items()
+                  })
+        pipe.expire(self.key, int(self.interval * 3))
+        pipe.execute()
+
+    def _loop(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.publish()
+                self._failing = False
+            except Exception as e:
+                # only warn once until it works again
+                if not self._failing:
+                    logging.getLogger(__name__).warning(
+                        f'Could not publish logging metrics: {e}')
+                self._failing = True
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+_publisher: Optional[MetricsPublisher] = None
+
+
+def start_metrics_publisher(redis_client: Optional['Redis'] = None,
+                            interval: Optional[float] = None
+                            ) -> MetricsPublisher:
+    global _publisher
+    if _publisher is None:
+        _publisher = MetricsPublisher(redis_client, interval)
+    return _publisher
+
+
+def _after_fork_in_child():
+    # the publisher thread doesnt exist in the child and the latencies
+    # are the parent's
+    global _publisher
+    _publisher = None
+    for handler_metrics in _handler_metrics.values():
+        handler_metrics.histogram.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,35 @@
+from collections import deque
+from typing import Dict, Optional, Sequence
+
+# Latency percentiles shared by the redis metrics, the alert sinks stats and
+# the benchmarks
+
+
+def percentile(latencies: Sequence[float], p: float) -> Optional[float]:
+    # nearest rank, latencies must be sorted
+    if not latencies:
+        return None
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+class LatencyWindow:
+    # keep the last latencies for the percentiles
+    SIZE = 1000
+
+    def __init__(self, size: Optional[int] = None):
+        self.latencies: deque = deque(maxlen=size or self.SIZE)
+
+    def __len__(self):
+        return len(self.latencies)
+
+    def add(self, latency: float):
+        self.latencies.append(latency)
+
+    def to_dict(self) -> Dict[str, Optional[float]]:
+        # percentiles and max of the window
+        latencies = sorted(self.latencies)
+        return {
+            'latency_p50': percentile(latencies, 0.5),
+            'latency_p99': percentile(latencies, 0.99),
+            'latency_max': latencies[-1] if latencies else None,
+        }
@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import mmap
+import time
+import logging
+
+from pathlib import Path
+from bisect import bisect_left
+from datetime import datetime
+from argparse import ArgumentParser
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from arb_logger.logger import JsonFileHandler, get_log_index_path
+
+# Query the json log files written with get_logger(json_file=True)
+# records are appended in time order: the sidecar index narrows the range
+# to INDEX_INTERVAL bytes, then the mapped file is binary searched line by line
+
+Index = List[Tuple[float, int]]
+
+
+def read_index(log_path: str, size: int) -> Index:
+    index_path = get_log_index_path(log_path)
+    if not os.path.exists(index_path):
+        return []
+    index = []
+    with open(index_path) as f:
+        for line in f:
+            created, offset = line.split()
+            # an index entry past the end of the file is stale
+            if int(offset) < size:
+                index.append((float(created), int(offset)))
+    index.sort(key=lambda entry: entry[1])
+    return index
+
+
+def _line_start(mm: mmap.mmap, pos: int) -> int:
+    # start of the first line at or after pos
+    if pos == 0:
+        return 0
+    newline = mm.find(b'\n', pos - 1)
+    return len(mm) if newline == -1 else newline + 1
+
+
+def _line_created(mm: mmap.mmap, pos: int) -> Optional[float]:
+    end = mm.find(b'\n', pos)
+    try:
+        return json.loads(mm[pos:len(mm) if end == -1 else end])['created']
+    except (ValueError, KeyError):
+        # line being written
+        return None
+
+
+def seek_time(mm: mmap.mmap, start: float, lo: int = 0,
+              hi: Optional[int] = None) -> int:
+    # Offset of the first line starting in [lo, hi) created at or after start
+    # lo must be a line start, every line before lo is older than start
+    hi = len(mm) if hi is None else hi
+    while lo < hi:
+        mid = (lo + hi) // 2
+        pos = _line_start(mm, mid)
+        if pos >= hi:
+            hi = mid
+            continue
+        created = _line_created(mm, pos)
+        if created is not None and created < start:
+            lo = _line_start(mm, pos + 1)
+        else:
+            hi = pos
+    return lo
+
+
+def find_start(mm: mmap.mmap, index: Index, start: float) -> int:
+    if not index:
+        return seek_time(mm, start)
+    i = bisect_left([created for created, _ in index], start)
+    lo = index[i - 1][1] if i > 0 else 0
+    hi = index[i][1] if i < len(index) else len(mm)
+    return seek_time(mm, start, lo, hi)
+
+
+def file_time_range(mm: mmap.mmap) -> Tuple[Optional[float], Optional[float]]:
+    last_start = mm.rfind(b'\n', 0, len(mm) - 1) + 1
+    return _line_created(mm, 0), _line_created(mm, last_start)
+
+
+def get_log_files(paths: List[Path]) -> List[str]:
+    log_files = []
+    suffix = f'.{JsonFileHandler.EXTENSION}'
+    for path in paths:
+        if path.is_dir():
+            log_files.extend(
+                str(p) for p in path.iterdir()
+                if p.is_file() and (p.name.endswith(suffix) or
+                                    f'{suffix}.' in p.name))
+        else:
+            log_files.append(str(path))
+    return log_files
+
+
+def match_record(record: Dict[str, Any], levelno: int,
+                 names: List[str], field_filters: Dict[str, str]) -> bool:
+    if record.get('levelno', 0) < levelno:
+        return False
+    if names:
+        name = record.get('name', '')
+        if not any(name == n or name.startswith(f'{n}.') for n in names):
+            return False
+    for key, value in field_filters.items():
+        if str(record.get(key)) != value:
+            return False
+    return True
+
+
+def query_file(log_path: str,
+               start: Optional[float] = None,
+               end: Optional[float] = None,
+               levelno: int = 0,
+               names: Optional[List[str]] = None,
+               field_filters: Optional[Dict[str, str]] = None
+               ) -> Iterator[Dict[str, Any]]:
+    names = names or []
+    field_filters = field_filters or {}
+    with open(log_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            first, last = file_time_range(mm)
+            if start is not None and last is not None and last < start:
+                return
+            if end is not None and first is not None and first > end:
+                return
+
+            pos = 0
+            if start is not None:
+                pos = find_start(mm, read_index(log_path, len(mm)), start)
+
+            size = len(mm)
+            while pos < size:
+                newline = mm.find(b'\n', pos)
+                if newline == -1:
+                    # line being written
+                    return
+                line = mm[pos:newline]
+                pos = newline + 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                created = record.get('created', 0)
+                if end is not None and created > end:
+                    return
+                if start is not None and created < start:
+                    continue
+                if match_record(record, levelno, names, field_filters):
+                    yield record
+
+
+def query(log_files: List[str], **kwargs) -> Iterator[Dict[str, Any]]:
+    for log_path in sorted(log_files, key=_first_created):
+        yield from query_file(log_path, **kwargs)
+
+
+def _first_created(log_path: str) -> float:
+    with open(log_path, 'rb') as f:
+        line = f.readline()
+    try:
+        return json.loads(line)['created']
+    except (ValueError, KeyError):
+        return float('inf')
+
+
+def format_record(record: Dict[str, Any]) -> str:
+    created = record.get('created', 0)
+    asctime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))
+    line = (f"{asctime},{int(created % 1 * 1000):03d} "
+            f"[{record.get('levelname')}] {record.get('name')} - "
+            f"{record.get('message', record.get('msg'))} - "
+            f"({record.get('filename')}:{record.get('lineno')})")
+    if record.get('exc_text'):
+        line = f"{line}\n{record['exc_text']}"
+    return line
+
+
+def parse_time(value: str) -> float:
+    # epoch seconds or iso datetime, local time when no timezone is given
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def parse_field(value: str) -> Tuple[str, str]:
+    key, sep, field_value = value.partition('=')
+    if not sep:
+        raise ValueError(f'Invalid field filter {value}, expected key=value')
+    return key, field_value
+
+
+def main():
+    parser = ArgumentParser(description='Query the json log files')
+    parser.add_argument('paths',
+                        nargs='*',
+                        type=Path,
+                        help='Log files or directories, defaults to '
+                        '$ARB_LOGS_PATH or logs')
+    parser.add_argument('--since',
+                        type=parse_time,
+                        help='Epoch seconds or iso datetime (local time)')
+    parser.add_argument('--until',
+                        type=parse_time,
+                        help='Epoch seconds or iso datetime (local time)')
+    parser.add_argument('-l',
+                        '--level',
+                        default='NOTSET',
+                        help='Minimum level name')
+    parser.add_argument('-n',
+                        '--name',
+                        action='append',
+                        default=[],
+                        help='Logger name, its sub loggers are included')
+    parser.add_argument('-f',
+                        '--field',
+                        action='append',
+                        type=parse_field,
+                        default=[],
+                        help='key=value, match an extra field')
+    parser.add_argument('--json',
+                        action='store_true',
+                        help='Print the records as json lines')
+    args = parser.parse_args()
+
+    levelno = logging.getLevelName(args.level.upper())
+    if not isinstance(levelno, int):
+        parser.error(f'Unknown level {args.level}')
+
+    paths = args.paths or [Path(os.environ.get('ARB_LOGS_PATH', 'logs'))]
+    records = query(get_log_files(paths),
+                    start=args.since,
+                    end=args.until,
+                    levelno=levelno,
+                    names=args.name,
+                    field_filters=dict(args.field))
+    try:
+        for record in records:
+            if args.json:
+                print(json.dumps(record))
+            else:
+                print(format_record(record))
+    except BrokenPipeError:
+        # piped into head
+        sys.stderr.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,44 @@
 import os
 import sys
-import json
+import copy
 import time
-import inspect
 import logging
+import threading
+import weakref
 import traceback
 import logging.handlers
 
 from pathlib import Path
-from typing import Optional
 from dataclasses import fields
-from collections import defaultdict
+from collections import deque
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+from arb_logger.throttle import ThrottleCache
 from arb_logger.alert_message import AlertMessage
 
-import coloredlogs
+#? coloredlogs and redis are slow to import (~200ms), they are only imported
+#? when a logger handles its first record or a redis client is needed
+if TYPE_CHECKING:
+    from redis import Redis
+    from arb_logger.sampling import SamplingFilter
 
-from redis import Redis
 
+def __getattr__(name):
+    # keep arb_logger.logger.Redis available without importing redis eagerly
+    if name == 'Redis':
+        from redis import Redis
+        return Redis
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def get_redis_log_client() -> Optional['Redis']:
+    # Shared process-wide client, only pinged when it is created
+    from arb_logger.redis_connection import get_redis_client
 
-def get_redis_log_client() -> Optional[Redis]:
-    # Will be replaced by another Redis client prolly
     try:
-        redis_client = Redis(host='localhost',
-                             port=6379,
-                             db=0,
-                             decode_responses=True)
-        success = redis_client.ping()
+        redis_client = get_redis_client(ping=True)
     except Exception as e:
         raise Exception('Could not connect to Redis') from e
 
-    if not success:
-        raise Exception('Could not ping Redis')
-
     return redis_client
 
 
@@ -39,30 +46,134 @@ def get_redis_log_key(name: str):
     return f'logs:{name}'
 
 
+#! stream every record is added to when not sharded, read by grafana
+REDIS_LOG_STREAM = 'logs'
+# logs:<logger root name>
+SHARD_BY_LOGGER = 'logger'
+# logs:level:<levelname>
+SHARD_BY_LEVEL = 'level'
+
+
+def get_redis_log_stream(name: str,
+                         levelname: str,
+                         shard_by: Optional[str] = None) -> str:
+    if shard_by == SHARD_BY_LOGGER:
+        return get_redis_log_key(name.split('.')[0])
+    if shard_by == SHARD_BY_LEVEL:
+        return get_redis_log_key(f'level:{levelname}')
+    return REDIS_LOG_STREAM
+
+
+# Handlers reinitialised around fork, see _before_fork/_after_fork_in_child
+_fork_aware_handlers: 'weakref.WeakSet[logging.Handler]' = weakref.WeakSet()
+
+
+def _before_fork():
+    for handler in list(_fork_aware_handlers):
+        handler.before_fork()
+
+
+def _after_fork_in_child():
+    # handlers locks are already reinitialised by the logging module
+    for handler in list(_fork_aware_handlers):
+        handler.after_fork_in_child()
+
+
+os.register_at_fork(before=_before_fork, after_in_child=_after_fork_in_child)
+
+
 class RedisHandler(logging.Handler):
     THROTTLE_TIME = 60
-
-    def __init__(self, redis_client, redis_key):
+    # maximum number of distinct messages tracked by the throttle
+    THROTTLE_CAPACITY = 1024
+    # streams are trimmed on write (approximately) to keep redis memory bounded
+    # stays below arb_sysload RedisLogsCheck threshold
+    STREAM_MAXLEN = 20000
+
+    def __init__(self,
+                 redis_client,
+                 redis_key,
+                 stream_maxlen: Optional[int] = None,
+                 stream_ttl: Optional[float] = None,
+                 shard_by: Optional[str] = None):
         super().__init__()
-        self.redis_client: Redis = redis_client
+        if shard_by not in (None, SHARD_BY_LOGGER, SHARD_BY_LEVEL):
+            raise ValueError(f'Unknown shard_by: {shard_by}')
+
+        self.redis_client: 'Redis' = redis_client
         self.redis_key = redis_key
 
+        # stream_maxlen=0 disables the trimming
+        # stream_ttl (seconds) trims by MINID instead of MAXLEN
+        self.stream_maxlen = (self.STREAM_MAXLEN
+                              if stream_maxlen is None else stream_maxlen)
+        self.stream_ttl = stream_ttl
+        self.shard_by = shard_by
+
         self.alert_fields = {f.name for f in fields(AlertMessage)}
 
-        self.last_message_ts = defaultdict(int)
+        self.throttle_cache = ThrottleCache(self.THROTTLE_TIME,
+                                            self.THROTTLE_CAPACITY,
+                                            on_close=self._send_suppressed)
+        self.throttle_checks = 0
+        self.throttled = 0
+        _fork_aware_handlers.add(self)
+
+    def before_fork(self):
+        pass
+
+    def after_fork_in_child(self):
+        # suppressed counts are reported by the parent
+        self.throttle_cache = ThrottleCache(self.THROTTLE_TIME,
+                                            self.THROTTLE_CAPACITY,
+                                            on_close=self._send_suppressed)
+        self.throttle_checks = 0
+        self.throttled = 0
+        # the connections belong to the parent, the child opens its own
+        pool = getattr(self.redis_client, 'connection_pool', None)
+        if pool is not None:
+            pool.reset()
 
     def _throttle(self, record: logging.LogRecord):
-        # Throttle alerts
-        msg_hash = hash(record.msg)
-        curr_time = int(time.time())
-
-        throttle = False
-        if (prev_time := self.last_message_ts.get(
-                msg_hash, 0)) and curr_time - prev_time < self.THROTTLE_TIME:
-            throttle = True
-
-        self.last_message_ts[msg_hash] = curr_time
-        return throttle
+        # Throttle alerts, msg is still the template when args are used
+        # so the key doesnt depend on the interpolated values
+        self.throttle_checks += 1
+        throttled = self.throttle_cache.check((record.name, str(record.msg)),
+                                              record)
+        if throttled:
+            self.throttled += 1
+        return throttled
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'throttle_checks': self.throttle_checks,
+            'throttled': self.throttled,
+            'throttle_hit_rate': (self.throttled / self.throttle_checks
+                                  if self.throttle_checks else None),
+            'throttle_windows': len(self.throttle_cache),
+        }
+
+    def expire_throttle(self, expire_all: bool = False):
+        # Report the suppressed counts of the closed throttle windows
+        self.acquire()
+        try:
+            if expire_all:
+                self.throttle_cache.clear()
+            else:
+                self.throttle_cache.expire()
+        finally:
+            self.release()
+
+    def _send_suppressed(self, record: logging.LogRecord, count: int):
+        summary = logging.makeLogRecord(record.__dict__)
+        summary.msg = f'Suppressed {count} similar messages: {record.getMessage()}'
+        summary.args = None
+        summary.created = time.time()
+        summary.suppressed = count
+        try:
+            self._send_record(summary)
+        except Exception:
+            self.handleError(summary)
 
     def emit(self, record: logging.LogRecord):
         try:
@@ -71,16 +182,172 @@ class RedisHandler(logging.Handler):
             if self._throttle(record):
                 return
 
-            record_dict = AlertMessage.log_record_to_dict(record)
-            #! split : to get the stream name being 'logs' for grafana
-            self.redis_client.xadd(self.redis_key.split(':')[0], record_dict)
-            self.redis_client.publish(self.redis_key,
-                                      json.dumps(record_dict,
-                                                 separators=(',', ':'),
-                                                 default=str))  # Add this line
+            self._send_record(record)
         except Exception:
             self.handleError(record)
 
+    def _send_record(self, record: logging.LogRecord):
+        record_dict, payload = AlertMessage.log_record_to_json(record)
+        self._write(self.redis_client, record_dict, payload)
+
+    def close(self):
+        self.expire_throttle(expire_all=True)
+        super().close()
+
+    def _get_trim_args(self):
+        if self.stream_ttl:
+            # stream ids are the insertion time in ms
+            minid = int((time.time() - self.stream_ttl) * 1000)
+            return {'minid': minid, 'approximate': True}
+        if self.stream_maxlen:
+            return {'maxlen': self.stream_maxlen, 'approximate': True}
+        return {}
+
+    def _write(self, redis_client: 'Redis', record_dict, payload: str):
+        # redis_client can be a pipeline, commands are then sent on execute
+        stream = get_redis_log_stream(record_dict['name'],
+                                      record_dict['levelname'], self.shard_by)
+        redis_client.xadd(stream, record_dict, **self._get_trim_args())
+        redis_client.publish(self.redis_key, payload)
+
+
+DROP_OLDEST = 'oldest'
+DROP_NEWEST = 'newest'
+
+_exc_formatter = logging.Formatter()
+
+
+def _prepare_record(record: logging.LogRecord) -> logging.LogRecord:
+    # Copy of the record for the handlers writing it later from a background
+    # thread, the message is interpolated and the exception formatted now,
+    # while args still hold the values they had when the record was logged
+    record = copy.copy(record)
+    record.message = record.getMessage()
+    if record.exc_info and not record.exc_text:
+        record.exc_text = _exc_formatter.formatException(record.exc_info)
+    record.args = None
+    record.exc_info = None
+    return record
+
+
+class AsyncRedisHandler(RedisHandler):
+    # emit only queues the record, a background thread sends them to redis
+    # in batches so a slow redis never stalls the logging thread
+    BATCH_SIZE = 100
+    FLUSH_INTERVAL = 0.5
+    MAX_QUEUE_SIZE = 10000
+
+    def __init__(self,
+                 redis_client,
+                 redis_key,
+                 batch_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None,
+                 max_queue_size: Optional[int] = None,
+                 drop_policy: str = DROP_OLDEST,
+                 **kwargs):
+        super().__init__(redis_client, redis_key, **kwargs)
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f'Unknown drop policy: {drop_policy}')
+
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.flush_interval = flush_interval or self.FLUSH_INTERVAL
+        self.max_queue_size = max_queue_size or self.MAX_QUEUE_SIZE
+        self.drop_policy = drop_policy
+
+        self._start()
+
+    def _start(self):
+        self.queue: deque = deque()
+        self.dropped = 0
+        self.flushed = 0
+
+        self._closed = False
+        self._cond = threading.Condition()
+        # only one thread sends at a time to keep records in order
+        self._send_lock = threading.Lock()
+        self._flusher = threading.Thread(
+            target=self._flusher_loop,
+            name=f'AsyncRedisHandler-{self.redis_key}',
+            daemon=True)
+        self._flusher.start()
+
+    def after_fork_in_child(self):
+        # the flusher thread doesnt exist in the child and the queued
+        # records are sent by the parent
+        super().after_fork_in_child()
+        if not self._closed:
+            self._start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The record is serialized later by the flusher thread
+        return _prepare_record(record)
+
+    def _send_record(self, record: logging.LogRecord):
+        record = self.prepare(record)
+        with self._cond:
+            if len(self.queue) >= self.max_queue_size:
+                self.dropped += 1
+                if self.drop_policy == DROP_NEWEST:
+                    return
+                self.queue.popleft()
+            self.queue.append(record)
+            if len(self.queue) >= self.batch_size:
+                self._cond.notify()
+
+    def _pop_batch(self) -> List[logging.LogRecord]:
+        with self._cond:
+            count = min(self.batch_size, len(self.queue))
+            return [self.queue.popleft() for _ in range(count)]
+
+    def _send(self):
+        with self._send_lock:
+            while batch := self._pop_batch():
+                try:
+                    pipe = self.redis_client.pipeline(transaction=False)
+                    for record in batch:
+                        record_dict, payload = AlertMessage.log_record_to_json(
+                            record)
+                        self._write(pipe, record_dict, payload)
+                    pipe.execute()
+                    self.flushed += len(batch)
+                except Exception:
+                    self.dropped += len(batch)
+                    self.handleError(batch[0])
+
+    def _flusher_loop(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self.queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            if not closed:
+                self.expire_throttle()
+            self._send()
+            if closed:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            'queue_depth': len(self.queue),
+            'dropped': self.dropped,
+            'flushed': self.flushed,
+        }
+
+    def flush(self):
+        self._send()
+
+    def close(self):
+        self.expire_throttle(expire_all=True)
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._flusher.is_alive():
+            self._flusher.join()
+        # records queued by a racing emit after the flusher exited
+        self._send()
+        super().close()
+
 
 STDOUT_LEVEL_NUM = 25
 logging.addLevelName(STDOUT_LEVEL_NUM, 'STDOUT')
@@ -111,10 +378,330 @@ class LoggerStdout:
         return self.stdout.isatty()
 
 
-def get_logger_name():
-    # Get the name of the calling module
-    name = inspect.getmodule(
-        inspect.currentframe().f_back).__name__  # type: ignore
+def get_log_filename(rootname: str, short: bool, extension: str = 'log') -> str:
+    if short:
+        return f'{rootname}.{extension}'
+    return f'{rootname}.{os.getpid()}.{extension}'
+
+
+class ArbFileHandler(logging.handlers.TimedRotatingFileHandler):
+    # Reopened in forked children, in a new <rootname>.<pid>.log file
+    # unless short
+    EXTENSION = 'log'
+
+    def __init__(self, log_dir: Path, rootname: str, short: bool, **kwargs):
+        self.log_dir = log_dir
+        self.rootname = rootname
+        self.short = short
+        super().__init__(
+            log_dir / get_log_filename(rootname, short, self.EXTENSION),
+            **kwargs)
+        _fork_aware_handlers.add(self)
+
+    def before_fork(self):
+        # an unflushed buffer would be written by both processes
+        self.flush()
+
+    def after_fork_in_child(self):
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            # only closes the child's copy of the file descriptor
+            stream.close()
+        self.baseFilename = os.path.abspath(
+            self.log_dir /
+            get_log_filename(self.rootname, self.short, self.EXTENSION))
+        self.rolloverAt = self.computeRollover(int(time.time()))
+        # the file is opened on the next emit
+
+
+def compress_log_file(path: str):
+    # gzip a rotated log file, written under a temporary name first so an
+    # interrupted compression never leaves a truncated .gz
+    import gzip
+    import shutil
+
+    tmp_path = f'{path}.gz.tmp'
+    with open(path, 'rb') as f_in, gzip.open(tmp_path, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.replace(tmp_path, f'{path}.gz')
+    os.remove(path)
+
+
+class BufferedFileHandler(ArbFileHandler):
+    # Records are buffered in memory and written by a background thread,
+    # when BUFFER_SIZE records are buffered or every FLUSH_INTERVAL seconds
+    # records of FLUSH_LEVEL or above are written right away with the
+    # buffered ones, so the context of an error is never lost
+    # rollover (and compression) only happens in the writer
+    BUFFER_SIZE = 1000
+    FLUSH_INTERVAL = 1
+    FLUSH_LEVEL = logging.ERROR
+
+    def __init__(self,
+                 log_dir: Path,
+                 rootname: str,
+                 short: bool,
+                 buffer_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None,
+                 compress: bool = True,
+                 **kwargs):
+        self.buffer_size = buffer_size or self.BUFFER_SIZE
+        self.flush_interval = flush_interval or self.FLUSH_INTERVAL
+        self.compress = compress
+        super().__init__(log_dir, rootname, short, delay=True, **kwargs)
+        self._start()
+
+    def _start(self):
+        self.buffer: List[logging.LogRecord] = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._writer = threading.Thread(
+            target=self._writer_loop,
+            name=f'BufferedFileHandler-{self.rootname}',
+            daemon=True)
+        self._writer.start()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            # The record is formatted later by the writer thread
+            record = _prepare_record(record)
+            # args are cleared, format the interpolated message
+            record.msg = record.message
+        except Exception:
+            self.handleError(record)
+            return
+        with self._cond:
+            self.buffer.append(record)
+            if len(self.buffer) >= self.buffer_size:
+                self._cond.notify()
+        if record.levelno >= self.FLUSH_LEVEL:
+            self._write_buffer()
+
+    def _write_buffer(self):
+        with self._write_lock:
+            with self._cond:
+                records, self.buffer = self.buffer, []
+            if not records:
+                return
+
+            try:
+                if self.shouldRollover(records[0]):
+                    self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+            except Exception:
+                self.handleError(records[0])
+                return
+
+            lines = []
+            for record in records:
+                try:
+                    lines.append(self.format(record) + self.terminator)
+                except Exception:
+                    self.handleError(record)
+            try:
+                self.stream.write(''.join(lines))
+                self.stream.flush()
+            except Exception:
+                self.handleError(records[0])
+
+    def _writer_loop(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self.buffer) < self.buffer_size:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            self._write_buffer()
+            if closed:
+                return
+
+    def rotate(self, source: str, dest: str):
+        super().rotate(source, dest)
+        if self.compress and os.path.exists(dest):
+            threading.Thread(target=compress_log_file,
+                             args=(dest, ),
+                             name=f'compress-{os.path.basename(dest)}',
+                             daemon=True).start()
+
+    def stats(self) -> Dict[str, Any]:
+        return {'queue_depth': len(self.buffer)}
+
+    def flush(self):
+        self._write_buffer()
+
+    def after_fork_in_child(self):
+        # the buffer was written before the fork, the writer thread
+        # doesnt exist in the child
+        super().after_fork_in_child()
+        if not self._closed:
+            self._start()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._writer.is_alive():
+            self._writer.join()
+        super().close()
+
+
+LOG_INDEX_DIR = '.index'
+
+
+def get_log_index_path(log_path: str) -> str:
+    # Sidecar index of a json log file, kept in a separate directory so
+    # the rotation never counts (nor deletes) it as a backup log file
+    log_dir, filename = os.path.split(log_path)
+    return os.path.join(log_dir, LOG_INDEX_DIR, f'{filename}.idx')
+
+
+class JsonFileHandler(ArbFileHandler):
+    # One json object per line with the AlertMessage fields, plus the
+    # formatted message and exception
+    # a sparse index of (created, byte offset) is kept every INDEX_INTERVAL
+    # bytes and appended to the sidecar index file at rollover and close
+    EXTENSION = 'jsonl'
+    INDEX_INTERVAL = 64 * 1024
+
+    def __init__(self,
+                 log_dir: Path,
+                 rootname: str,
+                 short: bool,
+                 index_interval: Optional[int] = None,
+                 **kwargs):
+        self.index_interval = index_interval or self.INDEX_INTERVAL
+        self.index: List[Tuple[float, int]] = []
+        self._unindexed = 0
+        super().__init__(log_dir, rootname, short, **kwargs)
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _exc_formatter.formatException(record.exc_info)
+        return AlertMessage.log_record_to_json(record)[1]
+
+    def _open(self):
+        stream = super()._open()
+        # index the first record written by this process
+        self._unindexed = self.index_interval
+        return stream
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+
+            line = self.format(record) + self.terminator
+            if self._unindexed >= self.index_interval:
+                #? tell is the end of the file in append mode, even when
+                #? other processes write to it (short=True)
+                self.index.append((record.created, self.stream.tell()))
+                self._unindexed = 0
+            self.stream.write(line)
+            self.stream.flush()
+            # ascii only json, one char is one byte
+            self._unindexed += len(line)
+        except Exception:
+            self.handleError(record)
+
+    def write_index(self, log_path: Optional[str] = None):
+        index, self.index = self.index, []
+        if not index:
+            return
+        index_path = get_log_index_path(log_path or self.baseFilename)
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(index_path, 'a') as f:
+            f.write(''.join(f'{created} {offset}\n'
+                            for created, offset in index))
+
+    def rotate(self, source: str, dest: str):
+        self.write_index(source)
+        super().rotate(source, dest)
+        source_index = get_log_index_path(source)
+        if os.path.exists(source_index):
+            os.replace(source_index, get_log_index_path(dest))
+
+    def doRollover(self):
+        super().doRollover()
+        # the indexes of the deleted backups
+        index_dir = os.path.join(os.path.dirname(self.baseFilename),
+                                 LOG_INDEX_DIR)
+        if not os.path.isdir(index_dir):
+            return
+        for filename in os.listdir(index_dir):
+            log_path = os.path.join(os.path.dirname(index_dir),
+                                    filename.removesuffix('.idx'))
+            if not os.path.exists(log_path):
+                os.remove(os.path.join(index_dir, filename))
+
+    def after_fork_in_child(self):
+        # the parent writes its own index
+        self.index = []
+        super().after_fork_in_child()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.write_index()
+        finally:
+            self.release()
+        super().close()
+
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(name)s - %(message)s - (%(filename)s:%(lineno)d)'
+
+
+class DeferredSetupHandler(logging.Handler):
+    # Placeholder handler, the logger handlers are only built (and coloredlogs
+    # imported, the log directory created...) when the first record is
+    # handled, so short-lived CLIs that barely log start fast
+
+    def __init__(self, logger: logging.Logger, setup: Callable[[], None]):
+        super().__init__()
+        self.logger = logger
+        self.setup = setup
+        self._setup_done = False
+        self._setup_lock = threading.Lock()
+
+    def handle(self, record: logging.LogRecord):
+        with self._setup_lock:
+            if not self._setup_done:
+                # new list, Logger.callHandlers is iterating over the old one
+                self.logger.handlers = []
+                try:
+                    self.setup()
+                except Exception:
+                    # e.g: the log directory can't be created, report it like
+                    # a failing handler instead of raising in the caller, the
+                    # handlers set up before the failure keep logging
+                    self.handleError(record)
+                    if not self.logger.handlers:
+                        self.logger.addHandler(self._get_fallback_handler())
+                finally:
+                    self._setup_done = True
+
+        for handler in self.logger.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+    def _get_fallback_handler(self) -> logging.Handler:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        return handler
+
+    def emit(self, record: logging.LogRecord):
+        pass
+
+
+def get_logger_name(depth: int = 2):
+    # Get the name of the module calling get_logger from its frame globals
+    # (depth 2: caller of the caller of get_logger_name)
+    name = sys._getframe(depth).f_globals.get('__name__')
     if name in ('__main__', '__init__', None):
         raise ValueError(
             'Please provide an explicit name for the logger when called from __main__ or __init__.'
@@ -130,59 +717,85 @@ def get_logger(
         log_in_file: bool = True,
         short: bool = False,
         redis_handler: bool = False,  # type: ignore
-        custom_redis_client: Optional[Redis] = None):
+        custom_redis_client: Optional['Redis'] = None,
+        redis_async: bool = False,
+        redis_shard_by: Optional[str] = None,
+        buffered: bool = False,
+        json_file: bool = False,
+        metrics: bool = False,
+        lazy: bool = True,
+        sampling: Optional['SamplingFilter'] = None):
 
     name = name or get_logger_name()
     logger = logging.getLogger(name)
 
+    if buffered and json_file:
+        raise ValueError('buffered and json_file cannot be used together')
+
     if not logger.hasHandlers():
         logger.setLevel(level)
         logger.propagate = False
-
-        # Set up the custom formatter
-        fmt = '%(asctime)s [%(levelname)s] %(name)s - %(message)s - (%(filename)s:%(lineno)d)'
-        formatter = logging.Formatter(fmt)
-
-        # Set up coloredlogs with the custom formatter
-        coloredlogs.install(level=level,
-                            logger=logger,
-                            fmt=fmt,
-                            milliseconds=True)
-
-        # Set up RedisHandler
-        #! DISABLE FOR NOW
-        if redis_handler and False:
-            redis_client = custom_redis_client or get_redis_log_client()
-            redis_key = get_redis_log_key(name)
-            redis_handler: logging.Handler = RedisHandler(
-                redis_client, redis_key)
-            redis_handler.setLevel(logging.ERROR)
-            redis_handler.setFormatter(formatter)
-            logger.addHandler(redis_handler)
-
-        # Set up FileHandler
-        if log_in_file:
-            log_dir = path or Path(os.environ.get('ARB_LOGS_PATH', 'logs'))
-            log_dir.mkdir(parents=True, exist_ok=True)
-
-            # Get the rootname of the calling module/logger name
-            # use it as the log filename to regroup multiple sublogger
-            # under the same file
-            _filename = name.split('.')[0]
-            if short:
-                filename = f'{_filename}.log'
-            else:
-                pid = os.getpid()
-                filename = f'{_filename}.{pid}.log'
-
-            file_handler = logging.handlers.TimedRotatingFileHandler(
-                log_dir / filename,
-                when='midnight',
-                interval=1,
-                backupCount=3,
-                utc=True)
-            file_handler.setFormatter(formatter)
-            logger.addHandler(file_handler)
+        if sampling is not None:
+            # Applied before any handler, only to the records of this logger
+            logger.addFilter(sampling)
+
+        def setup_handlers():
+            import coloredlogs
+
+            # Set up the custom formatter
+            formatter = logging.Formatter(LOG_FORMAT)
+
+            # Set up coloredlogs with the custom formatter
+            coloredlogs.install(level=level,
+                                logger=logger,
+                                fmt=LOG_FORMAT,
+                                milliseconds=True)
+
+            # Set up RedisHandler, only when the caller opts in
+            if redis_handler:
+                redis_client = (custom_redis_client
+                                or get_redis_log_client())
+                redis_key = get_redis_log_key(name)
+                handler_class = (AsyncRedisHandler
+                                 if redis_async else RedisHandler)
+                _redis_handler: logging.Handler = handler_class(
+                    redis_client, redis_key, shard_by=redis_shard_by)
+                _redis_handler.setLevel(logging.ERROR)
+                _redis_handler.setFormatter(formatter)
+                logger.addHandler(_redis_handler)
+
+            # Set up FileHandler
+            if log_in_file:
+                log_dir = path or Path(
+                    os.environ.get('ARB_LOGS_PATH', 'logs'))
+                log_dir.mkdir(parents=True, exist_ok=True)
+
+                # Get the rootname of the calling module/logger name
+                # use it as the log filename to regroup multiple sublogger
+                # under the same file
+                file_handler_class = ArbFileHandler
+                if buffered:
+                    file_handler_class = BufferedFileHandler
+                elif json_file:
+                    file_handler_class = JsonFileHandler
+                file_handler = file_handler_class(log_dir,
+                                                  name.split('.')[0],
+                                                  short,
+                                                  when='midnight',
+                                                  interval=1,
+                                                  backupCount=3,
+                                                  utc=True)
+                file_handler.setFormatter(formatter)
+                logger.addHandler(file_handler)
+
+            if metrics:
+                from arb_logger.handler_metrics import instrument_logger
+                instrument_logger(logger)
+
+        if lazy:
+            logger.addHandler(DeferredSetupHandler(logger, setup_handlers))
+        else:
+            setup_handlers()
 
         # Log uncaught exceptions using sys.excepthook
         def log_uncaught_exceptions(exc_type, exc_value, exc_traceback):
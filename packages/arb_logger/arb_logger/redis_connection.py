@@ -0,0 +1,163 @@
+import os
+import time
+import threading
+
+from typing import Any, Dict, Optional, Tuple
+
+from redis import Redis
+from redis.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.connection import (Connection, ConnectionPool,
+                              UnixDomainSocketConnection)
+
+from arb_logger.latency import LatencyWindow
+
+# Shared redis clients, one connection pool per (host, port, db, socket)
+# for the whole process, used by every arb package
+# ARB_REDIS_SOCKET makes every default client use this unix socket
+
+DEFAULT_HOST = 'localhost'
+DEFAULT_PORT = 6379
+
+# reconnect with exponential backoff, from 10ms up to 1s between retries
+RETRIES = 5
+BACKOFF_BASE = 0.01
+BACKOFF_CAP = 1
+
+
+class RedisMetrics:
+    # percentiles of the last commands, average and max of all of them
+
+    def __init__(self):
+        self.commands = 0
+        self.latency_total = 0.
+        self.latency_max = 0.
+        self.latency = LatencyWindow()
+
+    def add_latency(self, latency: float):
+        self.commands += 1
+        self.latency_total += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+        self.latency.add(latency)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'commands': self.commands,
+            'latency_avg':
+            self.latency_total / self.commands if self.commands else None,
+            **self.latency.to_dict(),
+            'latency_max': self.latency_max if self.commands else None,
+        }
+
+
+_metrics = RedisMetrics()
+
+
+class _TimedConnectionMixin:
+    # Round trip latency: from the command sent to its first response read
+    # a pipeline counts as a single round trip
+    _sent_at: Optional[float] = None
+
+    def send_packed_command(self, *args, **kwargs):
+        self._sent_at = time.perf_counter()
+        return super().send_packed_command(*args, **kwargs)
+
+    def read_response(self, *args, **kwargs):
+        response = super().read_response(*args, **kwargs)
+        if self._sent_at is not None:
+            _metrics.add_latency(time.perf_counter() - self._sent_at)
+            self._sent_at = None
+        return response
+
+
+class TimedConnection(_TimedConnectionMixin, Connection):
+    pass
+
+
+class TimedUnixDomainSocketConnection(_TimedConnectionMixin,
+                                      UnixDomainSocketConnection):
+    pass
+
+
+ClientKey = Tuple[str, int, int, Optional[str], bool]
+
+_clients: Dict[ClientKey, Redis] = {}
+_lock = threading.Lock()
+
+
+def _make_pool(host: str, port: int, db: int, unix_socket_path: Optional[str],
+               decode_responses: bool) -> ConnectionPool:
+    kwargs = dict(
+        db=db,
+        decode_responses=decode_responses,
+        retry=Retry(ExponentialBackoff(cap=BACKOFF_CAP, base=BACKOFF_BASE),
+                    RETRIES),
+        retry_on_error=[ConnectionError, TimeoutError],
+    )
+    if unix_socket_path:
+        return ConnectionPool(
+            connection_class=TimedUnixDomainSocketConnection,
+            path=unix_socket_path,
+            **kwargs)
+    return ConnectionPool(connection_class=TimedConnection,
+                          host=host,
+                          port=port,
+                          **kwargs)
+
+
+def get_redis_client(host: Optional[str] = None,
+                     port: Optional[int] = None,
+                     db: int = 0,
+                     unix_socket_path: Optional[str] = None,
+                     decode_responses: bool = True,
+                     ping: bool = False) -> Redis:
+    # ping only checks the connection when the client is created
+    host = host or DEFAULT_HOST
+    port = int(port or DEFAULT_PORT)
+    unix_socket_path = unix_socket_path or os.environ.get('ARB_REDIS_SOCKET')
+    key = (host, port, db, unix_socket_path, decode_responses)
+
+    redis_client = _clients.get(key)
+    if redis_client is not None:
+        return redis_client
+
+    with _lock:
+        redis_client = _clients.get(key)
+        if redis_client is None:
+            pool = _make_pool(host, port, db, unix_socket_path,
+                              decode_responses)
+            redis_client = Redis(connection_pool=pool)
+            if ping:
+                redis_client.ping()
+            _clients[key] = redis_client
+    return redis_client
+
+
+def get_redis_metrics() -> Dict[str, Any]:
+    connections = {'created': 0, 'in_use': 0, 'available': 0}
+    for redis_client in list(_clients.values()):
+        pool = redis_client.connection_pool
+        connections['created'] += pool._created_connections
+        connections['in_use'] += len(pool._in_use_connections)
+        connections['available'] += len(pool._available_connections)
+    return {
+        'clients': len(_clients),
+        'connections': connections,
+        **_metrics.to_dict(),
+    }
+
+
+def reset_redis_clients():
+    # Forget the clients without closing their connections, they are shared
+    # with the parent process after a fork and closing them would shut
+    # down the parent's sockets
+    global _lock
+    _clients.clear()
+    # the lock may have been held by another thread at fork time
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_redis_clients)
@@ -0,0 +1,116 @@
+import random
+import logging
+
+from typing import Dict, Optional, Tuple
+
+# (rate in records per second, burst)
+Rate = Tuple[float, float]
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'last')
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.last: Optional[float] = None
+
+    def take(self, now: float) -> bool:
+        # No lock, concurrent threads can at worst let a few more records
+        # through, which is fine for logs
+        tokens = self.tokens
+        if self.last is not None:
+            tokens = min(self.burst, tokens + (now - self.last) * self.rate)
+        self.last = now
+        if tokens >= 1:
+            self.tokens = tokens - 1
+            return True
+        self.tokens = tokens
+        return False
+
+
+class SamplingFilter(logging.Filter):
+    # Logger filter limiting the records of a hot loop:
+    # - level_rates: token bucket per level {logging.WARNING: (10, 50)}
+    # - sample_rates: probability to keep a record per level
+    #   {logging.DEBUG: 0.01}
+    # - callsite_rate: token bucket per filename:lineno (10, 50)
+    # each check is O(1), the record creation time is used as clock
+    # a summary of the sampled out records is logged every SUMMARY_INTERVAL
+    SUMMARY_INTERVAL = 60
+
+    def __init__(self,
+                 level_rates: Optional[Dict[int, Rate]] = None,
+                 sample_rates: Optional[Dict[int, float]] = None,
+                 callsite_rate: Optional[Rate] = None,
+                 summary_interval: Optional[float] = None):
+        super().__init__()
+        self.level_buckets = {
+            level: TokenBucket(*rate)
+            for level, rate in (level_rates or {}).items()
+        }
+        self.sample_rates = sample_rates or {}
+        self.callsite_rate = callsite_rate
+        self.callsite_buckets: Dict[Tuple[str, int], TokenBucket] = {}
+        self.summary_interval = summary_interval or self.SUMMARY_INTERVAL
+
+        # levelno -> number of records sampled out since the last summary
+        self.sampled_out: Dict[int, int] = {}
+        self._next_summary: Optional[float] = None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.__dict__.get('sampling_summary'):
+            return True
+
+        now = record.created
+        if self._next_summary is None:
+            self._next_summary = now + self.summary_interval
+        elif now >= self._next_summary:
+            self._next_summary = now + self.summary_interval
+            self._log_summary(record.name)
+
+        if self._keep(record, now):
+            return True
+        self.sampled_out[record.levelno] = self.sampled_out.get(
+            record.levelno, 0) + 1
+        return False
+
+    def _keep(self, record: logging.LogRecord, now: float) -> bool:
+        levelno = record.levelno
+
+        sample_rate = self.sample_rates.get(levelno)
+        if sample_rate is not None and random.random() >= sample_rate:
+            return False
+
+        bucket = self.level_buckets.get(levelno)
+        if bucket is not None and not bucket.take(now):
+            return False
+
+        if self.callsite_rate is not None:
+            callsite = (record.pathname, record.lineno)
+            bucket = self.callsite_buckets.get(callsite)
+            if bucket is None:
+                bucket = TokenBucket(*self.callsite_rate)
+                self.callsite_buckets[callsite] = bucket
+            if not bucket.take(now):
+                return False
+
+        return True
+
+    def _log_summary(self, name: str):
+        sampled_out, self.sampled_out = self.sampled_out, {}
+        if not sampled_out:
+            return
+
+        total = sum(sampled_out.values())
+        by_level = ', '.join(f'{logging.getLevelName(levelno)}: {count}'
+                             for levelno, count in sorted(sampled_out.items()))
+        logger = logging.getLogger(name)
+        summary = logger.makeRecord(
+            name, logging.WARNING, __file__, 0,
+            f'Sampled out {total} records in the last '
+            f'{self.summary_interval}s ({by_level})', None, None)
+        summary.sampling_summary = True
+        summary.sampled_out = total
+        logger.handle(summary)
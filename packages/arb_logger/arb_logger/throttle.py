@@ -0,0 +1,71 @@
+import time
+
+from logging import LogRecord
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+
+class ThrottleCache:
+    # Fixed capacity throttle windows
+    # entries are kept in window opening order, so the expired ones are always
+    # at the front and the oldest window is the one evicted when full
+    # every operation is O(1) (amortized for expire)
+
+    def __init__(self,
+                 window: float,
+                 capacity: int,
+                 on_close: Optional[Callable[[LogRecord, int], None]] = None):
+        self.window = window
+        self.capacity = capacity
+        # called with the last suppressed record and the suppressed count
+        # when a window with suppressed records is closed
+        self.on_close = on_close
+
+        # key -> [window opening time, suppressed count, last suppressed record]
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable):
+        return key in self._entries
+
+    def _close(self, entry):
+        _, count, record = entry
+        if count and self.on_close is not None:
+            self.on_close(record, count)
+
+    def expire(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry[0] < self.window:
+                break
+            del self._entries[key]
+            self._close(entry)
+
+    def check(self,
+              key: Hashable,
+              record: LogRecord,
+              now: Optional[float] = None) -> bool:
+        # Return True if the record has to be throttled
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[1] += 1
+            entry[2] = record
+            return True
+
+        if len(self._entries) >= self.capacity:
+            _, evicted = self._entries.popitem(last=False)
+            self._close(evicted)
+        self._entries[key] = [now, 0, None]
+        return False
+
+    def clear(self):
+        # Close every window, reporting their suppressed counts
+        while self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._close(entry)
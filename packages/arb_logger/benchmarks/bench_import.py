@@ -0,0 +1,54 @@
+import sys
+import time
+import tempfile
+import subprocess
+
+from argparse import ArgumentParser
+
+# What a short-lived CLI does: import arb_logger and create its logger
+CLI_STARTUP = """
+from pathlib import Path
+from arb_logger.logger import get_logger
+get_logger('bench_import', short=True, path=Path({path!r}))
+"""
+
+
+def run(code: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], check=True)
+    return time.perf_counter() - start
+
+
+def bench(code: str, number: int) -> float:
+    return min(run(code) for _ in range(number))
+
+
+def main():
+    parser = ArgumentParser(description='arb_logger import time benchmark')
+    parser.add_argument('-n',
+                        '--number',
+                        type=int,
+                        default=10,
+                        help='Number of runs, the fastest one is kept')
+    parser.add_argument('--max-ms',
+                        type=float,
+                        help='Exit with an error if the startup overhead '
+                        'is above this target')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        interpreter = bench('pass', args.number)
+        startup = bench(CLI_STARTUP.format(path=path), args.number)
+
+    overhead_ms = (startup - interpreter) * 1000
+    print(f'interpreter: {interpreter * 1000:.1f}ms')
+    print(f'import + get_logger: {startup * 1000:.1f}ms '
+          f'(+{overhead_ms:.1f}ms)')
+
+    if args.max_ms is not None and overhead_ms > args.max_ms:
+        print(f'above the {args.max_ms:.1f}ms target')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import json
+import timeit
+import logging
+
+from numbers import Number
+from argparse import ArgumentParser
+
+from arb_logger.alert_message import AlertMessage, LOG_RECORD_EXC_FIELDS
+
+
+def legacy_log_record_to_json(log_record: logging.LogRecord):
+    # Serialization as it was done before the fast path, kept as reference
+
+    def jsonify_value(value):
+        if isinstance(value, (str, Number)):
+            return value
+        return json.dumps(value, separators=(',', ':'), default=str)
+
+    record_dict = {
+        k: jsonify_value(v)
+        for k, v in log_record.__dict__.items()
+        if (k not in LOG_RECORD_EXC_FIELDS and not k.startswith('_')
+            and v is not None)
+    }
+    return record_dict, json.dumps(record_dict,
+                                   separators=(',', ':'),
+                                   default=str)
+
+
+def make_record():
+    record = logging.LogRecord('bench.strategy', logging.ERROR, __file__, 42,
+                               'Order rejected by exchange', None, None)
+    record.exchange = 'binance'
+    record.order = {'id': 123456, 'qty': 0.5, 'price': 27123.4}
+    return record
+
+
+def bench(func, record, number):
+    elapsed = min(timeit.repeat(lambda: func(record), number=number, repeat=5))
+    return number / elapsed
+
+
+def main():
+    parser = ArgumentParser(description='LogRecord serialization benchmark')
+    parser.add_argument('-n',
+                        '--number',
+                        type=int,
+                        default=100000,
+                        help='Number of records per run')
+    args = parser.parse_args()
+
+    record = make_record()
+    before = bench(legacy_log_record_to_json, record, args.number)
+    after = bench(AlertMessage.log_record_to_json, record, args.number)
+
+    print(f'before: {before:,.0f} records/s')
+    print(f'after:  {after:,.0f} records/s ({after / before:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import sys
+import json
+import time
+import logging
+import platform
+import tempfile
+import threading
+
+from pathlib import Path
+from argparse import ArgumentParser
+from typing import Any, Callable, Dict, List, NamedTuple
+
+from arb_logger.logger import (get_logger, get_redis_log_key, RedisHandler,
+                               AsyncRedisHandler)
+from arb_logger.latency import percentile
+
+# Records/s and latency of a log call for the usual get_logger configurations
+# the console handler is removed unless --console, the terminal would be
+# the bottleneck
+# the file configurations log INFO records, an ERROR would be written right
+# away by the BufferedFileHandler (FLUSH_LEVEL), the redis ones log ERROR
+# records, the level of the redis handlers in get_logger
+
+
+class BenchConfig(NamedTuple):
+    name: str
+    logger_kwargs: Dict[str, Any]
+    # None, RedisHandler or AsyncRedisHandler added to the logger
+    redis_handler: Any
+    log: Callable[[logging.Logger, int, int], None]
+    level: int = logging.INFO
+
+
+def log_unique(logger: logging.Logger, level: int, i: int):
+    logger.log(level, f'Order {i} rejected by exchange')
+
+
+def log_duplicate(logger: logging.Logger, level: int, i: int):
+    # same template, throttled by the redis handlers
+    logger.log(level, 'Order %s rejected by exchange', i)
+
+
+def log_extra(logger: logging.Logger, level: int, i: int):
+    logger.log(level,
+               f'Order {i} rejected by exchange',
+               extra={
+                   'exchange': 'binance',
+                   'order_id': i,
+                   'order': {
+                       'qty': 0.5,
+                       'price': 27123.4
+                   },
+               })
+
+
+CONFIGS = [
+    BenchConfig('file_short', {'short': True}, None, log_unique),
+    BenchConfig('file_pid', {'short': False}, None, log_unique),
+    BenchConfig('file_buffered', {'buffered': True}, None, log_unique),
+    BenchConfig('file_json', {'json_file': True}, None, log_unique),
+    BenchConfig('redis', {'log_in_file': False}, RedisHandler, log_unique,
+                logging.ERROR),
+    BenchConfig('redis_async', {'log_in_file': False}, AsyncRedisHandler,
+                log_unique, logging.ERROR),
+    BenchConfig('redis_throttled', {'log_in_file': False}, RedisHandler,
+                log_duplicate, logging.ERROR),
+    BenchConfig('extra_fields', {}, RedisHandler, log_extra, logging.ERROR),
+]
+
+
+def get_redis_client(redis_url):
+    if redis_url:
+        from redis import Redis
+        return Redis.from_url(redis_url, decode_responses=True)
+    from fakeredis import FakeRedis
+    return FakeRedis(decode_responses=True)
+
+
+def setup_logger(config: BenchConfig, name: str, path: Path, redis_client,
+                 console: bool) -> logging.Logger:
+    logger = get_logger(name, path=path, lazy=False, **config.logger_kwargs)
+    if not console:
+        for handler in list(logger.handlers):
+            if not isinstance(handler, logging.FileHandler):
+                logger.removeHandler(handler)
+    if config.redis_handler is not None:
+        redis_handler = config.redis_handler(redis_client,
+                                             get_redis_log_key(name))
+        redis_handler.setLevel(logging.ERROR)
+        logger.addHandler(redis_handler)
+    return logger
+
+
+def run(config: BenchConfig, threads: int, number: int, path: Path,
+        redis_client, console: bool) -> Dict[str, Any]:
+    name = f'bench_{config.name}_{threads}'
+    logger = setup_logger(config, name, path, redis_client, console)
+    per_thread = number // threads
+    latencies: List[List[float]] = [[] for _ in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def produce(thread_latencies: List[float]):
+        log = config.log
+        level = config.level
+        perf_counter = time.perf_counter
+        append = thread_latencies.append
+        barrier.wait()
+        for i in range(per_thread):
+            start = perf_counter()
+            log(logger, level, i)
+            append(perf_counter() - start)
+
+    producers = [
+        threading.Thread(target=produce, args=(thread_latencies, ))
+        for thread_latencies in latencies
+    ]
+    for producer in producers:
+        producer.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for producer in producers:
+        producer.join()
+    elapsed = time.perf_counter() - start
+
+    # time for the async and buffered handlers to write what they queued
+    drain_start = time.perf_counter()
+    for handler in list(logger.handlers):
+        handler.close()
+        logger.removeHandler(handler)
+    drain = time.perf_counter() - drain_start
+
+    all_latencies = sorted(l for thread in latencies for l in thread)
+    records = len(all_latencies)
+    return {
+        'config': config.name,
+        'threads': threads,
+        'records': records,
+        'records_per_s': records / elapsed,
+        'latency_p50_us': percentile(all_latencies, 0.5) * 1e6,
+        'latency_p99_us': percentile(all_latencies, 0.99) * 1e6,
+        'latency_max_us': all_latencies[-1] * 1e6,
+        'drain_s': drain,
+    }
+
+
+def main():
+    parser = ArgumentParser(description='arb_logger throughput benchmark')
+    parser.add_argument('-n',
+                        '--number',
+                        type=int,
+                        default=20000,
+                        help='Number of records per run')
+    parser.add_argument('-t',
+                        '--threads',
+                        type=int,
+                        nargs='+',
+                        default=[1, 4],
+                        help='Number of producer threads, one run per value')
+    parser.add_argument('-c',
+                        '--configs',
+                        nargs='+',
+                        choices=[config.name for config in CONFIGS],
+                        help='Configurations to run, defaults to all')
+    parser.add_argument('--redis-url',
+                        help='Benchmark against this redis, e.g. '
+                        'redis://localhost:6379/15, defaults to fakeredis')
+    parser.add_argument('--console',
+                        action='store_true',
+                        help='Keep the coloredlogs console handler')
+    parser.add_argument('--json',
+                        action='store_true',
+                        help='Print the results as json')
+    args = parser.parse_args()
+
+    configs = [
+        config for config in CONFIGS
+        if not args.configs or config.name in args.configs
+    ]
+    redis_client = get_redis_client(args.redis_url)
+
+    results = []
+    with tempfile.TemporaryDirectory() as path:
+        for config in configs:
+            for threads in args.threads:
+                result = run(config, threads, args.number, Path(path),
+                             redis_client, args.console)
+                results.append(result)
+                if not args.json:
+                    print(f"{result['config']:<16} {threads:>2} threads: "
+                          f"{result['records_per_s']:>10,.0f} records/s  "
+                          f"p50 {result['latency_p50_us']:>7.1f}us  "
+                          f"p99 {result['latency_p99_us']:>7.1f}us  "
+                          f"drain {result['drain_s'] * 1000:.1f}ms")
+
+    if args.json:
+        json.dump(
+            {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'redis': 'redis' if args.redis_url else 'fakeredis',
+                'number': args.number,
+                'results': results,
+            },
+            sys.stdout,
+            indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
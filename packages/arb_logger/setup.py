@@ -10,10 +10,12 @@ setup(
     long_description_content_type='text/markdown',
     version='2.2.1',
     packages=find_packages(),
+    python_requires='>=3.10',
     install_requires=['coloredlogs', 'redis', 'pync'],
     entry_points={
         'console_scripts': [
             'arb_alerts = arb_logger.arb_alerts:main',
+            'arb_logs = arb_logger.log_query:main',
         ]
     },
 )
@@ -1,5 +1,10 @@
+import os
+import gzip
 import json
+import sys
 import shutil
+import datetime
+import threading
 import logging
 
 from pathlib import Path
@@ -9,8 +14,22 @@ from unittest import TestCase, mock
 from redis import Redis
 from fakeredis import FakeRedis
 
-from arb_logger.alert_message import AlertMessage
-from arb_logger.logger import get_logger, RedisHandler, get_redis_log_key
+from arb_logger.arb_alerts import ArbAlerts
+from arb_logger.alert_sinks import AlertSink, SinkDispatcher
+from arb_logger.alert_aggregator import AlertAggregator
+from arb_logger import redis_connection
+from arb_logger.latency import LatencyWindow
+from arb_logger.throttle import ThrottleCache
+from arb_logger.sampling import SamplingFilter, TokenBucket
+from arb_logger.alert_message import (AlertMessage, LOG_RECORD_EXC_FIELDS,
+                                      encode_json)
+from arb_logger import log_query
+from arb_logger import handler_metrics
+from arb_logger.logger import (get_logger, RedisHandler, AsyncRedisHandler,
+                               BufferedFileHandler, DeferredSetupHandler,
+                               JsonFileHandler,
+                               get_redis_log_key, DROP_NEWEST, SHARD_BY_LEVEL,
+                               SHARD_BY_LOGGER)
 
 
 class TestAlertMessage(TestCase):
@@ -31,6 +50,62 @@ class TestAlertMessage(TestCase):
         self.assertEqual(log_message.msg, "test message")
         self.assertEqual(log_message.extra["extra_data"], "extra_value")
 
+    @staticmethod
+    def _dumps(value):
+        return json.dumps(value, separators=(',', ':'), default=str)
+
+    def test_encode_json(self):
+        values = [
+            "plain",
+            "héllo ✓ 日本 😀 \"quoted\" \n\t\x00",
+            42,
+            -1.5,
+            True,
+            None,
+            [1, [2, [3, {"a": (4, 5)}]], {}],
+            {"nested": {"list": [1.0, None, False], "tuple": ()}},
+            {1: "int", 2.5: "float", True: "bool", None: "none"},
+            [float("nan"), float("inf"), float("-inf")],
+            {"obj": object.__new__(object), "path": Path("a/b")},
+            {"date": datetime.date(2024, 1, 2), "bytes": b"\xff", "set": {1}},
+            {"héllo": "wörld"},
+        ]
+        for value in values:
+            with self.subTest(value=value):
+                self.assertEqual(encode_json(value), self._dumps(value))
+
+    def test_encode_json_invalid_key(self):
+        with self.assertRaises(TypeError):
+            self._dumps({(1, 2): "tuple"})
+        with self.assertRaises(TypeError):
+            encode_json({(1, 2): "tuple"})
+
+    def test_log_record_to_json(self):
+        # Same stream entry and payload as the plain json.dumps serialization
+        record = logging.LogRecord("test_name", logging.ERROR, __file__, 42,
+                                   "message %s", ("é", ), None)
+        record.order = {"id": 1, "price": float("nan"), 2: ["日本"]}
+        record.exchange = "binance"
+        record.when = datetime.datetime(2024, 1, 2, 3, 4, 5)
+        record.flag = False
+        record.count = 3
+
+        def jsonify_value(value):
+            if isinstance(value, (str, int, float)):
+                return value
+            return self._dumps(value)
+
+        expected_dict = {
+            k: jsonify_value(v)
+            for k, v in record.__dict__.items()
+            if (k not in LOG_RECORD_EXC_FIELDS and not k.startswith('_')
+                and v is not None)
+        }
+        record_dict, payload = AlertMessage.log_record_to_json(record)
+        self.assertEqual(record_dict, expected_dict)
+        self.assertEqual(list(record_dict), list(expected_dict))
+        self.assertEqual(payload, self._dumps(expected_dict))
+
 
 class TestLogger(TestCase):
 
@@ -82,8 +157,55 @@ class TestLogger(TestCase):
         logger = get_logger(name="test_logger_3", path=self.custom_logs_path)
         self.assertIsInstance(logger, logging.Logger)
         self.assertEqual(logger.name, "test_logger_3")
+        # handlers are set up when the first record is handled
+        mock_mkdir.assert_not_called()
+        logger.info("Test message")
+        mock_mkdir.assert_called_once()
+
+    def test_deferred_setup(self):
+        logger = get_logger(name="test_logger_deferred",
+                            path=self.custom_logs_path)
+        self.assertEqual(len(logger.handlers), 1)
+        self.assertIsInstance(logger.handlers[0], DeferredSetupHandler)
+
+        logger.info("first message")
+        self.assertNotIn(DeferredSetupHandler,
+                         [type(h) for h in logger.handlers])
+        log_file = (self.custom_logs_path /
+                    f"test_logger_deferred.{os.getpid()}.log")
+        self.assertIn("first message", log_file.read_text())
+
+    @patch("arb_logger.logger.Path.mkdir", side_effect=PermissionError)
+    def test_deferred_setup_error(self, mock_mkdir):
+        logger = get_logger(name="test_logger_deferred_error",
+                            path=self.custom_logs_path)
+        with patch.object(DeferredSetupHandler,
+                          "handleError") as mock_handle_error:
+            # reported, not raised in the caller
+            logger.info("first message")
+        mock_handle_error.assert_called_once()
+        self.assertEqual(mock_handle_error.call_args.args[0].getMessage(),
+                         "first message")
+
+        # the console handler set up before the failure is kept
+        self.assertEqual(len(logger.handlers), 1)
+        self.assertNotIsInstance(logger.handlers[0], DeferredSetupHandler)
+        logger.info("second message")
         mock_mkdir.assert_called_once()
 
+    @patch("coloredlogs.install", side_effect=RuntimeError)
+    def test_deferred_setup_fallback(self, _):
+        logger = get_logger(name="test_logger_deferred_fallback",
+                            log_in_file=False)
+        with patch.object(DeferredSetupHandler, "handleError"):
+            logger.info("first message")
+        self.assertEqual(len(logger.handlers), 1)
+        self.assertIsInstance(logger.handlers[0], logging.StreamHandler)
+
+    def test_get_logger_name(self):
+        logger = get_logger(None, log_in_file=False)
+        self.assertEqual(logger.name, __name__)
+
     @patch("arb_logger.logger.logging.Logger._log")
     def test_stdout(self, mock_log):
         logger = get_logger("test_logger")
@@ -93,6 +215,280 @@ class TestLogger(TestCase):
         mock_log.assert_called_once_with(25, message, ())
 
 
+class TestLoggerFork(TestCase):
+
+    def setUp(self):
+        self.custom_logs_path = Path("custom_logs_fork")
+
+    def tearDown(self):
+        shutil.rmtree(self.custom_logs_path, ignore_errors=True)
+
+    def test_fork_reopens_file_handler(self):
+        logger = get_logger(name="test_logger_fork",
+                            path=self.custom_logs_path)
+        logger.info("parent message")
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                logger.info("child message")
+                for handler in logger.handlers:
+                    handler.flush()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        for handler in logger.handlers:
+            handler.flush()
+
+        parent_log = self.custom_logs_path / f"test_logger_fork.{os.getpid()}.log"
+        child_log = self.custom_logs_path / f"test_logger_fork.{pid}.log"
+        self.assertNotIn("child message", parent_log.read_text())
+        self.assertIn("child message", child_log.read_text())
+        self.assertNotIn("parent message", child_log.read_text())
+
+
+class TestBufferedFileHandler(TestCase):
+
+    def setUp(self):
+        self.custom_logs_path = Path("custom_logs_buffered")
+        self.custom_logs_path.mkdir(parents=True, exist_ok=True)
+        self.handler = BufferedFileHandler(self.custom_logs_path,
+                                           "test_buffered",
+                                           short=True,
+                                           flush_interval=60,
+                                           when='midnight')
+        self.log_file = Path(self.handler.baseFilename)
+
+    def tearDown(self):
+        self.handler.close()
+        shutil.rmtree(self.custom_logs_path)
+
+    def _record(self, msg, level=logging.DEBUG):
+        return logging.LogRecord("test_buffered", level, __file__, 1, msg,
+                                 None, None)
+
+    def test_flush_on_error(self):
+        self.handler.handle(self._record("debug message"))
+        self.assertFalse(self.log_file.exists())
+
+        self.handler.handle(self._record("error message", logging.ERROR))
+        lines = self.log_file.read_text().splitlines()
+        self.assertEqual(lines, ["debug message", "error message"])
+
+    def test_flush_on_close(self):
+        self.handler.handle(self._record("debug message"))
+        self.handler.close()
+        self.assertEqual(self.log_file.read_text(), "debug message\n")
+
+    def test_args_are_formatted_on_emit(self):
+        order = {"qty": 1}
+        record = logging.LogRecord("test_buffered", logging.DEBUG, __file__,
+                                   1, "order %s", (order, ), None)
+        self.handler.handle(record)
+        # mutated before the writer thread formats the record
+        order["qty"] = 999
+        self.handler.close()
+
+        self.assertEqual(self.log_file.read_text(), "order {'qty': 1}\n")
+        # the caller record is left untouched
+        self.assertIsNotNone(record.args)
+
+    def test_exception_is_formatted_on_emit(self):
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = logging.LogRecord("test_buffered", logging.DEBUG,
+                                       __file__, 1, "failed", None,
+                                       sys.exc_info())
+        self.handler.handle(record)
+        self.handler.close()
+
+        text = self.log_file.read_text()
+        self.assertTrue(text.startswith("failed\nTraceback"))
+        self.assertIn("ValueError: boom", text)
+
+    def test_rollover_is_compressed(self):
+        self.handler.handle(self._record("old message", logging.ERROR))
+        self.handler.rolloverAt = 0
+        self.handler.handle(self._record("new message", logging.ERROR))
+
+        for thread in threading.enumerate():
+            if thread.name.startswith("compress-"):
+                thread.join()
+
+        rotated = [
+            p for p in self.custom_logs_path.iterdir()
+            if p.name != self.log_file.name
+        ]
+        self.assertEqual(len(rotated), 1)
+        self.assertEqual(rotated[0].suffix, ".gz")
+        with gzip.open(rotated[0], "rt") as f:
+            self.assertEqual(f.read(), "old message\n")
+        self.assertEqual(self.log_file.read_text(), "new message\n")
+
+
+class TestJsonFileHandler(TestCase):
+
+    def setUp(self):
+        self.custom_logs_path = Path("custom_logs_json")
+        self.custom_logs_path.mkdir(parents=True, exist_ok=True)
+        self.handler = JsonFileHandler(self.custom_logs_path,
+                                       "test_json",
+                                       short=True,
+                                       index_interval=200,
+                                       when='midnight')
+        self.log_file = self.handler.baseFilename
+
+    def tearDown(self):
+        self.handler.close()
+        shutil.rmtree(self.custom_logs_path)
+
+    def _record(self, i, created, level=logging.INFO, name="test_json"):
+        record = logging.LogRecord(name, level, __file__, 1, "message %s",
+                                   (i, ), None)
+        record.created = created
+        record.order_id = f"order-{i}"
+        return record
+
+    def _write(self, count=100):
+        for i in range(count):
+            self.handler.handle(self._record(i, 1000. + i))
+
+    def test_json_lines(self):
+        self._write(2)
+        lines = Path(self.log_file).read_text().splitlines()
+        record = json.loads(lines[1])
+        self.assertEqual(record["message"], "message 1")
+        self.assertEqual(record["msg"], "message %s")
+        self.assertEqual(record["order_id"], "order-1")
+        self.assertEqual(record["created"], 1001.)
+
+    def test_index_written_on_close(self):
+        self._write()
+        self.handler.close()
+        index = log_query.read_index(self.log_file,
+                                     os.path.getsize(self.log_file))
+        self.assertGreater(len(index), 1)
+        self.assertEqual(index[0], (1000., 0))
+        with open(self.log_file, "rb") as f:
+            for created, offset in index:
+                f.seek(offset)
+                self.assertEqual(json.loads(f.readline())["created"], created)
+
+    def test_index_follows_rollover(self):
+        self._write(10)
+        self.handler.rolloverAt = 0
+        self.handler.handle(self._record(10, 1010.))
+
+        rotated = [
+            p for p in self.custom_logs_path.iterdir()
+            if p.is_file() and p.name != Path(self.log_file).name
+        ]
+        self.assertEqual(len(rotated), 1)
+        self.assertTrue(
+            os.path.exists(log_query.get_log_index_path(str(rotated[0]))))
+
+    def test_query_time_range(self):
+        self._write()
+        for with_index in (False, True):
+            if with_index:
+                self.handler.close()
+            records = list(
+                log_query.query_file(self.log_file, start=1010.5, end=1020))
+            self.assertEqual([r["created"] for r in records],
+                             [1000. + i for i in range(11, 21)])
+
+    def test_query_filters(self):
+        self.handler.handle(self._record(0, 1000., logging.DEBUG))
+        self.handler.handle(self._record(1, 1001., logging.ERROR))
+        self.handler.handle(self._record(2, 1002., name="test_json.sub"))
+        self.handler.handle(self._record(3, 1003., name="test_json_other"))
+
+        def query(**kwargs):
+            return [
+                r["order_id"] for r in log_query.query(
+                    log_query.get_log_files([self.custom_logs_path]),
+                    **kwargs)
+            ]
+
+        self.assertEqual(query(levelno=logging.ERROR), ["order-1"])
+        self.assertEqual(query(names=["test_json"]),
+                         ["order-0", "order-1", "order-2"])
+        self.assertEqual(query(field_filters={"order_id": "order-3"}),
+                         ["order-3"])
+
+
+class TestHandlerMetrics(TestCase):
+
+    def setUp(self):
+        self.custom_logs_path = Path("custom_logs_metrics")
+
+    def tearDown(self):
+        handler_metrics._handler_metrics.clear()
+        shutil.rmtree(self.custom_logs_path, ignore_errors=True)
+
+    def test_latency_histogram(self):
+        histogram = handler_metrics.LatencyHistogram()
+        for _ in range(99):
+            histogram.add(0.000003)
+        histogram.add(0.5)
+        self.assertEqual(histogram.count, 100)
+        # 3us falls in the [2, 4) us bucket
+        self.assertEqual(histogram.percentile(0.5), 0.000004)
+        self.assertEqual(histogram.percentile(1), 0.5)
+        self.assertEqual(histogram.to_dict()["latency_max"], 0.5)
+
+    def test_get_logger_metrics(self):
+        logger = get_logger("test_metrics",
+                            path=self.custom_logs_path,
+                            lazy=False,
+                            metrics=True)
+        for i in range(3):
+            logger.info(f"message {i}")
+
+        metrics = handler_metrics.get_logging_metrics()
+        self.assertEqual(metrics["test_metrics:file"]["count"], 3)
+        self.assertEqual(metrics["test_metrics:stream"]["count"], 3)
+        for handler in logger.handlers:
+            handler.close()
+
+    def test_redis_handler_stats(self):
+        handler = AsyncRedisHandler(FakeRedis(decode_responses=True),
+                                    get_redis_log_key("test_metrics"),
+                                    flush_interval=60)
+        handler_metrics.instrument_handler(handler, "test_metrics:redis")
+        record = logging.LogRecord("test_metrics", logging.ERROR, __file__, 1,
+                                   "message", None, None)
+        for _ in range(4):
+            handler.handle(record)
+
+        metrics = handler_metrics.get_logging_metrics()["test_metrics:redis"]
+        self.assertEqual(metrics["count"], 4)
+        self.assertEqual(metrics["throttled"], 3)
+        self.assertEqual(metrics["throttle_hit_rate"], 0.75)
+        self.assertEqual(metrics["queue_depth"], 1)
+        handler.close()
+
+    def test_publish(self):
+        redis_client = FakeRedis(decode_responses=True)
+        handler = logging.NullHandler()
+        handler_metrics.instrument_handler(handler, "test_metrics:null")
+        handler.handle(
+            logging.LogRecord("test_metrics", logging.INFO, __file__, 1,
+                              "message", None, None))
+
+        publisher = handler_metrics.MetricsPublisher(redis_client,
+                                                     interval=60)
+        publisher.publish()
+        publisher.stop()
+
+        published = redis_client.hget(handler_metrics.get_metrics_key(),
+                                      "test_metrics:null")
+        self.assertEqual(json.loads(published)["count"], 1)
+        self.assertGreater(redis_client.ttl(handler_metrics.get_metrics_key()),
+                           0)
+
+
 class TestRedisLogger(TestCase):
 
     def setUp(self):
@@ -147,3 +543,562 @@ class TestRedisLogger(TestCase):
 
         for key, value in extra.items():
             self.assertEqual(log_data[key], value)
+
+
+class TestAsyncRedisHandler(TestCase):
+
+    def setUp(self):
+        self.redis_client = FakeRedis(decode_responses=True)
+        self.redis_key = get_redis_log_key("test_async_logger")
+
+    def _record(self, msg):
+        return logging.LogRecord("test_async_logger", logging.ERROR, __file__,
+                                 1, msg, None, None)
+
+    def test_emit_is_flushed_in_batches(self):
+        handler = AsyncRedisHandler(self.redis_client,
+                                    self.redis_key,
+                                    batch_size=2,
+                                    flush_interval=0.01)
+        for i in range(5):
+            handler.emit(self._record(f"message {i}"))
+        handler.close()
+
+        messages = self.redis_client.xrange("logs")
+        self.assertEqual([m[1]["msg"] for m in messages],
+                         [f"message {i}" for i in range(5)])
+        self.assertEqual(handler.flushed, 5)
+        self.assertEqual(handler.dropped, 0)
+
+    def test_drop_oldest(self):
+        # flusher never wakes up before close
+        handler = AsyncRedisHandler(self.redis_client,
+                                    self.redis_key,
+                                    batch_size=10,
+                                    flush_interval=60,
+                                    max_queue_size=2)
+        for i in range(3):
+            handler.emit(self._record(f"message {i}"))
+        self.assertEqual(handler.dropped, 1)
+        handler.close()
+
+        messages = self.redis_client.xrange("logs")
+        self.assertEqual([m[1]["msg"] for m in messages],
+                         ["message 1", "message 2"])
+
+    def test_drop_newest(self):
+        handler = AsyncRedisHandler(self.redis_client,
+                                    self.redis_key,
+                                    batch_size=10,
+                                    flush_interval=60,
+                                    max_queue_size=2,
+                                    drop_policy=DROP_NEWEST)
+        for i in range(3):
+            handler.emit(self._record(f"message {i}"))
+        handler.close()
+
+        messages = self.redis_client.xrange("logs")
+        self.assertEqual([m[1]["msg"] for m in messages],
+                         ["message 0", "message 1"])
+        self.assertEqual(handler.dropped, 1)
+        self.assertEqual(handler.flushed, 2)
+
+    def test_args_are_formatted_on_emit(self):
+        handler = AsyncRedisHandler(self.redis_client,
+                                    self.redis_key,
+                                    batch_size=10,
+                                    flush_interval=60)
+        values = [1, 2]
+        record = logging.LogRecord("test_async_logger", logging.ERROR,
+                                   __file__, 1, "values %s", (values, ), None)
+        handler.emit(record)
+        # mutated before the flusher serializes the record
+        values.append(3)
+        handler.close()
+
+        messages = self.redis_client.xrange("logs")
+        self.assertEqual(messages[0][1]["message"], "values [1, 2]")
+        # the caller record is left untouched
+        self.assertEqual(record.args, (values, ))
+
+    def test_get_logger_redis_async(self):
+        logger = get_logger(name="test_async_logger",
+                            log_in_file=False,
+                            redis_handler=True,
+                            custom_redis_client=self.redis_client,
+                            redis_async=True,
+                            lazy=False)
+        handlers = [h for h in logger.handlers
+                    if isinstance(h, AsyncRedisHandler)]
+        self.assertEqual(len(handlers), 1)
+
+        logger.error("async message")
+        handlers[0].close()
+        logger.removeHandler(handlers[0])
+
+        messages = self.redis_client.xrange("logs")
+        self.assertEqual(messages[0][1]["msg"], "async message")
+
+
+class TestThrottleCache(TestCase):
+
+    def setUp(self):
+        self.closed = []
+        self.cache = ThrottleCache(
+            window=60,
+            capacity=2,
+            on_close=lambda record, count: self.closed.append(
+                (record.msg, count)))
+
+    def _record(self, msg):
+        return logging.LogRecord("test_throttle", logging.ERROR, __file__, 1,
+                                 msg, None, None)
+
+    def test_throttle_window(self):
+        record = self._record("same message")
+        self.assertFalse(self.cache.check("key", record, now=0))
+        self.assertTrue(self.cache.check("key", record, now=10))
+        self.assertTrue(self.cache.check("key", record, now=20))
+        # window is closed, suppressed count is reported once
+        self.assertFalse(self.cache.check("key", record, now=61))
+        self.assertEqual(self.closed, [("same message", 2)])
+
+    def test_capacity(self):
+        for i in range(10):
+            self.cache.check(f"key {i}", self._record(f"message {i}"), now=i)
+        self.assertEqual(len(self.cache), 2)
+        # windows without suppressed records are closed silently
+        self.assertEqual(self.closed, [])
+
+    def test_evicted_window_is_reported(self):
+        self.cache.check("key 0", self._record("message 0"), now=0)
+        self.cache.check("key 0", self._record("message 0"), now=1)
+        self.cache.check("key 1", self._record("message 1"), now=2)
+        self.cache.check("key 2", self._record("message 2"), now=3)
+        self.assertNotIn("key 0", self.cache)
+        self.assertEqual(self.closed, [("message 0", 1)])
+
+    def test_redis_handler_reports_suppressed(self):
+        redis_client = FakeRedis(decode_responses=True)
+        handler = RedisHandler(redis_client,
+                               get_redis_log_key("test_throttle"))
+        for i in range(3):
+            handler.emit(self._record("Order %s failed"))
+        handler.close()
+
+        messages = [m[1] for m in redis_client.xrange("logs")]
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(messages[1]["suppressed"], "2")
+
+
+class TestSamplingFilter(TestCase):
+
+    def _record(self, level=logging.INFO, lineno=1, created=0.):
+        record = logging.LogRecord("test_sampling", level, __file__, lineno,
+                                   "message", None, None)
+        record.created = created
+        return record
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=1, burst=2)
+        self.assertTrue(bucket.take(0))
+        self.assertTrue(bucket.take(0))
+        self.assertFalse(bucket.take(0.5))
+        self.assertTrue(bucket.take(1))
+
+    def test_level_rate(self):
+        sampling = SamplingFilter(level_rates={logging.WARNING: (1, 2)})
+        kept = [
+            sampling.filter(self._record(logging.WARNING)) for _ in range(5)
+        ]
+        self.assertEqual(kept, [True, True, False, False, False])
+        # other levels are not limited
+        self.assertTrue(sampling.filter(self._record(logging.ERROR)))
+        self.assertEqual(sampling.sampled_out, {logging.WARNING: 3})
+
+    def test_sample_rates(self):
+        sampling = SamplingFilter(sample_rates={
+            logging.DEBUG: 0,
+            logging.INFO: 1
+        })
+        self.assertFalse(sampling.filter(self._record(logging.DEBUG)))
+        self.assertTrue(sampling.filter(self._record(logging.INFO)))
+
+    def test_callsite_rate(self):
+        sampling = SamplingFilter(callsite_rate=(1, 1))
+        self.assertTrue(sampling.filter(self._record(lineno=1)))
+        self.assertFalse(sampling.filter(self._record(lineno=1)))
+        self.assertTrue(sampling.filter(self._record(lineno=2)))
+
+    def test_summary(self):
+        sampling = SamplingFilter(sample_rates={logging.DEBUG: 0},
+                                  summary_interval=10)
+        logger = get_logger("test_sampling",
+                            log_in_file=False,
+                            lazy=False,
+                            sampling=sampling)
+        with self.assertLogs(logger, logging.DEBUG) as logs:
+            for _ in range(3):
+                logger.handle(self._record(logging.DEBUG, created=1))
+            logger.handle(self._record(logging.INFO, created=11))
+
+        self.assertEqual(len(logs.records), 2)
+        summary = logs.records[0]
+        self.assertEqual(summary.sampled_out, 3)
+        self.assertIn("DEBUG: 3", summary.getMessage())
+        self.assertEqual(sampling.sampled_out, {})
+
+
+class TestRedisStreams(TestCase):
+
+    def setUp(self):
+        self.redis_client = FakeRedis(decode_responses=True)
+
+    def _record(self, name, msg, level=logging.ERROR):
+        return logging.LogRecord(name, level, __file__, 1, msg, None, None)
+
+    def test_shard_by_logger(self):
+        handler = RedisHandler(self.redis_client,
+                               get_redis_log_key("strategy"),
+                               shard_by=SHARD_BY_LOGGER)
+        handler.emit(self._record("strategy.orders", "message"))
+
+        self.assertEqual(self.redis_client.xlen("logs:strategy"), 1)
+        self.assertFalse(self.redis_client.exists("logs"))
+
+    def test_shard_by_level(self):
+        handler = RedisHandler(self.redis_client,
+                               get_redis_log_key("strategy"),
+                               shard_by=SHARD_BY_LEVEL)
+        handler.emit(self._record("strategy", "message 1"))
+        handler.emit(self._record("strategy", "message 2", logging.CRITICAL))
+
+        self.assertEqual(self.redis_client.xlen("logs:level:ERROR"), 1)
+        self.assertEqual(self.redis_client.xlen("logs:level:CRITICAL"), 1)
+
+    def test_get_logger_shard_by(self):
+        logger = get_logger(name="strategy_sharded.orders",
+                            log_in_file=False,
+                            redis_handler=True,
+                            custom_redis_client=self.redis_client,
+                            redis_shard_by=SHARD_BY_LOGGER,
+                            lazy=False)
+        logger.error("message")
+
+        self.assertEqual(self.redis_client.xlen("logs:strategy_sharded"), 1)
+        self.assertFalse(self.redis_client.exists("logs"))
+
+    def test_stream_maxlen(self):
+        handler = RedisHandler(self.redis_client,
+                               get_redis_log_key("strategy"),
+                               stream_maxlen=5)
+        with mock.patch.object(self.redis_client,
+                               "xadd",
+                               wraps=self.redis_client.xadd) as mock_xadd:
+            handler.emit(self._record("strategy", "message"))
+
+        mock_xadd.assert_called_once_with("logs",
+                                          mock.ANY,
+                                          maxlen=5,
+                                          approximate=True)
+
+
+class TestArbAlertsGroup(TestCase):
+
+    def setUp(self):
+        self.redis_client = FakeRedis(decode_responses=True)
+        self.arb_alerts = ArbAlerts(redis_client=self.redis_client,
+                                    aggregate_window=0)
+        self.arb_alerts.create_group("logs", ArbAlerts.GROUP_NAME)
+
+    def _xadd(self, name, msg):
+        self.redis_client.xadd("logs", {
+            "name": name,
+            "msg": msg,
+            "levelno": 40,
+            "levelname": "ERROR",
+            "lineno": 1
+        })
+
+    def test_read_group_batch(self):
+        mock_log_alert = mock.Mock(wraps=self.arb_alerts.log_alert_message)
+        self.arb_alerts.aggregator.on_flush = mock_log_alert
+        self._xadd("test_group", "message 1")
+        self._xadd("arb_alerts", "own message")
+        self._xadd("test_group", "message 2")
+
+        count = self.arb_alerts.read_group_batch(["logs"],
+                                                 ArbAlerts.GROUP_NAME,
+                                                 "consumer")
+        self.assertEqual(count, 3)
+        alerts = [c.args[0] for c in mock_log_alert.call_args_list]
+        self.assertEqual([a.msg for a in alerts], ["message 1", "message 2"])
+        self.assertEqual(alerts[0].levelno, logging.ERROR)
+
+        # everything was acked
+        pending = self.redis_client.xpending("logs", ArbAlerts.GROUP_NAME)
+        self.assertEqual(pending["pending"], 0)
+
+    def test_replay_pending(self):
+        self._xadd("test_group", "message")
+        with mock.patch.object(ArbAlerts,
+                               "process_stream_entry",
+                               side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.arb_alerts.read_group_batch(["logs"],
+                                                 ArbAlerts.GROUP_NAME,
+                                                 "consumer")
+
+        with mock.patch.object(self.arb_alerts.aggregator,
+                               "on_flush") as mock_log:
+            count = self.arb_alerts.read_group_batch(["logs"],
+                                                     ArbAlerts.GROUP_NAME,
+                                                     "consumer",
+                                                     last_id="0")
+        self.assertEqual(count, 1)
+        mock_log.assert_called_once()
+
+    def test_acks_are_batched(self):
+        for i in range(3):
+            self._xadd("test_group", f"message {i}")
+        self._xadd("arb_alerts", "own message")
+
+        with mock.patch.object(self.redis_client,
+                               "xack",
+                               wraps=self.redis_client.xack) as mock_xack:
+            self.arb_alerts.read_group_batch(["logs"], ArbAlerts.GROUP_NAME,
+                                             "consumer")
+        # no sink, the alerts are handled inline and acked together
+        mock_xack.assert_called_once()
+        self.assertEqual(len(mock_xack.call_args.args), 2 + 4)
+
+    def test_ack_after_dispatch(self):
+        # entries stay pending while their alert waits in the aggregator,
+        # then in the sink queue
+        sink = BlockingSink()
+        arb_alerts = ArbAlerts(redis_client=self.redis_client,
+                               sinks=[sink],
+                               aggregate_window=10)
+        self._xadd("test_group", "message")
+        self._xadd("test_group", "message")
+
+        def pending():
+            return self.redis_client.xpending(
+                "logs", ArbAlerts.GROUP_NAME)["pending"]
+
+        arb_alerts.read_group_batch(["logs"], ArbAlerts.GROUP_NAME,
+                                    "consumer")
+        self.assertEqual(pending(), 2)
+
+        # flushes the burst
+        arb_alerts.aggregator.stop()
+        self.assertEqual(pending(), 2)
+
+        sink.release.set()
+        arb_alerts.dispatcher.join()
+        arb_alerts.dispatcher.stop()
+        self.assertEqual(sink.sent, ["message (x2)"])
+        # acked with the next batch
+        self.assertEqual(pending(), 2)
+        arb_alerts.read_group_batch(["logs"], ArbAlerts.GROUP_NAME,
+                                    "consumer")
+        self.assertEqual(pending(), 0)
+
+    def test_replay_pending_once(self):
+        # replayed entries stay pending while their alert is in flight,
+        # they must not be read again
+        sink = BlockingSink()
+        arb_alerts = ArbAlerts(redis_client=self.redis_client,
+                               sinks=[sink],
+                               aggregate_window=10)
+        for _ in range(3):
+            self._xadd("test_group", "message")
+        # read before a restart, left pending
+        self.redis_client.xreadgroup(ArbAlerts.GROUP_NAME, "consumer",
+                                     {"logs": ">"})
+
+        with mock.patch.object(ArbAlerts, "BATCH_SIZE", 2):
+            count = arb_alerts.replay_pending(["logs"], ArbAlerts.GROUP_NAME,
+                                              "consumer")
+        self.assertEqual(count, 3)
+
+        with mock.patch.object(self.redis_client,
+                               "xack",
+                               wraps=self.redis_client.xack) as mock_xack:
+            arb_alerts.aggregator.stop()
+            sink.release.set()
+            arb_alerts.dispatcher.join()
+            arb_alerts.dispatcher.stop()
+            arb_alerts.flush_acks()
+        self.assertEqual(sink.sent, ["message (x3)"])
+        acked = [i for c in mock_xack.call_args_list for i in c.args[2:]]
+        self.assertEqual(len(acked), 3)
+        self.assertEqual(len(set(acked)), 3)
+
+
+class BlockingSink(AlertSink):
+    MAX_QUEUE_SIZE = 2
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.sent = []
+
+    def send(self, alert_message):
+        self.release.wait()
+        self.sent.append(alert_message.msg)
+
+
+class TestSinkDispatcher(TestCase):
+
+    def _alert(self, msg, levelno=logging.ERROR):
+        return AlertMessage(name="test_sink", msg=msg, levelno=levelno)
+
+    def test_slow_sink_does_not_block(self):
+        sink = BlockingSink()
+        dispatcher = SinkDispatcher([sink])
+
+        # first alert is taken by the worker, 2 fill the queue, 1 is dropped
+        dispatcher.dispatch(self._alert("message 0"))
+        while dispatcher.stats()["BlockingSink"]["queue_depth"]:
+            pass
+        for i in range(1, 4):
+            dispatcher.dispatch(self._alert(f"message {i}"))
+        # below the sink level
+        dispatcher.dispatch(self._alert("info", levelno=logging.INFO))
+
+        sink.release.set()
+        dispatcher.join()
+        dispatcher.stop()
+
+        self.assertEqual(sink.sent, ["message 0", "message 1", "message 2"])
+        stats = dispatcher.stats()["BlockingSink"]
+        self.assertEqual(stats["sent"], 3)
+        self.assertEqual(stats["dropped"], 1)
+        self.assertEqual(stats["max_queue_depth"], 2)
+        self.assertIsNotNone(stats["latency_p99"])
+
+
+class TestAlertAggregator(TestCase):
+
+    def setUp(self):
+        self.flushed = []
+        # no flusher thread, flush_expired is called by the tests
+        self.acks = []
+
+        def on_flush(alert_message, acks):
+            self.flushed.append(alert_message)
+            self.acks.append(acks)
+
+        with mock.patch("arb_logger.alert_aggregator.threading.Thread"):
+            self.aggregator = AlertAggregator(on_flush,
+                                              window=10,
+                                              max_count=3)
+
+    def _alert(self, msg, process, created):
+        return AlertMessage(name="test_burst",
+                            msg=msg,
+                            levelno=logging.ERROR,
+                            processName="MainProcess",
+                            process=process,
+                            created=created)
+
+    def test_burst_is_collapsed(self):
+        self.aggregator.add(self._alert("exchange down", 1, 100.0), now=0)
+        self.aggregator.add(self._alert("exchange down", 2, 101.0), now=1)
+        self.aggregator.add(self._alert("other", 1, 102.0), now=2)
+        self.aggregator.flush_expired(now=5)
+        self.assertEqual(self.flushed, [])
+
+        self.aggregator.flush_expired(now=11)
+        self.assertEqual(len(self.flushed), 1)
+        alert = self.flushed[0]
+        self.assertEqual(alert.msg, "exchange down (x2)")
+        self.assertEqual(alert.extra["count"], 2)
+        self.assertEqual(alert.extra["first_created"], 100.0)
+        self.assertEqual(alert.extra["last_created"], 101.0)
+        self.assertEqual(alert.extra["processes"],
+                         ["MainProcess:1", "MainProcess:2"])
+
+        # single alert is forwarded as is
+        self.aggregator.flush_expired(now=12)
+        self.assertEqual(self.flushed[1].msg, "other")
+        self.assertEqual(len(self.aggregator), 0)
+
+    def test_max_count(self):
+        for i in range(4):
+            self.aggregator.add(self._alert("exchange down", i, 100.0 + i),
+                                now=i)
+        self.assertEqual([a.msg for a in self.flushed],
+                         ["exchange down (x3)"])
+        self.assertEqual(len(self.aggregator), 1)
+
+    def test_acks_are_flushed_with_the_burst(self):
+        for i in range(2):
+            self.aggregator.add(self._alert("exchange down", i, 100.0 + i),
+                                now=i,
+                                ack=f"ack {i}")
+        self.aggregator.add(self._alert("other", 1, 102.0), now=2)
+        self.assertEqual(self.acks, [])
+
+        self.aggregator.flush_all()
+        self.assertEqual(self.acks, [["ack 0", "ack 1"], []])
+
+
+class TestRedisConnection(TestCase):
+
+    def tearDown(self):
+        redis_connection.reset_redis_clients()
+
+    def test_shared_client(self):
+        redis_client = redis_connection.get_redis_client()
+        self.assertIs(redis_client, redis_connection.get_redis_client())
+        self.assertIsNot(redis_client,
+                         redis_connection.get_redis_client(db=1))
+
+        redis_connection.reset_redis_clients()
+        self.assertIsNot(redis_client, redis_connection.get_redis_client())
+
+    @mock.patch.dict("os.environ", {"ARB_REDIS_SOCKET": "/tmp/redis.sock"})
+    def test_unix_socket(self):
+        redis_client = redis_connection.get_redis_client()
+        pool = redis_client.connection_pool
+        self.assertIs(pool.connection_class,
+                      redis_connection.TimedUnixDomainSocketConnection)
+        self.assertEqual(pool.connection_kwargs["path"], "/tmp/redis.sock")
+
+    def test_metrics(self):
+        redis_connection.get_redis_client()
+        metrics = redis_connection.get_redis_metrics()
+        self.assertEqual(metrics["clients"], 1)
+        self.assertEqual(metrics["connections"]["created"], 0)
+        self.assertIn("latency_p99", metrics)
+
+    def test_metrics_latency(self):
+        metrics = redis_connection.RedisMetrics()
+        for latency in (0.003, 0.001, 0.002):
+            metrics.add_latency(latency)
+        metrics = metrics.to_dict()
+        self.assertEqual(metrics["commands"], 3)
+        self.assertEqual(metrics["latency_p50"], 0.002)
+        self.assertEqual(metrics["latency_max"], 0.003)
+
+
+class TestLatencyWindow(TestCase):
+
+    def test_percentiles(self):
+        window = LatencyWindow(size=100)
+        self.assertEqual(window.to_dict(), {
+            "latency_p50": None,
+            "latency_p99": None,
+            "latency_max": None
+        })
+
+        # only the last 100 are kept
+        for i in range(200):
+            window.add(float(i))
+        self.assertEqual(len(window), 100)
+        self.assertEqual(window.to_dict(), {
+            "latency_p50": 150.,
+            "latency_p99": 199.,
+            "latency_max": 199.
+        })
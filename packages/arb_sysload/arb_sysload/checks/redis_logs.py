@@ -6,13 +6,29 @@ from arb_sysload.base_check import BaseCheck
 class RedisLogsCheck(BaseCheck):
     REDIS_LOGS_SIZE_THRESHOLD = 30000
 
+    def _get_log_streams(self, redis: Redis):
+        # 'logs' and the sharded streams (logs:<logger>, logs:level:<level>)
+        streams = set(redis.scan_iter(match='logs:*', _type='stream'))
+        if redis.exists('logs'):
+            streams.add('logs')
+        return sorted(streams)
+
     def run(self):
-        redis = Redis(host='localhost', port=6379, decode_responses=True)
-        length = redis.xlen("logs")
-        if length > self.REDIS_LOGS_SIZE_THRESHOLD:  # Example threshold
-            message = f"Redis logs stream length is {length}, which is above the threshold of {self.REDIS_LOGS_SIZE_THRESHOLD}"
+        lengths = {
+            stream: self.redis.xlen(stream)
+            for stream in self._get_log_streams(self.redis)
+        }
+        above = {
+            stream: length
+            for stream, length in lengths.items()
+            if length > self.REDIS_LOGS_SIZE_THRESHOLD
+        }
+        if above:
+            streams = ', '.join(f'{s} ({l})' for s, l in above.items())
+            message = f"Redis logs streams above the threshold of {self.REDIS_LOGS_SIZE_THRESHOLD}: {streams}"
             self.error(message)
         else:
+            length = max(lengths.values(), default=0)
             self.success(
-                f"Redis logs stream length is {length}/{self.REDIS_LOGS_SIZE_THRESHOLD}"
+                f"Redis logs streams max length is {length}/{self.REDIS_LOGS_SIZE_THRESHOLD} ({len(lengths)} streams)"
             )
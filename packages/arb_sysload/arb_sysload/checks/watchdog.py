@@ -1,31 +1,49 @@
-import redis
 from arb_sysload.base_check import BaseCheck
 
+from arb_watchdog.hosts import get_aggregated_view
+
 
 class WatchdogCheck(BaseCheck):
     INTERVAL = 15  # adjust as needed
 
     def run(self):
-        down_processes = []
+        # every host's agent and processes in one pipelined read
+        view = get_aggregated_view(self.redis)
 
-        # Get the list of all keys matching the pattern
-        keys = self.redis.keys('arb_watchdog:*')
+        lost_agents = []
+        offline_agents = []
+        for host, status in view.agent_statuses.items():
+            if status == 'LOST':
+                lost_agents.append(host)
+            elif status == 'OFFLINE':
+                offline_agents.append(host)
 
-        # Check which expected processes are missing
-        for key in keys:
-            status = self.redis.hget(key, 'status')
-            print(status)
-            if status != "UP":
-                process = key.split(":")[1]
-                down_processes.append(process)
+        # the processes of the agents still running
+        down_processes = []
+        for (host, process_name), process_data in view.processes.items():
+            if view.agent_statuses[host] != 'ONLINE':
+                continue
+            status = process_data.status if process_data else 'DOWN'
+            if status != 'UP':
+                down_processes.append(f'{process_name}@{host} ({status})')
 
-        # Construct the message
-        message = "All processes are present. "
+        errors = []
         if down_processes:
-            message = f"Processes marked as down: {', '.join(down_processes)}."
+            errors.append(
+                f"Processes marked as down: {', '.join(down_processes)}.")
+        if lost_agents:
+            errors.append(f"Watchdog agents lost: {', '.join(lost_agents)}.")
+        for process_name, hosts in view.duplicates.items():
+            errors.append(
+                f"{process_name} is running on several hosts: "
+                f"{', '.join(hosts)}.")
 
-        # Update status based on missing or down processes
-        if down_processes:
-            self.error(message)
+        if errors:
+            self.error(' '.join(errors))
+        elif offline_agents:
+            self.warning(
+                f"Watchdog agents stopped: {', '.join(offline_agents)}.")
+        elif not view.agents:
+            self.warning("No watchdog agent registered.")
         else:
-            self.success(message)
+            self.success("All processes are present. ")
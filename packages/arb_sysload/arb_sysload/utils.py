@@ -1,5 +1,6 @@
-from redis import Redis
+from arb_logger.redis_connection import get_redis_client
 
 
 def get_sysload_redis():
-    return Redis(host='localhost', port=6379, decode_responses=True)
+    # shared process-wide client
+    return get_redis_client()
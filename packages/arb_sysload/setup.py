@@ -10,7 +10,9 @@ setup(
     long_description=open('README.md').read(),
     long_description_content_type='text/markdown',
     packages=find_packages(),
-    install_requires=['arb_logger', 'flask', ' Flask-CORS', 'docker'],
+    install_requires=[
+        'arb_logger', 'arb_watchdog', 'flask', ' Flask-CORS', 'docker'
+    ],
     entry_points={
         'console_scripts': [
             'arb_sysload = arb_sysload.arb_sysload:main',
@@ -1,41 +1,135 @@
 import os
+import time
 
 from pathlib import Path
 from datetime import datetime
 from argparse import ArgumentParser
+from typing import Dict, List, Optional, Set
 
-from redis import Redis
+from redis import RedisError
 from tabulate import tabulate
 from colorama import init, Fore
 
+from arb_logger.redis_connection import get_redis_client
+
 from arb_watchdog.config import get_config
 from arb_watchdog.process_data import ProcessData
+from arb_watchdog.telemetry import ProcessStats
+from arb_watchdog.hosts import (AGENTS_KEY, AgentInfo, AggregatedView,
+                                ProcessKey, fetch_processes,
+                                get_aggregated_view, get_agents,
+                                get_duplicates, get_last_seen)
 
 
 class ProcessWatchdogCLI:
+    # keyspace notifications (K) of the process and agents hashes (h) and of
+    # the stats lists (l)
+    KEYSPACE_EVENTS = 'Khl'
+    # the A alias includes every event type flag, not the K class flag
+    ALIAS_FLAGS = 'hl'
+    # wait for the other events of a write before redrawing
+    DEBOUNCE = 0.05
+    # without keyspace notifications, refetch everything periodically
+    # with them, only the last seen times of the agents are read
+    POLL_INTERVAL = 1
 
-    def __init__(self, config_file: Path):
-        self._config = get_config(config_file)
+    def __init__(self, config_file: Path, host: Optional[str] = None):
+        # only the redis settings are read, the processes are the ones the
+        # agents registered
+        self._config = get_config(config_file, watch=False)
         redis_host = self.config.get('redis_host')
         redis_port = self.config.get('redis_port')
 
-        self.redis = Redis(host=redis_host or 'localhost',
-                           port=redis_port or 6379,
-                           decode_responses=True)
+        self.redis = get_redis_client(host=redis_host, port=redis_port)
+        # only show this host, every host by default
+        self.host = host
+        self.view: Optional[AggregatedView] = None
 
     @property
     def config(self):
         return self._config.config_data
 
-    def get_process_list(self):
-        return self.config.get('processes', [])
+    def _select_agents(
+            self, agents: Dict[str, AgentInfo]) -> Dict[str, AgentInfo]:
+        if self.host is None:
+            return agents
+        return {h: a for h, a in agents.items() if h == self.host}
 
-    def get_process_info(self, process_name):
-        key = f'arb_watchdog:{process_name}'
-        data = self.redis.hgetall(key)
-        if not data:
-            return
-        return ProcessData(**data)
+    def fetch_view(self) -> AggregatedView:
+        # every host in one pipelined read, see get_aggregated_view
+        view = get_aggregated_view(self.redis, with_stats=True)
+        if self.host is not None:
+            view.agents = self._select_agents(view.agents)
+            view.processes = {
+                k: p
+                for k, p in view.processes.items() if k[0] == self.host
+            }
+        return view
+
+    def refresh_agents(self):
+        # an agent was registered or changed, refetch only the processes of
+        # the hosts whose process list or status changed
+        agents = self._select_agents(get_agents(self.redis))
+        keys: List[ProcessKey] = []
+        for host, agent in agents.items():
+            previous = self.view.agents.get(host)
+            if (previous is None or previous.processes != agent.processes
+                    or previous.status != agent.status):
+                keys.extend((host, name) for name in agent.processes)
+
+        watched = {(host, name)
+                   for host, agent in agents.items()
+                   for name in agent.processes}
+        self.view.agents = agents
+        self.view.agent_statuses = {
+            host: agent.get_status()
+            for host, agent in agents.items()
+        }
+        self.view.processes = {
+            k: p
+            for k, p in self.view.processes.items() if k in watched
+        }
+        self.view.stats = {
+            k: s
+            for k, s in self.view.stats.items() if k in watched
+        }
+        if keys:
+            self.refresh_processes(keys)
+        else:
+            self.view.duplicates = get_duplicates(self.view.processes,
+                                                  self.view.agent_statuses)
+
+    def refresh_last_seen(self) -> bool:
+        # the last seen times are not notified, an agent not seen for too
+        # long becomes LOST, True when the view changed
+        last_seen = get_last_seen(self.redis)
+        changed = False
+        for host, agent in self.view.agents.items():
+            seen = last_seen.get(host)
+            if seen is not None and seen != agent.last_seen:
+                agent.last_seen = seen
+                changed = True
+
+        agent_statuses = {
+            host: agent.get_status()
+            for host, agent in self.view.agents.items()
+        }
+        if agent_statuses != self.view.agent_statuses:
+            self.view.agent_statuses = agent_statuses
+            self.view.duplicates = get_duplicates(self.view.processes,
+                                                  agent_statuses)
+            changed = True
+        return changed
+
+    def refresh_processes(self, keys: List[ProcessKey]):
+        # refetch only the processes that changed
+        processes, stats = fetch_processes(self.redis, keys, with_stats=True)
+        self.view.processes.update(processes)
+        for key in keys:
+            self.view.stats.pop(key, None)
+        self.view.stats.update(stats)
+        self.view.duplicates = get_duplicates(self.view.processes,
+                                              self.view.agent_statuses)
 
     def _get_process_last_status_change(self, process_data: ProcessData):
         try:
@@ -46,34 +140,174 @@ class ProcessWatchdogCLI:
         except ValueError:
             return 'N/A'
 
-    def display_process_info(self):
-        process_list = self.get_process_list()
+    @staticmethod
+    def _get_process_stats_columns(process_data: ProcessData,
+                                   process_stats: ProcessStats):
+        if process_data.pid is None or process_stats is None:
+            return ['', '', '', '']
+
+        def column(value, fmt):
+            return '' if value is None else fmt.format(value)
+
+        return [
+            column(process_stats.cpu_percent, '{:.1f}'),
+            column(process_stats.rss and process_stats.rss / 2**20, '{:.0f}'),
+            column(process_stats.threads, '{}'),
+            column(process_stats.fds, '{}'),
+        ]
+
+    @staticmethod
+    def _color_status(status: str, text: Optional[str] = None) -> str:
+        text = text or status
+        if status in ('UP', 'ONLINE'):
+            return Fore.GREEN + text + Fore.RESET
+        if status in ('DOWN', 'LOST'):
+            return Fore.RED + text + Fore.RESET
+        if status in ('DEGRADED', 'DUPLICATE', 'STALE'):
+            return Fore.YELLOW + text + Fore.RESET
+        return Fore.LIGHTBLACK_EX + text + Fore.RESET
+
+    def render(self, view: AggregatedView) -> str:
+        agents_data = []
+        for host, agent in view.agents.items():
+            agents_data.append([
+                host,
+                self._color_status(view.agent_statuses[host]),
+                agent.pid,
+                datetime.fromtimestamp(agent.last_seen).strftime('%H:%M:%S'),
+                len(agent.processes),
+            ])
+        agents_headers = ['Host', 'Agent', 'PID', 'Last Seen', 'Processes']
+
         table_data = []
+        for (host, process_name), process_data in view.processes.items():
+            if not process_data:
+                continue
+            status = process_data.status
+            text = status
+            if process_data.expected_replicas is not None:
+                text += (f' ({process_data.replicas or 0}/'
+                         f'{process_data.expected_replicas})')
+            if view.agent_statuses.get(host) != 'ONLINE':
+                # the agent is not watching it anymore
+                status = text = 'UNKNOWN'
+            elif process_name in view.duplicates:
+                status, text = 'DUPLICATE', text + ' (duplicate)'
+
+            table_data.append([
+                host,
+                process_data.name,
+                self._color_status(status, text),
+                process_data.pid,
+                self._get_process_last_status_change(process_data),
+                *self._get_process_stats_columns(
+                    process_data, view.stats.get((host, process_name))),
+            ])
+        headers = [
+            'Host', 'Name', 'Status', 'PID', 'Last Status Change', 'CPU %',
+            'RSS (MB)', 'Threads', 'FDs'
+        ]
+        table_data.sort(key=lambda x: (x[1].lower(), x[0]))
+
+        output = [
+            tabulate(agents_data, headers=agents_headers, tablefmt='grid'),
+            tabulate(table_data, headers=headers, tablefmt='grid'),
+        ]
+        for process_name, hosts in view.duplicates.items():
+            output.append(Fore.RED + f'{process_name} is running on '
+                          f'{len(hosts)} hosts: {", ".join(hosts)}' +
+                          Fore.RESET)
+        return '\n' + '\n'.join(output)
+
+    def display_process_info(self):
+        self.view = self.fetch_view()
+        print(self.render(self.view))
+
+    def enable_keyspace_events(self) -> bool:
+        # add the needed flags to the server config, keep the existing ones
+        try:
+            current = self.redis.config_get('notify-keyspace-events').get(
+                'notify-keyspace-events', '')
+            missing = [
+                f for f in self.KEYSPACE_EVENTS if f not in current
+                and not ('A' in current and f in self.ALIAS_FLAGS)
+            ]
+            if missing:
+                self.redis.config_set('notify-keyspace-events',
+                                      current + ''.join(missing))
+        except RedisError:
+            # CONFIG is often disabled on managed redis, poll instead
+            return False
+        return True
+
+    @staticmethod
+    def _get_changed_key(channel: str) -> Optional[ProcessKey]:
+        # __keyspace@0__:arb_watchdog:<host>:<name>
+        # __keyspace@0__:arb_watchdog_stats:<host>:<name>:raw
+        key = channel.split('__:', 1)[1]
+        if key.startswith('arb_watchdog:'):
+            parts = key.split(':', 2)
+        elif key.startswith('arb_watchdog_stats:') and key.endswith(':raw'):
+            parts = key[:-len(':raw')].split(':', 2)
+        else:
+            return None
+        if len(parts) != 3:
+            return None
+        return parts[1], parts[2]
+
+    def _redraw(self):
+        # clear the screen, then draw the cached view
+        print('\033[H\033[2J' + self.render(self.view), flush=True)
 
-        for process_name in process_list:
-            process_data = self.get_process_info(process_name)
+    def watch_process_info(self):
+        self.display_process_info()
+        if not self.enable_keyspace_events():
+            self._poll_process_info()
+            return
 
-            if process_data:
-                status_colored = process_data.status
+        db = self.redis.connection_pool.connection_kwargs.get('db', 0)
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(f'__keyspace@{db}__:arb_watchdog:*',
+                          f'__keyspace@{db}__:arb_watchdog_stats:*:raw',
+                          f'__keyspace@{db}__:{AGENTS_KEY}')
+        self._redraw()
 
-                if process_data.status == 'UP':
-                    status_colored = Fore.GREEN + status_colored + Fore.RESET
-                elif process_data.status == 'DOWN':
-                    status_colored = Fore.RED + status_colored + Fore.RESET
+        changed: Set[ProcessKey] = set()
+        agents_changed = False
+        next_poll = time.monotonic() + self.POLL_INTERVAL
+        while True:
+            pending = changed or agents_changed
+            message = pubsub.get_message(
+                timeout=self.DEBOUNCE if pending else max(
+                    next_poll - time.monotonic(), 0))
+            if message is not None:
+                if message['channel'].endswith(f'__:{AGENTS_KEY}'):
+                    agents_changed = True
                 else:
-                    status_colored = Fore.LIGHTBLACK_EX + status_colored + Fore.RESET
+                    key = self._get_changed_key(message['channel'])
+                    if key is not None and key in self.view.processes:
+                        changed.add(key)
+                continue
+
+            redraw = bool(pending)
+            if agents_changed:
+                # registered, stopped, or new processes
+                self.refresh_agents()
+            if changed:
+                self.refresh_processes(sorted(changed))
+            if time.monotonic() >= next_poll:
+                next_poll = time.monotonic() + self.POLL_INTERVAL
+                redraw = self.refresh_last_seen() or redraw
+            changed.clear()
+            agents_changed = False
+            if redraw:
+                self._redraw()
 
-                last_status_change = self._get_process_last_status_change(
-                    process_data)
-                table_data.append([
-                    process_data.name,
-                    status_colored,
-                    process_data.pid,
-                    last_status_change,
-                ])
-        headers = ['Name', 'Status', 'PID', 'Last Status Change']
-        table_data.sort(key=lambda x: x[0].lower())
-        print('\n' + tabulate(table_data, headers=headers, tablefmt='grid'))
+    def _poll_process_info(self):
+        while True:
+            time.sleep(self.POLL_INTERVAL)
+            self.view = self.fetch_view()
+            self._redraw()
 
 
 def main():
@@ -86,10 +320,21 @@ def main():
                         type=Path,
                         default=default_path,
                         help='Path to the configuration file')
+    parser.add_argument('-w',
+                        '--watch',
+                        action='store_true',
+                        help='Keep the table updated as the processes change')
+    parser.add_argument('--host', help='Only show this host')
     args = parser.parse_args()
 
-    cli = ProcessWatchdogCLI(config_file=args.config_file)
-    cli.display_process_info()
+    cli = ProcessWatchdogCLI(config_file=args.config_file, host=args.host)
+    if args.watch:
+        try:
+            cli.watch_process_info()
+        except KeyboardInterrupt:
+            pass
+    else:
+        cli.display_process_info()
 
 
 if __name__ == '__main__':
@@ -1,25 +1,140 @@
 import json
 import time
+import hashlib
 
 from pathlib import Path
-from threading import Thread
+from dataclasses import dataclass, field
+from threading import Lock, Thread, Timer
+from typing import Any, Dict, List, Optional
 
 from watchdog.observers import Observer
 from arb_logger.logger import get_logger
 from watchdog.events import FileSystemEventHandler
+from arb_watchdog.process_matcher import ProcessRule
 
 LOGGER = get_logger(name='arb_watchdog.config')
 
+# key: (accepted types, required)
+CONFIG_SCHEMA = {
+    'redis_host': ((str, ), False),
+    'redis_port': ((int, ), False),
+    'interval': ((int, float), False),
+    'processes': ((list, ), True),
+    'exit_events': ((bool, ), False),
+    'telemetry': ((bool, ), False),
+}
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def validate_config(config_data: Any):
+    if not isinstance(config_data, dict):
+        raise ConfigError('config must be a json object')
+    for key, (types, required) in CONFIG_SCHEMA.items():
+        if key not in config_data:
+            if required:
+                raise ConfigError(f'missing key {key}')
+            continue
+        value = config_data[key]
+        # bool is an int, only accepted where asked for
+        if (not isinstance(value, types)
+                or isinstance(value, bool) and bool not in types):
+            raise ConfigError(f'{key} must be of type '
+                              f'{"/".join(t.__name__ for t in types)}')
+    if config_data.get('interval', 1) <= 0:
+        raise ConfigError('interval must be positive')
+    for item in config_data['processes']:
+        # a plain name or a rule, see ProcessRule
+        try:
+            ProcessRule.from_config(item)
+        except ValueError as e:
+            raise ConfigError(f'processes: {e}')
+
+
+def get_process_names(config_data: Dict) -> List[str]:
+    return list(
+        dict.fromkeys(item if isinstance(item, str) else item['name']
+                      for item in config_data.get('processes', [])))
+
+
+@dataclass
+class ConfigDiff:
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    # the other top level keys whose value changed, processes when only
+    # the rules changed
+    changed: List[str] = field(default_factory=list)
+
+    @property
+    def names_changed(self) -> bool:
+        return bool(self.added or self.removed)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __str__(self):
+        parts = []
+        if self.added:
+            parts.append(f'added {", ".join(self.added)}')
+        if self.removed:
+            parts.append(f'removed {", ".join(self.removed)}')
+        if self.changed:
+            parts.append(f'changed {", ".join(self.changed)}')
+        return '; '.join(parts) or 'no change'
+
+
+def diff_configs(old: Dict, new: Dict) -> ConfigDiff:
+    old_names = get_process_names(old)
+    new_names = set(get_process_names(new))
+    old_set = set(old_names)
+    diff = ConfigDiff(
+        added=[n for n in get_process_names(new) if n not in old_set],
+        removed=[n for n in old_names if n not in new_names],
+        changed=sorted(k for k in old.keys() | new.keys()
+                       if k != 'processes' and old.get(k) != new.get(k)),
+    )
+    if (not diff.names_changed
+            and old.get('processes') != new.get('processes')):
+        diff.changed = sorted(diff.changed + ['processes'])
+    return diff
+
 
 class ConfigFileHandler(FileSystemEventHandler):
+    # Editors write a file with several events (truncate, write, rename...),
+    # reload once DEBOUNCE seconds after the last event on the config file
+    DEBOUNCE = 0.2
 
-    def __init__(self, callback):
+    def __init__(self, config_file: Path, callback):
         super().__init__()
+        self.config_file = Path(config_file).resolve()
         self.callback = callback
+        self._timer: Optional[Timer] = None
+        self._lock = Lock()
+
+    def _is_config_file(self, event) -> bool:
+        if event.is_directory:
+            return False
+        paths = [event.src_path, getattr(event, 'dest_path', '')]
+        return any(p and Path(p).resolve() == self.config_file for p in paths)
 
-    def on_modified(self, event):
-        if not event.is_directory:
-            self.callback()
+    def on_any_event(self, event):
+        if event.event_type not in ('modified', 'created', 'moved'):
+            return
+        if not self._is_config_file(event):
+            return
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = Timer(self.DEBOUNCE, self.callback)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
 
 
 class Config:
@@ -31,27 +146,63 @@ class Config:
             cls.__instance.__initialized = False
         return cls.__instance
 
-    def __init__(self, config_file: Path):
+    def __init__(self, config_file: Path, watch: bool = True):
         if self.__initialized:
             return
         self.__initialized = True
         self.config_file = config_file
         self.config_data = {}
+        self._digest: Optional[str] = None
         self.load_config()
 
-        Thread(target=self.watch_config, daemon=True).start()
+        # a one-shot reader (e.g: the cli) doesnt need the file watcher
+        if watch:
+            Thread(target=self.watch_config, daemon=True).start()
+
+    def load_config(self) -> Optional[ConfigDiff]:
+        # the whole config is replaced at once, readers never see a partial
+        # one; an invalid file keeps the current config
+        with open(self.config_file, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        if digest == self._digest:
+            return None
 
-    def load_config(self):
-        LOGGER.info(f'Loading config from {self.config_file}')
-        with open(self.config_file, "r") as f:
-            self.config_data = json.load(f)
-            LOGGER.info(f'Config loaded: {self.config_data}')
+        first_load = self._digest is None
+        try:
+            config_data = json.loads(content)
+            validate_config(config_data)
+        except ValueError as e:
+            if first_load:
+                raise
+            LOGGER.error(f'Invalid config {self.config_file}, '
+                         f'keeping the current one: {e}')
+            return None
+
+        diff = diff_configs(self.config_data, config_data)
+        self.config_data = config_data
+        self._digest = digest
+        if first_load:
+            LOGGER.info(f'Config loaded from {self.config_file}: '
+                        f'{len(get_process_names(config_data))} processes')
+        elif diff:
+            LOGGER.info(f'Config reloaded: {diff}')
+        return diff
+
+    def reload_config(self):
+        # called from the file watcher, a missing file (e.g: mid-rename)
+        # keeps the current config
+        try:
+            self.load_config()
+        except OSError as e:
+            LOGGER.error(f'Error while reloading config: {e}')
 
     def watch_config(self):
         LOGGER.info('Watching config file for changes')
         self._observer = Observer()
-        event_handler = ConfigFileHandler(self.load_config)
-        self._observer.schedule(event_handler,
+        self._event_handler = ConfigFileHandler(self.config_file,
+                                                self.reload_config)
+        self._observer.schedule(self._event_handler,
                                 str(self.config_file.parent),
                                 recursive=False)
         self._observer.start()
@@ -66,10 +217,11 @@ class Config:
 
     def stop(self):
         if hasattr(self, '_observer') and self._observer.is_alive():
+            self._event_handler.cancel()
             self._observer.stop()
             self._observer.join()
 
 
-def get_config(config_file: Path) -> Config:
-    config = Config(config_file)
+def get_config(config_file: Path, watch: bool = True) -> Config:
+    config = Config(config_file, watch)
     return config
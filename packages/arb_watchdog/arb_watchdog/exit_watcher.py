@@ -0,0 +1,82 @@
+import os
+import time
+import selectors
+
+from typing import Dict, List, Optional
+
+from arb_watchdog.process_matcher import ProcessEntry
+from arb_watchdog.process_tracker import is_process_alive
+
+
+def pidfd_supported() -> bool:
+    # os.pidfd_open needs Linux >= 5.3
+    if not hasattr(os, 'pidfd_open'):
+        return False
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return False
+    return True
+
+
+class ExitWatcher:
+    # Wait for the exit of the tracked processes: a pidfd becomes readable
+    # as soon as its process exits, all of them are waited on with a selector
+    # without pidfd support wait only sleeps, the exits are found by polling
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled and pidfd_supported()
+        self._selector = selectors.DefaultSelector() if self.enabled else None
+        self._watched: Dict[str, ProcessEntry] = {}
+        self._pidfds: Dict[str, int] = {}
+
+    def watch(self, name: str, entry: ProcessEntry):
+        if not self.enabled or self._watched.get(name) == entry:
+            return
+        self.unwatch(name)
+        try:
+            pidfd = os.pidfd_open(entry.pid)
+        except ProcessLookupError:
+            # already exited, found missing on the next cycle
+            return
+        # the pid may have been reused between the scan and pidfd_open
+        if not is_process_alive(entry):
+            os.close(pidfd)
+            return
+        self._selector.register(pidfd, selectors.EVENT_READ, name)
+        self._watched[name] = entry
+        self._pidfds[name] = pidfd
+
+    def unwatch(self, name: str):
+        pidfd = self._pidfds.pop(name, None)
+        self._watched.pop(name, None)
+        if pidfd is not None:
+            self._selector.unregister(pidfd)
+            os.close(pidfd)
+
+    def sync(self, tracked: Dict[str, ProcessEntry]):
+        # watch exactly the tracked processes
+        for name in list(self._watched):
+            if name not in tracked:
+                self.unwatch(name)
+        for name, entry in tracked.items():
+            self.watch(name, entry)
+
+    def wait(self, timeout: Optional[float]) -> List[str]:
+        # names of the processes that exited, unwatched
+        if not self.enabled or not self._watched:
+            if timeout:
+                time.sleep(timeout)
+            return []
+
+        exited = []
+        for key, _ in self._selector.select(timeout):
+            exited.append(key.data)
+            self.unwatch(key.data)
+        return exited
+
+    def close(self):
+        for name in list(self._watched):
+            self.unwatch(name)
+        if self._selector is not None:
+            self._selector.close()
@@ -0,0 +1,159 @@
+import os
+import mmap
+import time
+import struct
+import tempfile
+import threading
+
+from typing import Dict, List, Optional
+
+from redis import Redis, RedisError
+
+from arb_watchdog.hosts import get_host
+
+# Application heartbeats: a watched process calls beat() from its main loop,
+# the watcher marks it STALE when its last beat is older than the heartbeat
+# budget of its rule (see ProcessRule.heartbeat)
+# the beat is written at most every interval_ms, either in a shared memory
+# slot (one 8 bytes file per name, the default) or in redis by a thread
+HEARTBEAT_DIR = os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+    'arb_watchdog_heartbeats')
+# arb_watchdog_heartbeats:<host>: name -> time of the last beat
+HEARTBEATS_KEY = 'arb_watchdog_heartbeats'
+INTERVAL_MS = 100
+
+# a double, 8 bytes aligned: written and read in one piece
+SLOT = struct.Struct('d')
+
+_monotonic = time.monotonic
+
+
+def get_heartbeats_key(host: str) -> str:
+    return f'{HEARTBEATS_KEY}:{host}'
+
+
+def get_heartbeat_path(name: str) -> str:
+    return os.path.join(HEARTBEAT_DIR, name.replace('/', '_'))
+
+
+def _to_wall_time(monotonic_time: float) -> float:
+    return time.time() - (_monotonic() - monotonic_time)
+
+
+class Heartbeat:
+
+    def __init__(self,
+                 name: str,
+                 interval_ms: float = INTERVAL_MS,
+                 redis: Optional[Redis] = None,
+                 host: Optional[str] = None):
+        self.name = name
+        self.interval = interval_ms / 1000
+        self.redis = redis
+        # the host of the agent watching this process, see hosts.get_host
+        self.key = get_heartbeats_key(host or get_host())
+        self._next = 0.
+        self._last: Optional[float] = None
+
+        if redis is None:
+            os.makedirs(HEARTBEAT_DIR, exist_ok=True)
+            fd = os.open(get_heartbeat_path(name), os.O_RDWR | os.O_CREAT,
+                         0o644)
+            try:
+                os.ftruncate(fd, SLOT.size)
+                self._slot = mmap.mmap(fd, SLOT.size)
+            finally:
+                os.close(fd)
+            self.beat = self._beat_shm
+        else:
+            self._slot = None
+            self._flushed: Optional[float] = None
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._flush_loop,
+                                            name=f'heartbeat-{name}',
+                                            daemon=True)
+            self._thread.start()
+            self.beat = self._beat_redis
+
+    def _beat_shm(self):
+        now = _monotonic()
+        if now >= self._next:
+            self._next = now + self.interval
+            SLOT.pack_into(self._slot, 0, now)
+
+    def _beat_redis(self):
+        # the thread writes it, the main loop only keeps the time
+        self._last = _monotonic()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        last = self._last
+        if last is None or last == self._flushed:
+            return
+        try:
+            self.redis.hset(self.key, self.name, _to_wall_time(last))
+            self._flushed = last
+        except RedisError:
+            # retried on the next flush
+            pass
+
+    def close(self):
+        if self._slot is not None:
+            self._slot.close()
+        else:
+            self._stop.set()
+            self._thread.join()
+            self.flush()
+
+
+_heartbeats: Dict[str, Heartbeat] = {}
+_lock = threading.Lock()
+
+
+def get_heartbeat(name: str,
+                  interval_ms: float = INTERVAL_MS,
+                  redis: Optional[Redis] = None,
+                  host: Optional[str] = None) -> Heartbeat:
+    # one heartbeat per name in the process
+    with _lock:
+        if name not in _heartbeats:
+            _heartbeats[name] = Heartbeat(name, interval_ms, redis, host)
+        return _heartbeats[name]
+
+
+def read_heartbeat(name: str) -> Optional[float]:
+    # time of the last beat in shared memory, None when never written
+    try:
+        with open(get_heartbeat_path(name), 'rb') as f:
+            data = f.read(SLOT.size)
+    except OSError:
+        return None
+    if len(data) != SLOT.size:
+        return None
+    monotonic_time = SLOT.unpack(data)[0]
+    if not monotonic_time:
+        return None
+    return _to_wall_time(monotonic_time)
+
+
+def get_heartbeats(redis: Optional[Redis], host: str,
+                   names: List[str]) -> Dict[str, float]:
+    # time of the last beat of each name, from both backends
+    heartbeats = {}
+    for name in names:
+        beat = read_heartbeat(name)
+        if beat is not None:
+            heartbeats[name] = beat
+    if redis is not None and names:
+        try:
+            values = redis.hmget(get_heartbeats_key(host), names)
+        except RedisError:
+            values = []
+        for name, value in zip(names, values):
+            if value is not None:
+                heartbeats[name] = max(float(value), heartbeats.get(name, 0.))
+    return heartbeats
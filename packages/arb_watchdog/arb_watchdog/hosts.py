@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import socket
+
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from redis import Redis, RedisError
+
+from arb_logger.logger import get_logger
+from arb_watchdog.process_data import ProcessData
+from arb_watchdog.telemetry import ProcessStats, get_stats_key
+
+LOGGER = get_logger(name='arb_watchdog.hosts', redis_handler=False)
+
+# Several agents (one per host) can share a redis, the keys of an agent are
+# scoped by its host and every agent registers itself in AGENTS_KEY
+# arb_watchdog:<host>:<name>   process data (see ProcessData)
+# arb_watchdog_agents          host -> agent (json, see AgentInfo), only
+#                              written when it changes
+# arb_watchdog_agents_seen     host -> last time the agent was seen,
+#                              written every cycle
+AGENTS_KEY = 'arb_watchdog_agents'
+AGENTS_SEEN_KEY = 'arb_watchdog_agents_seen'
+# an ONLINE agent not seen for LOST_INTERVALS of its interval is LOST
+LOST_INTERVALS = 3
+# statuses of a running process, see ProcessWatcher
+RUNNING_STATUSES = ('UP', 'STALE', 'DEGRADED', 'DUPLICATE')
+
+
+def get_host() -> str:
+    # $ARB_WATCHDOG_HOST (e.g: several agents on one box), else the hostname
+    return os.getenv('ARB_WATCHDOG_HOST') or socket.gethostname()
+
+
+def get_process_key(host: str, process_name: str) -> str:
+    return f'arb_watchdog:{host}:{process_name}'
+
+
+@dataclass
+class AgentInfo:
+    host: str
+    pid: int
+    interval: float
+    started: float = field(default_factory=time.time)
+    last_seen: float = field(default_factory=time.time)
+    # ONLINE or OFFLINE (stopped), see get_status for LOST
+    status: str = 'ONLINE'
+    processes: List[str] = field(default_factory=list)
+
+    def get_status(self, now: Optional[float] = None) -> str:
+        now = time.time() if now is None else now
+        if (self.status == 'ONLINE'
+                and now - self.last_seen > LOST_INTERVALS * self.interval):
+            return 'LOST'
+        return self.status
+
+    def to_json(self) -> str:
+        # last_seen is kept in AGENTS_SEEN_KEY, the json only changes with
+        # the agent
+        data = asdict(self)
+        del data['last_seen']
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls,
+                  data: str,
+                  last_seen: Optional[str] = None) -> 'AgentInfo':
+        agent = cls(**json.loads(data))
+        agent.last_seen = (agent.started
+                           if last_seen is None else float(last_seen))
+        return agent
+
+
+class Agent:
+    # registration of the watchdog agent of this host, refreshed every cycle
+
+    def __init__(self, redis: Redis, host: str, interval: float):
+        self.redis = redis
+        self.info = AgentInfo(host=host, pid=os.getpid(), interval=interval)
+        self._saved: Optional[str] = None
+
+    def beat(self, processes: List[str], interval: float):
+        self.info.last_seen = time.time()
+        self.info.processes = processes
+        self.info.interval = interval
+        self.info.status = 'ONLINE'
+        self._save()
+
+    def stop(self):
+        # the processes of an OFFLINE agent are no longer reported
+        self.info.last_seen = time.time()
+        self.info.status = 'OFFLINE'
+        self._save()
+
+    def _save(self):
+        # the readers are notified of the AGENTS_KEY writes (see the cli),
+        # it is only rewritten when the agent changed, HSETNX registers it
+        # again if the key was lost
+        host = self.info.host
+        data = self.info.to_json()
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            if data != self._saved:
+                pipe.hset(AGENTS_KEY, host, data)
+            else:
+                pipe.hsetnx(AGENTS_KEY, host, data)
+            pipe.hset(AGENTS_SEEN_KEY, host, self.info.last_seen)
+            pipe.execute()
+            self._saved = data
+        except RedisError as e:
+            LOGGER.error(f'Error while updating agent {host}: {e}')
+
+
+def get_agents(redis: Redis) -> Dict[str, AgentInfo]:
+    pipe = redis.pipeline(transaction=False)
+    pipe.hgetall(AGENTS_KEY)
+    pipe.hgetall(AGENTS_SEEN_KEY)
+    agents, last_seen = pipe.execute()
+    return {
+        host: AgentInfo.from_json(data, last_seen.get(host))
+        for host, data in sorted(agents.items())
+    }
+
+
+def get_last_seen(redis: Redis) -> Dict[str, float]:
+    return {
+        host: float(last_seen)
+        for host, last_seen in redis.hgetall(AGENTS_SEEN_KEY).items()
+    }
+
+
+# (host, process name)
+ProcessKey = Tuple[str, str]
+
+
+@dataclass
+class AggregatedView:
+    agents: Dict[str, AgentInfo]
+    # agent status of each host, at the time of the read
+    agent_statuses: Dict[str, str]
+    processes: Dict[ProcessKey, Optional[ProcessData]]
+    stats: Dict[ProcessKey, ProcessStats]
+    # names running on several ONLINE hosts
+    duplicates: Dict[str, List[str]]
+
+
+def fetch_processes(
+    redis: Redis,
+    keys: List[ProcessKey],
+    with_stats: bool = False
+) -> Tuple[Dict[ProcessKey, Optional[ProcessData]], Dict[ProcessKey,
+                                                         ProcessStats]]:
+    # every process hash (and latest stats sample) in one pipeline
+    pipe = redis.pipeline(transaction=False)
+    for host, process_name in keys:
+        pipe.hgetall(get_process_key(host, process_name))
+        if with_stats:
+            pipe.lindex(get_stats_key(host, process_name), 0)
+    results = iter(pipe.execute())
+
+    processes, stats = {}, {}
+    for key in keys:
+        data = next(results)
+        processes[key] = ProcessData(**data) if data else None
+        if with_stats:
+            line = next(results)
+            if line:
+                stats[key] = ProcessStats.from_csv(line)
+    return processes, stats
+
+
+def get_duplicates(processes: Dict[ProcessKey, Optional[ProcessData]],
+                   agent_statuses: Dict[str, str]) -> Dict[str, List[str]]:
+    hosts: Dict[str, List[str]] = {}
+    for (host, process_name), process_data in processes.items():
+        if (agent_statuses.get(host) == 'ONLINE' and process_data is not None
+                and process_data.status in RUNNING_STATUSES):
+            hosts.setdefault(process_name, []).append(host)
+    return {name: h for name, h in sorted(hosts.items()) if len(h) > 1}
+
+
+def get_aggregated_view(redis: Redis,
+                        with_stats: bool = False,
+                        now: Optional[float] = None) -> AggregatedView:
+    # the agents, then the processes of every host in one pipeline
+    agents = get_agents(redis)
+    agent_statuses = {
+        host: agent.get_status(now)
+        for host, agent in agents.items()
+    }
+    keys = [(host, process_name) for host, agent in agents.items()
+            for process_name in agent.processes]
+    processes, stats = fetch_processes(redis, keys, with_stats)
+    return AggregatedView(agents, agent_statuses, processes, stats,
+                          get_duplicates(processes, agent_statuses))
@@ -9,6 +9,9 @@ class ProcessData:
     pid: Optional[int] = None
     status: str = 'DOWN'
     cmdline: Optional[str] = None
+    # processes found / expected, for the rules with replicas
+    replicas: Optional[int] = None
+    expected_replicas: Optional[int] = None
     last_status_change: datetime = field(default_factory=datetime.now)
 
     def __post_init__(self):
@@ -20,3 +23,7 @@ class ProcessData:
 
         if isinstance(self.pid, str):
             self.pid = int(self.pid)
+        if isinstance(self.replicas, str):
+            self.replicas = int(self.replicas)
+        if isinstance(self.expected_replicas, str):
+            self.expected_replicas = int(self.expected_replicas)
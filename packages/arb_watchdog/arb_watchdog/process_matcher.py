@@ -0,0 +1,238 @@
+import os
+import re
+
+from dataclasses import dataclass, fields, replace
+from typing import (Dict, Iterable, List, NamedTuple, Optional, Set, Tuple,
+                    Union)
+
+
+class ProcessEntry(NamedTuple):
+    pid: int
+    cmdline: str
+    # tells a process from a later one reusing its pid
+    create_time: Optional[float] = None
+    argv: Tuple[str, ...] = ()
+    # only read when a rule needs them, see ProcessMatcher.extra_attrs
+    exe: Optional[str] = None
+    username: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class ProcessRule:
+    name: str
+    # substring of the cmdline, the rule of a plain name in the config
+    cmdline: Optional[str] = None
+    # executable path, or its basename
+    exe: Optional[str] = None
+    # one of the arguments, or its basename (e.g: feed.py matches
+    # python /opt/feed.py but not python /opt/feed.py.bak)
+    argv: Optional[str] = None
+    # searched in the cmdline
+    regex: Optional[str] = None
+    user: Optional[str] = None
+    # substring of the cgroup path (e.g: the systemd unit)
+    cgroup: Optional[str] = None
+    # expected number of processes, when set all the matching processes are
+    # counted (see ProcessTracker)
+    replicas: Optional[int] = None
+    # seconds without a heartbeat before the process is STALE, see heartbeat
+    heartbeat: Optional[float] = None
+
+    @classmethod
+    def from_config(cls, item: Union[str, Dict]) -> 'ProcessRule':
+        # a plain name, or an object with a name and its predicates
+        if isinstance(item, str):
+            if not item:
+                raise ValueError('empty process name')
+            return cls(name=item, cmdline=item)
+        if not isinstance(item, dict):
+            raise ValueError(f'invalid process rule {item!r}')
+
+        name = item.get('name')
+        if not isinstance(name, str) or not name:
+            raise ValueError(f'process rule without a name: {item!r}')
+        keys = {f.name for f in fields(cls)}
+        unknown = set(item) - keys
+        if unknown:
+            raise ValueError(
+                f'{name}: unknown keys {", ".join(sorted(unknown))}')
+        for key in keys - {'name', 'replicas', 'heartbeat'}:
+            value = item.get(key)
+            if value is not None and (not isinstance(value, str) or not value):
+                raise ValueError(f'{name}: {key} must be a non empty string')
+        replicas = item.get('replicas')
+        if replicas is not None and (not isinstance(replicas, int)
+                                     or isinstance(replicas, bool)
+                                     or replicas < 1):
+            raise ValueError(f'{name}: replicas must be a positive integer')
+        heartbeat = item.get('heartbeat')
+        if heartbeat is not None and (not isinstance(heartbeat, (int, float))
+                                      or isinstance(heartbeat, bool)
+                                      or heartbeat <= 0):
+            raise ValueError(f'{name}: heartbeat must be a positive number')
+        if item.get('regex') is not None:
+            try:
+                re.compile(item['regex'])
+            except re.error as e:
+                raise ValueError(f'{name}: invalid regex: {e}')
+
+        rule = cls(**item)
+        if not (rule.cmdline or rule.exe or rule.argv or rule.regex):
+            # only filters (user, cgroup...): look for the name
+            rule = replace(rule, cmdline=name)
+        return rule
+
+
+class ProcessMatcher:
+    # Compiled once from the rules: each rule is indexed by one of its
+    # predicates (argv token, exe, cmdline substring), a process is only
+    # checked against the rules its arguments, exe and cmdline select
+    # the rules with only a regex are the ones tried on every process
+    # all the cmdline substrings are found with a single regex: the lookahead
+    # finds the matches at every position (overlapping ones too), the
+    # alternation prefers the longest substring at a position and the shorter
+    # ones it contains are added from _contained
+
+    def __init__(self, rules: Iterable[Union[str, Dict, ProcessRule]]):
+        self.rules: Dict[str, ProcessRule] = {}
+        for rule in rules:
+            if not isinstance(rule, ProcessRule):
+                rule = ProcessRule.from_config(rule)
+            self.rules.setdefault(rule.name, rule)
+        self.names: List[str] = list(self.rules)
+        # names whose every process is tracked
+        self.counted: List[str] = [
+            rule.name for rule in self.rules.values()
+            if rule.replicas is not None
+        ]
+        # psutil attributes the snapshots need besides the cmdline
+        self.extra_attrs: Tuple[str, ...] = tuple(
+            attr for attr, key in (('exe', 'exe'), ('username', 'user'))
+            if any(getattr(rule, key) for rule in self.rules.values()))
+
+        self._by_argv: Dict[str, List[ProcessRule]] = {}
+        self._by_exe: Dict[str, List[ProcessRule]] = {}
+        self._by_substring: Dict[str, List[ProcessRule]] = {}
+        self._unindexed: List[ProcessRule] = []
+        for rule in self.rules.values():
+            if rule.argv:
+                self._by_argv.setdefault(rule.argv, []).append(rule)
+            elif rule.exe:
+                self._by_exe.setdefault(rule.exe, []).append(rule)
+            elif rule.cmdline:
+                self._by_substring.setdefault(rule.cmdline, []).append(rule)
+            else:
+                self._unindexed.append(rule)
+        self._regexes = {
+            rule.name: re.compile(rule.regex)
+            for rule in self.rules.values() if rule.regex
+        }
+
+        substrings = sorted(self._by_substring, key=len, reverse=True)
+        self._substring_regex = (re.compile(
+            '(?=(' + '|'.join(map(re.escape, substrings)) + '))')
+                                 if substrings else None)
+        self._contained: Dict[str, List[str]] = {
+            substring:
+            [other for other in substrings
+             if other != substring and other in substring]
+            for substring in substrings
+        }
+
+    @staticmethod
+    def _get_tokens(entry: ProcessEntry) -> Set[str]:
+        argv = entry.argv or tuple(entry.cmdline.split())
+        tokens = set(argv)
+        tokens.update(token.rpartition('/')[2] for token in argv)
+        return tokens
+
+    def _find_substrings(self, cmdline: str) -> Set[str]:
+        found: Set[str] = set()
+        for match in self._substring_regex.finditer(cmdline):
+            substring = match.group(1)
+            if substring not in found:
+                found.add(substring)
+                found.update(self._contained[substring])
+        return found
+
+    def _check(self, rule: ProcessRule, entry: ProcessEntry, tokens: Set[str],
+               cgroups: Dict[int, str]) -> bool:
+        # cheapest predicates first, the cgroup is read from /proc
+        if rule.argv is not None and rule.argv not in tokens:
+            return False
+        if rule.exe is not None and (entry.exe is None or rule.exe not in (
+                entry.exe, os.path.basename(entry.exe))):
+            return False
+        if rule.cmdline is not None and rule.cmdline not in entry.cmdline:
+            return False
+        if rule.user is not None and rule.user != entry.username:
+            return False
+        if rule.regex is not None and not self._regexes[rule.name].search(
+                entry.cmdline):
+            return False
+        if rule.cgroup is not None:
+            if entry.pid not in cgroups:
+                cgroups[entry.pid] = get_cgroup(entry.pid)
+            if rule.cgroup not in cgroups[entry.pid]:
+                return False
+        return True
+
+    def match(self, process: Union[str, ProcessEntry]) -> Set[str]:
+        # names of the rules a process (or a bare cmdline) matches
+        entry = (process if isinstance(process, ProcessEntry) else
+                 ProcessEntry(0, process))
+        found: Set[str] = set()
+        if not self.names:
+            return found
+
+        tokens = self._get_tokens(entry) if self._by_argv else set()
+        candidates: List[ProcessRule] = []
+        for token in tokens:
+            candidates.extend(self._by_argv.get(token, ()))
+        if self._by_exe and entry.exe:
+            candidates.extend(self._by_exe.get(entry.exe, ()))
+            candidates.extend(
+                self._by_exe.get(os.path.basename(entry.exe), ()))
+        if self._substring_regex is not None:
+            for substring in self._find_substrings(entry.cmdline):
+                candidates.extend(self._by_substring[substring])
+        candidates.extend(self._unindexed)
+
+        cgroups: Dict[int, str] = {}
+        for rule in candidates:
+            if rule.name not in found and self._check(rule, entry, tokens,
+                                                      cgroups):
+                found.add(rule.name)
+        return found
+
+    def match_processes(
+            self,
+            processes: Iterable[ProcessEntry]) -> Dict[str, ProcessEntry]:
+        # first process matching each name, in the snapshot order
+        matches: Dict[str, ProcessEntry] = {}
+        for entry in processes:
+            for name in self.match(entry):
+                if name not in matches:
+                    matches[name] = entry
+            if len(matches) == len(self.names):
+                break
+        return matches
+
+    def match_all(
+            self,
+            processes: Iterable[ProcessEntry]) -> Dict[str, List[ProcessEntry]]:
+        # every process matching each name, in the snapshot order
+        matches: Dict[str, List[ProcessEntry]] = {}
+        for entry in processes:
+            for name in self.match(entry):
+                matches.setdefault(name, []).append(entry)
+        return matches
+
+
+def get_cgroup(pid: int) -> str:
+    # e.g: 0::/system.slice/arb_feed.service
+    try:
+        with open(f'/proc/{pid}/cgroup') as f:
+            return f.read()
+    except OSError:
+        return ''
@@ -0,0 +1,170 @@
+import time
+import psutil
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from arb_logger.logger import get_logger
+from arb_watchdog.process_matcher import ProcessEntry, ProcessMatcher
+
+LOGGER = get_logger(name='arb_watchdog.tracker', redis_handler=False)
+
+
+def get_process_snapshot(pids: Optional[Iterable[int]] = None,
+                         extra_attrs: Tuple[str, ...] = ()) -> List[ProcessEntry]:
+    # One pass over /proc (or only over pids), each cmdline read and joined once
+    # extra_attrs: exe/username, only read when a rule needs them
+    attrs = ['pid', 'cmdline', 'create_time', *extra_attrs]
+    if pids is None:
+        processes = psutil.process_iter(attrs=attrs)
+    else:
+        processes = _iter_pids(pids, attrs)
+
+    snapshot = []
+    for process in processes:
+        try:
+            argv = tuple(process.info.get('cmdline') or ())
+            if argv:
+                snapshot.append(
+                    ProcessEntry(process.info['pid'], ' '.join(argv),
+                                 process.info.get('create_time'), argv,
+                                 process.info.get('exe'),
+                                 process.info.get('username')))
+        except (psutil.NoSuchProcess, psutil.AccessDenied,
+                psutil.ZombieProcess) as e:
+            LOGGER.error(f'Error while iterating over processes: {e}')
+            continue
+    return snapshot
+
+
+def _iter_pids(pids: Iterable[int], attrs: List[str]):
+    for pid in sorted(pids):
+        try:
+            process = psutil.Process(pid)
+            process.info = process.as_dict(attrs=attrs)
+        except psutil.NoSuchProcess:
+            # short lived process
+            continue
+        yield process
+
+
+def get_pids() -> Set[int]:
+    return set(psutil.pids())
+
+
+def is_process_alive(entry: ProcessEntry) -> bool:
+    # same pid and same create time: not a new process reusing the pid
+    try:
+        process = psutil.Process(entry.pid)
+        with process.oneshot():
+            return (process.create_time() == entry.create_time
+                    and process.status() != psutil.STATUS_ZOMBIE)
+    except psutil.Error:
+        return False
+
+
+class ProcessTracker:
+    # Keep name -> (pid, create_time) of the processes found, a tick only
+    # checks the tracked pids are still alive
+    # the missing names are searched in the pids started since the last scan,
+    # and in the whole process table every FULL_SCAN_INTERVAL seconds
+    # (a process can exec its final cmdline after it was scanned)
+    # the names with expected replicas keep all their processes in replicas,
+    # their first one in tracked, and are searched even when found
+    FULL_SCAN_INTERVAL = 60
+
+    def __init__(self,
+                 matcher: ProcessMatcher,
+                 full_scan_interval: Optional[float] = None):
+        self.matcher = matcher
+        self.full_scan_interval = (full_scan_interval
+                                   or self.FULL_SCAN_INTERVAL)
+        self.tracked: Dict[str, ProcessEntry] = {}
+        self.replicas: Dict[str, List[ProcessEntry]] = {}
+        self._known_pids: Set[int] = set()
+        self._last_full_scan: Optional[float] = None
+
+    def set_matcher(self, matcher: ProcessMatcher):
+        # keep the processes of the rules still watched, search the new ones
+        self.tracked = {
+            name: entry
+            for name, entry in self.tracked.items()
+            if matcher.rules.get(name) == self.matcher.rules.get(name)
+        }
+        self.replicas = {
+            name: entries
+            for name, entries in self.replicas.items()
+            if name in matcher.counted and name in self.tracked
+        }
+        self.matcher = matcher
+        self._last_full_scan = None
+
+    def forget(self, name: str):
+        # exited, searched again on the next update
+        entry = self.tracked.pop(name, None)
+        if name in self.replicas:
+            self.replicas[name] = [
+                e for e in self.replicas[name] if e != entry
+            ]
+            if self.replicas[name]:
+                self.tracked[name] = self.replicas[name][0]
+
+    def _snapshot(self, pids: Optional[Set[int]] = None):
+        kwargs = {}
+        if self.matcher.extra_attrs:
+            kwargs['extra_attrs'] = self.matcher.extra_attrs
+        if pids is None:
+            return get_process_snapshot(**kwargs)
+        return get_process_snapshot(pids, **kwargs)
+
+    def update(self, now: Optional[float] = None) -> Dict[str, ProcessEntry]:
+        now = time.monotonic() if now is None else now
+
+        for name, entries in self.replicas.items():
+            self.replicas[name] = [e for e in entries if is_process_alive(e)]
+        for name, entry in list(self.tracked.items()):
+            if name in self.replicas:
+                if self.replicas[name]:
+                    self.tracked[name] = self.replicas[name][0]
+                else:
+                    del self.tracked[name]
+            elif not is_process_alive(entry):
+                del self.tracked[name]
+
+        missing = [
+            name for name in self.matcher.names if name not in self.tracked
+        ]
+        if not missing and not self.matcher.counted:
+            return self.tracked
+
+        if (self._last_full_scan is None
+                or now - self._last_full_scan >= self.full_scan_interval):
+            self._last_full_scan = now
+            self._known_pids = get_pids()
+            snapshot = self._snapshot()
+            full_scan = True
+        else:
+            pids = get_pids()
+            new_pids = pids - self._known_pids
+            self._known_pids = pids
+            if not new_pids:
+                return self.tracked
+            snapshot = self._snapshot(new_pids)
+            full_scan = False
+
+        matches = self.matcher.match_all(snapshot)
+        for name in missing:
+            if name in matches:
+                self.tracked[name] = matches[name][0]
+        for name in self.matcher.counted:
+            if full_scan:
+                self.replicas[name] = matches.get(name, [])
+            else:
+                self.replicas.setdefault(name, []).extend(
+                    matches.get(name, []))
+            entries = self.replicas[name]
+            if self.tracked.get(name) not in entries:
+                if entries:
+                    self.tracked[name] = entries[0]
+                else:
+                    self.tracked.pop(name, None)
+        return self.tracked
@@ -1,20 +1,36 @@
 import os
+import sys
 import time
-import psutil
+import signal
 
 from pathlib import Path
 from datetime import datetime
 from dataclasses import asdict
 from argparse import ArgumentParser
+from typing import Dict, List, Optional, Union
 
 from redis import Redis, RedisError
 
+from arb_logger import redis_connection
 from arb_logger.logger import get_logger
-from arb_watchdog.config import get_config
+from arb_watchdog.config import (diff_configs, get_config,
+                                 get_process_names)
 from arb_watchdog.process_data import ProcessData
+from arb_watchdog.exit_watcher import ExitWatcher
+from arb_watchdog.heartbeat import get_heartbeats
+from arb_watchdog.hosts import Agent, get_host, get_process_key
+from arb_watchdog.telemetry import TelemetryCollector
+from arb_watchdog.process_matcher import ProcessEntry, ProcessMatcher
+from arb_watchdog.process_tracker import ProcessTracker, get_process_snapshot
 
 LOGGER = get_logger(name='arb_watchdog.watcher', redis_handler=False)
 
+# status changes, outside of arb_watchdog:* so it is not taken for a process
+EVENTS_STREAM = 'arb_watchdog_events'
+EVENTS_MAXLEN = 10000
+# heartbeats are checked between the cycles, at least every half budget
+HEARTBEAT_CHECK_MIN = 0.1
+
 
 def factory(data):
 
@@ -27,12 +43,9 @@ def factory(data):
 
 
 def get_redis_client(host='localhost', port=6379) -> Redis:
-    host = host or 'localhost'
-    port = port or 6379
-    redis = Redis(host=host, port=port, db=0, decode_responses=True)
-
     try:
-        redis.ping()
+        # shared process-wide client, pinged when created
+        redis = redis_connection.get_redis_client(host, port, ping=True)
     except RedisError as e:
         LOGGER.error(f'Error while connecting to Redis: {e}')
         raise e
@@ -41,20 +54,35 @@ def get_redis_client(host='localhost', port=6379) -> Redis:
 
 class ProcessWatcher:
 
-    def __init__(self, config_file, redis_client=None):
+    def __init__(self, config_file, redis_client=None, host=None):
         self.config_obj = get_config(config_file)
         # allow custom redis client (e.g: for testing)
         self.redis = redis_client or get_redis_client(
             host=self.config.get('redis_host'),
             port=self.config.get('redis_port'))
+        # the keys are scoped by host, several agents can share a redis
+        self.host = host or get_host()
+        self.agent = Agent(self.redis, self.host,
+                           self.config.get('interval', 60))
+        # rebuilt when the watched names change
+        self._matcher: Optional[ProcessMatcher] = None
+        self._matcher_source: List[Union[str, Dict]] = []
+        self._tracker: Optional[ProcessTracker] = None
+        # last state written to redis, only the changes are written
+        self._published: Dict[str, ProcessData] = {}
+        # exits of the tracked processes are reported between the cycles
+        self.exit_watcher = ExitWatcher(self.config.get('exit_events', True))
+        self.telemetry = (TelemetryCollector(self.host)
+                          if self.config.get('telemetry', True) else None)
+        # config the components above were set up with
+        self._applied_config: Dict = self.config
 
     @property
     def config(self):
         return self.config_obj.config_data
 
-    @staticmethod
-    def _get_redis_key(process_name):
-        return f'arb_watchdog:{process_name}'
+    def _get_redis_key(self, process_name):
+        return get_process_key(self.host, process_name)
 
     def get_process_data(self, process_name) -> ProcessData:
         key = self._get_redis_key(process_name)
@@ -62,48 +90,304 @@ class ProcessWatcher:
         if not data: return
         return ProcessData(**data)
 
-    def get_process_info(self, process_name):
-        for process in psutil.process_iter(attrs=['pid', 'name', 'cmdline']):
-            try:
-                cmdline = ' '.join(process.info.get('cmdline') or [])
-                if process_name in cmdline:
-                    return ProcessData(name=process_name,
-                                       pid=process.info['pid'],
-                                       status='UP',
-                                       cmdline=cmdline)
-            except (psutil.NoSuchProcess, psutil.AccessDenied,
-                    psutil.ZombieProcess) as e:
-                LOGGER.error(f'Error while iterating over processes: {e}')
+    def get_matcher(self, processes: List[Union[str, Dict]]) -> ProcessMatcher:
+        # processes: names or rules (see ProcessRule), compiled once
+        if self._matcher is None or self._matcher_source != processes:
+            self._matcher = ProcessMatcher(processes)
+            self._matcher_source = list(processes)
+        return self._matcher
+
+    def get_tracker(self, processes: List[Union[str, Dict]]) -> ProcessTracker:
+        matcher = self.get_matcher(processes)
+        if self._tracker is None:
+            self._tracker = ProcessTracker(matcher)
+        elif self._tracker.matcher is not matcher:
+            self._tracker.set_matcher(matcher)
+        return self._tracker
+
+    @staticmethod
+    def _to_processes_info(
+            process_names: List[str], matches: Dict[str, ProcessEntry]
+    ) -> Dict[str, Optional[ProcessData]]:
+        processes_info = {}
+        for process_name in process_names:
+            process_data = None
+            if process_name in matches:
+                entry = matches[process_name]
+                process_data = ProcessData(name=process_name,
+                                           pid=entry.pid,
+                                           status='UP',
+                                           cmdline=entry.cmdline)
+            processes_info[process_name] = process_data
+        return processes_info
+
+    @staticmethod
+    def _get_replicas_status(found: int, expected: int) -> str:
+        if not found:
+            return 'DOWN'
+        if found < expected:
+            return 'DEGRADED'
+        if found > expected:
+            return 'DUPLICATE'
+        return 'UP'
+
+    def _get_tracked_info(
+            self, process_names: List[str]) -> Dict[str, Optional[ProcessData]]:
+        # from the tracker state, without scanning
+        tracker = self._tracker
+        processes_info = self._to_processes_info(process_names,
+                                                 tracker.tracked)
+        for process_name in process_names:
+            rule = tracker.matcher.rules.get(process_name)
+            if rule is None or rule.replicas is None:
                 continue
-        return None
+            found = len(tracker.replicas.get(process_name, []))
+            process_data = (processes_info[process_name]
+                            or ProcessData(name=process_name))
+            process_data.status = self._get_replicas_status(
+                found, rule.replicas)
+            process_data.replicas = found
+            process_data.expected_replicas = rule.replicas
+            processes_info[process_name] = process_data
+        self._apply_heartbeats(processes_info)
+        return processes_info
+
+    def _apply_heartbeats(self, processes_info: Dict[str,
+                                                     Optional[ProcessData]]):
+        # running but without a heartbeat for longer than its budget: STALE
+        # a process that never beat is given its budget from its start
+        rules = self._tracker.matcher.rules
+        names = [
+            name for name, process_data in processes_info.items()
+            if process_data is not None and process_data.status != 'DOWN'
+            and rules[name].heartbeat is not None
+        ]
+        if not names:
+            return
+        heartbeats = get_heartbeats(self.redis, self.host, names)
+        now = time.time()
+        for name in names:
+            last_beat = heartbeats.get(name)
+            entry = self._tracker.tracked.get(name)
+            started = entry.create_time if entry is not None else None
+            # the beat of a previous instance
+            if started is not None and (last_beat is None
+                                        or last_beat < started):
+                last_beat = started
+            if (last_beat is not None
+                    and now - last_beat > rules[name].heartbeat):
+                processes_info[name].status = 'STALE'
+
+    def get_processes_info(
+        self, processes: List[Union[str, Dict]]
+    ) -> Dict[str, Optional[ProcessData]]:
+        # only the missing processes are searched, see ProcessTracker
+        tracker = self.get_tracker(processes)
+        tracker.update()
+        return self._get_tracked_info(tracker.matcher.names)
+
+    def get_process_info(self, process_name):
+        matches = ProcessMatcher([process_name]).match_processes(
+            get_process_snapshot())
+        return self._to_processes_info([process_name], matches)[process_name]
 
     def update_process_data(self, process_data: ProcessData):
+        # write the process data as is
         try:
             key = self._get_redis_key(process_data.name)
             process_data_dict = asdict(process_data, dict_factory=factory)
             self.redis.hset(key, mapping=process_data_dict)
+            self._published[process_data.name] = process_data
 
         except RedisError as e:
             LOGGER.error(f'Error while updating process status in Redis: {e}')
 
-    def get_process_list(self):
-        processes = self.config.get('processes', [])
+    def load_published(self, process_names: List[str]):
+        # state written by a previous run, keeps its last_status_change
+        pipe = self.redis.pipeline(transaction=False)
+        for process_name in process_names:
+            pipe.hgetall(self._get_redis_key(process_name))
+        for process_name, data in zip(process_names, pipe.execute()):
+            self._published[process_name] = (ProcessData(**data)
+                                             if data else None)
+
+    def publish_processes(self, processes: List[ProcessData]):
+        # Write only what changed since the last publish, in one pipeline
+        # last_status_change is only updated when the status changes, and
+        # each status change is added to the EVENTS_STREAM
+        try:
+            not_loaded = [
+                p.name for p in processes if p.name not in self._published
+            ]
+            if not_loaded:
+                self.load_published(not_loaded)
+
+            now = datetime.now()
+            pipe = self.redis.pipeline(transaction=False)
+            changed = []
+            for process_data in processes:
+                previous = self._published.get(process_data.name)
+                status_changed = (previous is None
+                                  or previous.status != process_data.status)
+                if status_changed:
+                    process_data.last_status_change = now
+                else:
+                    process_data.last_status_change = (
+                        previous.last_status_change)
+                    if process_data == previous:
+                        continue
+
+                key = self._get_redis_key(process_data.name)
+                process_data_dict = asdict(process_data, dict_factory=factory)
+                pipe.hset(key, mapping=process_data_dict)
+                if previous is not None:
+                    # e.g: the pid of a process now DOWN
+                    previous_dict = asdict(previous, dict_factory=factory)
+                    removed = [
+                        k for k in previous_dict if k not in process_data_dict
+                    ]
+                    if removed:
+                        pipe.hdel(key, *removed)
+                if status_changed:
+                    event = {
+                        'host': self.host,
+                        'name': process_data.name,
+                        'status': process_data.status,
+                        'previous_status': previous.status if previous else '',
+                        'pid': process_data.pid or '',
+                        'time': now.timestamp(),
+                    }
+                    pipe.xadd(EVENTS_STREAM,
+                              event,
+                              maxlen=EVENTS_MAXLEN,
+                              approximate=True)
+                changed.append((process_data, previous, status_changed))
+
+            if not changed:
+                return
+            pipe.execute()
+        except RedisError as e:
+            # retried on the next cycle
+            LOGGER.error(f'Error while updating process status in Redis: {e}')
+            return
+
+        for process_data, previous, status_changed in changed:
+            self._published[process_data.name] = process_data
+            if not status_changed:
+                continue
+            if process_data.status == 'DOWN':
+                LOGGER.error(f'Process {process_data.name} is down')
+            elif previous is not None:
+                LOGGER.info(f'Process {process_data.name} is '
+                            f'{process_data.status} (pid {process_data.pid})')
+
+    def apply_config(self) -> Dict:
+        # a reload replaces the config dict as a whole, its changes are
+        # applied here between two cycles (never during one)
+        config = self.config
+        if config is self._applied_config:
+            return config
+        diff = diff_configs(self._applied_config, config)
+        self._applied_config = config
+
+        if 'exit_events' in diff.changed:
+            self.exit_watcher.close()
+            self.exit_watcher = ExitWatcher(config.get('exit_events', True))
+        if 'telemetry' in diff.changed:
+            self.telemetry = (TelemetryCollector(self.host)
+                              if config.get('telemetry', True) else None)
+        if {'redis_host', 'redis_port'} & set(diff.changed):
+            LOGGER.warning('Redis config changed, restart to apply it')
+        # the matcher is rebuilt by get_matcher when the rules changed
+        return config
+
+    def get_process_rules(self, config: Optional[Dict] = None):
+        # names or rules, as in the config
+        config = self.config if config is None else config
+        processes = config.get('processes', [])
         if not processes:
             LOGGER.error('No processes found in config file')
         return processes
 
+    def get_process_list(self, config: Optional[Dict] = None):
+        config = self.config if config is None else config
+        return get_process_names(config)
+
+    def check_processes(self):
+        processes_info = self.get_processes_info(
+            self.get_process_rules(self.apply_config()))
+        self.publish_processes([
+            processes_info.get(process_name) or ProcessData(name=process_name)
+            for process_name in self._tracker.matcher.names
+        ])
+        self.exit_watcher.sync(self._tracker.tracked)
+        if self.telemetry is not None:
+            stats = self.telemetry.collect(self._tracker.tracked)
+            self.telemetry.publish(self.redis, stats)
+        self.agent.beat(self._tracker.matcher.names,
+                        self._applied_config.get('interval', 60))
+
+    def get_heartbeat_period(self) -> Optional[float]:
+        budgets = [
+            rule.heartbeat for rule in self._tracker.matcher.rules.values()
+            if rule.heartbeat is not None
+        ] if self._tracker is not None else []
+        if not budgets:
+            return None
+        return max(min(budgets) / 2, HEARTBEAT_CHECK_MIN)
+
+    def check_heartbeats(self):
+        # publish the processes becoming STALE (or UP again) between cycles
+        names = [
+            name for name, rule in self._tracker.matcher.rules.items()
+            if rule.heartbeat is not None
+        ]
+        processes_info = self._get_tracked_info(names)
+        self.publish_processes([
+            processes_info.get(process_name)
+            or ProcessData(name=process_name) for process_name in names
+        ])
+
+    def wait_for_exits(self, timeout: float):
+        # until the next cycle, DOWN is published as soon as a process exits
+        # (or the next replica of a rule with replicas is watched)
+        # and the heartbeats are checked every heartbeat period
+        deadline = time.monotonic() + timeout
+        heartbeat_period = self.get_heartbeat_period()
+        next_heartbeat_check = (time.monotonic() + heartbeat_period
+                                if heartbeat_period else deadline)
+        while (remaining := deadline - time.monotonic()) > 0:
+            exited = self.exit_watcher.wait(
+                max(min(remaining, next_heartbeat_check - time.monotonic()),
+                    0))
+            if heartbeat_period and time.monotonic() >= next_heartbeat_check:
+                next_heartbeat_check = time.monotonic() + heartbeat_period
+                self.check_heartbeats()
+            if not exited:
+                continue
+            for process_name in exited:
+                self._tracker.forget(process_name)
+            self.exit_watcher.sync(self._tracker.tracked)
+            processes_info = self._get_tracked_info(exited)
+            self.publish_processes([
+                processes_info.get(process_name)
+                or ProcessData(name=process_name) for process_name in exited
+            ])
+
     def watch_processes(self):
         LOGGER.info('Starting process watcher')
+        if not self.exit_watcher.enabled:
+            LOGGER.info('Process exits are only detected by polling')
 
-        while True:
-            for process_name in self.get_process_list():
-                process_data = self.get_process_info(process_name)
-                if process_data is None:
-                    process_data = ProcessData(name=process_name)
-                if process_data.status == 'DOWN':
-                    LOGGER.error(f'Process {process_name} is down')
-                self.update_process_data(process_data)
-            time.sleep(self.config.get('interval', 60))
+        try:
+            while True:
+                self.check_processes()
+                self.wait_for_exits(self._applied_config.get('interval', 60))
+        finally:
+            # the aggregated views stop reporting the processes of this host
+            LOGGER.info(f'Stopping process watcher of {self.host}')
+            self.agent.stop()
+            self.exit_watcher.close()
 
 
 def main():
@@ -116,11 +400,20 @@ def main():
                         type=Path,
                         default=default_path,
                         help='Path to the configuration file')
+    parser.add_argument('--host',
+                        help='Host name of the agent in redis (default: '
+                        '$ARB_WATCHDOG_HOST, else the hostname)')
     args = parser.parse_args()
 
+    # stop gracefully (agent OFFLINE) on SIGTERM too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
     LOGGER.info('Starting arb watchdog')
-    watcher = ProcessWatcher(config_file=args.config_file)
-    watcher.watch_processes()
+    watcher = ProcessWatcher(config_file=args.config_file, host=args.host)
+    try:
+        watcher.watch_processes()
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == '__main__':
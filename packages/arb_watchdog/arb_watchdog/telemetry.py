@@ -0,0 +1,210 @@
+import time
+import psutil
+
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional, Tuple
+
+from redis import Redis, RedisError
+
+from arb_logger.logger import get_logger
+from arb_watchdog.process_matcher import ProcessEntry
+
+LOGGER = get_logger(name='arb_watchdog.telemetry', redis_handler=False)
+
+# Resource usage of the watched processes, one redis list per process and
+# resolution, newest sample first, each sample a csv line (see ProcessStats)
+# arb_watchdog_stats:<host>:<name>:raw   every sample
+# arb_watchdog_stats:<host>:<name>:<s>   averaged over s seconds
+STATS_KEY = 'arb_watchdog_stats'
+RAW_SAMPLES = 360
+# (resolution in seconds, samples kept): 1 day of 1 min, 1 week of 1 hour
+RESOLUTIONS: List[Tuple[int, int]] = [(60, 1440), (3600, 168)]
+
+# num_fds is POSIX only, io_counters is not available on macOS: as_dict
+# raises on an attribute the platform doesnt define
+STATS_ATTRS = [
+    attr for attr in ('cpu_percent', 'memory_info', 'num_threads', 'num_fds',
+                      'num_ctx_switches', 'io_counters')
+    if hasattr(psutil.Process, attr)
+]
+
+
+@dataclass
+class ProcessStats:
+    time: float
+    cpu_percent: Optional[float] = None
+    rss: Optional[int] = None
+    threads: Optional[int] = None
+    fds: Optional[int] = None
+    # cumulative counters
+    ctx_switches: Optional[int] = None
+    read_bytes: Optional[int] = None
+    write_bytes: Optional[int] = None
+
+    GAUGES = ('cpu_percent', 'rss', 'threads', 'fds')
+
+    @classmethod
+    def from_process(cls, process: psutil.Process,
+                     now: float) -> 'ProcessStats':
+        # as_dict reads everything in a single oneshot
+        info = process.as_dict(attrs=STATS_ATTRS, ad_value=None)
+        memory_info = info.get('memory_info')
+        ctx_switches = info.get('num_ctx_switches')
+        io_counters = info.get('io_counters')
+        return cls(
+            time=now,
+            cpu_percent=info.get('cpu_percent'),
+            rss=memory_info.rss if memory_info else None,
+            threads=info.get('num_threads'),
+            fds=info.get('num_fds'),
+            ctx_switches=(ctx_switches.voluntary + ctx_switches.involuntary
+                          if ctx_switches else None),
+            read_bytes=io_counters.read_bytes if io_counters else None,
+            write_bytes=io_counters.write_bytes if io_counters else None,
+        )
+
+    @classmethod
+    def average(cls, samples: List['ProcessStats'],
+                bucket_time: float) -> 'ProcessStats':
+        # mean of the gauges, last value of the counters
+        values = {}
+        for f in fields(cls)[1:]:
+            if f.name in cls.GAUGES:
+                known = [
+                    getattr(s, f.name) for s in samples
+                    if getattr(s, f.name) is not None
+                ]
+                values[f.name] = sum(known) / len(known) if known else None
+            else:
+                values[f.name] = getattr(samples[-1], f.name)
+        return cls(time=bucket_time, **values)
+
+    def to_csv(self) -> str:
+        return ','.join(_format_value(getattr(self, f.name))
+                        for f in fields(self))
+
+    @classmethod
+    def from_csv(cls, line: str) -> 'ProcessStats':
+        values = []
+        for f, value in zip(fields(cls), line.split(',')):
+            if value == '':
+                values.append(None)
+            elif f.name in ('time', 'cpu_percent'):
+                values.append(float(value))
+            else:
+                values.append(int(float(value)))
+        return cls(*values)
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return str(round(value, 1))
+    return str(value)
+
+
+def get_stats_key(host: str,
+                  process_name: str,
+                  resolution: str = 'raw') -> str:
+    return f'{STATS_KEY}:{host}:{process_name}:{resolution}'
+
+
+class Downsampler:
+    # Average the samples of each resolution-seconds bucket, the bucket is
+    # emitted when a sample of the next bucket arrives
+
+    def __init__(self, resolution: int):
+        self.resolution = resolution
+        self.bucket: Optional[int] = None
+        self.samples: List[ProcessStats] = []
+
+    def add(self, stats: ProcessStats) -> Optional[ProcessStats]:
+        bucket = int(stats.time // self.resolution)
+        averaged = None
+        if self.bucket is not None and bucket != self.bucket:
+            averaged = ProcessStats.average(self.samples,
+                                            self.bucket * self.resolution)
+            self.samples = []
+        self.bucket = bucket
+        self.samples.append(stats)
+        return averaged
+
+
+class TelemetryCollector:
+
+    def __init__(self, host: str):
+        self.host = host
+        # psutil keeps the previous cpu times in the Process object,
+        # needed for cpu_percent
+        self._processes: Dict[str, Tuple[ProcessEntry, psutil.Process]] = {}
+        self._downsamplers: Dict[str, List[Downsampler]] = {}
+
+    def collect(self,
+                tracked: Dict[str, ProcessEntry],
+                now: Optional[float] = None) -> Dict[str, ProcessStats]:
+        now = time.time() if now is None else now
+        for name in list(self._processes):
+            if name not in tracked:
+                del self._processes[name]
+
+        stats = {}
+        for name, entry in tracked.items():
+            cached = self._processes.get(name)
+            new_process = cached is None or cached[0] != entry
+            if new_process:
+                try:
+                    process = psutil.Process(entry.pid)
+                except psutil.NoSuchProcess:
+                    continue
+                cached = self._processes[name] = (entry, process)
+            try:
+                process_stats = ProcessStats.from_process(cached[1], now)
+            except psutil.NoSuchProcess:
+                continue
+            except Exception as e:
+                # never let the stats of one process stop the watcher loop
+                LOGGER.warning(f'Error while collecting {name} stats: {e}')
+                continue
+            if new_process:
+                # the first cpu_percent call only sets the reference cpu times
+                process_stats.cpu_percent = None
+            stats[name] = process_stats
+        return stats
+
+    def publish(self, redis: Redis, stats: Dict[str, ProcessStats]):
+        if not stats:
+            return
+        pipe = redis.pipeline(transaction=False)
+        for name, process_stats in stats.items():
+            self._push(pipe, get_stats_key(self.host, name), process_stats,
+                       RAW_SAMPLES)
+            downsamplers = self._downsamplers.setdefault(
+                name, [Downsampler(r) for r, _ in RESOLUTIONS])
+            for downsampler, (resolution, size) in zip(downsamplers,
+                                                       RESOLUTIONS):
+                averaged = downsampler.add(process_stats)
+                if averaged is not None:
+                    self._push(pipe,
+                               get_stats_key(self.host, name, str(resolution)),
+                               averaged, size)
+        try:
+            pipe.execute()
+        except RedisError as e:
+            LOGGER.error(f'Error while publishing process stats: {e}')
+
+    @staticmethod
+    def _push(pipe, key: str, stats: ProcessStats, size: int):
+        pipe.lpush(key, stats.to_csv())
+        pipe.ltrim(key, 0, size - 1)
+
+
+def get_latest_stats(redis: Redis, host: str,
+                     process_names: List[str]) -> Dict[str, ProcessStats]:
+    pipe = redis.pipeline(transaction=False)
+    for process_name in process_names:
+        pipe.lindex(get_stats_key(host, process_name), 0)
+    return {
+        process_name: ProcessStats.from_csv(line)
+        for process_name, line in zip(process_names, pipe.execute()) if line
+    }
@@ -1,22 +1,43 @@
 import os
 import json
+import time
+import psutil
 import tempfile
 import unittest
+import subprocess
 
 from pathlib import Path
 from datetime import datetime
+from unittest.mock import MagicMock, patch
 
+from redis import RedisError
 from fakeredis import FakeRedis
 
 from arb_watchdog.process_data import ProcessData
-from arb_watchdog.config import Config, get_config
+from arb_watchdog.config import (Config, ConfigError, ConfigFileHandler,
+                                 diff_configs, get_config, validate_config)
+from arb_watchdog.process_tracker import ProcessTracker
+from arb_watchdog.exit_watcher import ExitWatcher, pidfd_supported
+from arb_watchdog.heartbeat import Heartbeat, get_heartbeats, read_heartbeat
+from arb_watchdog import heartbeat, telemetry
+from arb_watchdog.telemetry import (Downsampler, ProcessStats,
+                                    TelemetryCollector, get_latest_stats)
+from arb_watchdog.process_matcher import (ProcessEntry, ProcessMatcher,
+                                         ProcessRule)
 from arb_watchdog.process_watcher import ProcessWatcher
+from arb_watchdog.cli import ProcessWatchdogCLI
+from arb_watchdog.hosts import (AGENTS_KEY, AGENTS_SEEN_KEY, LOST_INTERVALS,
+                                Agent, fetch_processes, get_agents,
+                                get_aggregated_view, get_process_key)
 
 
 class TestArbWatchdog(unittest.TestCase):
 
     def setUp(self):
         self.test_redis = FakeRedis(decode_responses=True)
+        patcher = patch.dict(os.environ, {'ARB_WATCHDOG_HOST': 'test_host'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
         self.config_file = Path(tempfile.NamedTemporaryFile(delete=False).name)
         self.config_data = {
@@ -52,6 +73,28 @@ class TestArbWatchdog(unittest.TestCase):
         config = get_config(self.config_file)
         self.assertEqual(config.config_data, self.config_data)
 
+        # same content: nothing reloaded
+        self.assertIsNone(config.load_config())
+
+        # invalid config: the current one is kept
+        with open(self.config_file, 'w') as f:
+            json.dump({'processes': 'fake_process'}, f)
+        self.assertIsNone(config.load_config())
+        self.assertEqual(config.config_data, self.config_data)
+
+        updated_config_data['processes'] = ['fake_process', 'new_process']
+        with open(self.config_file, 'w') as f:
+            json.dump(updated_config_data, f)
+        diff = config.load_config()
+        self.assertEqual(diff.added, ['new_process'])
+        self.assertEqual(diff.removed, ['another_fake_process'])
+        self.assertEqual(diff.changed, [])
+
+        # back to the config the other tests expect
+        with open(self.config_file, 'w') as f:
+            json.dump(self.config_data, f)
+        config.load_config()
+
     def test_process_data(self):
         # Test default values
         name = 'test_process'
@@ -110,3 +153,721 @@ class TestArbWatchdog(unittest.TestCase):
         # Verifying that the process data was updated correctly
         updated_process_data = process_watcher.get_process_data(process_name)
         self.assertEqual(process_data, updated_process_data)
+
+    @patch('arb_watchdog.process_tracker.get_pids', return_value={10, 11})
+    def test_processes_info_single_snapshot(self, _):
+        process_watcher = ProcessWatcher(config_file=self.config_file,
+                                         redis_client=self.test_redis)
+        snapshot = [
+            ProcessEntry(10, 'python -m another_fake_process', 1.),
+            ProcessEntry(11, 'python -m fake_process --live', 1.)
+        ]
+        with patch('arb_watchdog.process_tracker.get_process_snapshot',
+                   return_value=snapshot) as get_snapshot:
+            processes_info = process_watcher.get_processes_info(
+                process_watcher.get_process_list())
+
+        get_snapshot.assert_called_once_with()
+        # fake_process is also a substring of another_fake_process
+        self.assertEqual(processes_info['fake_process'].pid, 10)
+        self.assertEqual(processes_info['another_fake_process'].pid, 10)
+        self.assertEqual(processes_info['fake_process'].status, 'UP')
+
+    @unittest.skipUnless(pidfd_supported(), 'pidfd_open not supported')
+    def test_down_published_on_exit(self):
+        process_watcher = ProcessWatcher(config_file=self.config_file,
+                                         redis_client=self.test_redis)
+
+        process, entry = start_process()
+        tracker = process_watcher.get_tracker(['fake_process'])
+        tracker.tracked['fake_process'] = entry
+        process_watcher.exit_watcher.sync(tracker.tracked)
+
+        process.kill()
+        process_watcher.wait_for_exits(0.5)
+        process.wait()
+
+        self.assertEqual(
+            self.test_redis.hget('arb_watchdog:test_host:fake_process',
+                                 'status'), 'DOWN')
+        self.assertNotIn('fake_process', tracker.tracked)
+
+    def test_publish_only_changes(self):
+        process_watcher = ProcessWatcher(config_file=self.config_file,
+                                         redis_client=self.test_redis)
+        key = 'arb_watchdog:test_host:fake_process'
+
+        process_watcher.publish_processes(
+            [ProcessData('fake_process', pid=10, status='UP', cmdline='fake')])
+        up_since = self.test_redis.hget(key, 'last_status_change')
+
+        # unchanged: not written again
+        self.test_redis.hset(key, 'cmdline', 'not rewritten')
+        process_watcher.publish_processes(
+            [ProcessData('fake_process', pid=10, status='UP', cmdline='fake')])
+        self.assertEqual(self.test_redis.hget(key, 'cmdline'), 'not rewritten')
+
+        # same status: last_status_change is kept
+        process_watcher.publish_processes(
+            [ProcessData('fake_process', pid=11, status='UP', cmdline='fake')])
+        self.assertEqual(self.test_redis.hget(key, 'pid'), '11')
+        self.assertEqual(self.test_redis.hget(key, 'last_status_change'),
+                         up_since)
+
+        time.sleep(0.01)
+        process_watcher.publish_processes([ProcessData('fake_process')])
+        data = self.test_redis.hgetall(key)
+        self.assertEqual(data['status'], 'DOWN')
+        self.assertNotIn('pid', data)
+        self.assertGreater(float(data['last_status_change']), float(up_since))
+
+        events = [e[1] for e in self.test_redis.xrange('arb_watchdog_events')]
+        self.assertEqual([(e['status'], e['previous_status']) for e in events],
+                         [('UP', ''), ('DOWN', 'UP')])
+
+    def test_publish_keeps_previous_run_state(self):
+        last_status_change = datetime(2024, 1, 1)
+        self.test_redis.hset(
+            'arb_watchdog:test_host:fake_process',
+            mapping={
+                'name': 'fake_process',
+                'status': 'DOWN',
+                'last_status_change': last_status_change.timestamp()
+            })
+        process_watcher = ProcessWatcher(config_file=self.config_file,
+                                         redis_client=self.test_redis)
+        process_watcher.publish_processes([ProcessData('fake_process')])
+
+        process_data = process_watcher.get_process_data('fake_process')
+        self.assertEqual(process_data.last_status_change, last_status_change)
+        self.assertFalse(self.test_redis.exists('arb_watchdog_events'))
+
+    def test_watchdog_cli(self):
+        Agent(self.test_redis, 'host_a', 60).beat(['fake_process'], 60)
+        self.test_redis.hset('arb_watchdog:host_a:fake_process',
+                             mapping={
+                                 'name': 'fake_process',
+                                 'status': 'UP',
+                                 'pid': 42
+                             })
+        self.test_redis.lpush(
+            telemetry.get_stats_key('host_a', 'fake_process'),
+            ProcessStats(time=1.0, rss=2**20).to_csv())
+        with patch('arb_watchdog.cli.get_redis_client',
+                   return_value=self.test_redis):
+            cli = ProcessWatchdogCLI(config_file=self.config_file)
+
+        cli.display_process_info()
+        key = ('host_a', 'fake_process')
+        self.assertEqual(cli.view.processes[key].pid, 42)
+        self.assertEqual(cli.view.stats[key].rss, 2**20)
+        self.assertIn('fake_process', cli.render(cli.view))
+
+        self.test_redis.hset('arb_watchdog:host_a:fake_process', 'pid', 43)
+        cli.refresh_processes([key])
+        self.assertEqual(cli.view.processes[key].pid, 43)
+
+        self.assertEqual(
+            cli._get_changed_key(
+                '__keyspace@0__:arb_watchdog:host_a:fake_process'), key)
+        self.assertEqual(
+            cli._get_changed_key(
+                '__keyspace@0__:arb_watchdog_stats:host_a:fake_process:raw'),
+            key)
+        self.assertIsNone(
+            cli._get_changed_key(
+                '__keyspace@0__:arb_watchdog_stats:host_a:fake_process:60'))
+
+    def test_watchdog_cli_refresh_agents(self):
+        for host in ('host_a', 'host_b'):
+            Agent(self.test_redis, host, 60).beat(['fake_process'], 60)
+            self.test_redis.hset(get_process_key(host, 'fake_process'),
+                                 mapping={
+                                     'name': 'fake_process',
+                                     'status': 'UP'
+                                 })
+        with patch('arb_watchdog.cli.get_redis_client',
+                   return_value=self.test_redis):
+            cli = ProcessWatchdogCLI(config_file=self.config_file)
+        cli.display_process_info()
+        self.assertEqual(cli.view.duplicates,
+                         {'fake_process': ['host_a', 'host_b']})
+
+        # only the processes of the host whose list changed are refetched
+        agent_b = Agent(self.test_redis, 'host_b', 60)
+        agent_b.beat(['fake_process', 'another_fake_process'], 60)
+        with patch('arb_watchdog.cli.fetch_processes',
+                   wraps=fetch_processes) as mock_fetch:
+            cli.refresh_agents()
+        self.assertEqual(mock_fetch.call_args.args[1],
+                         [('host_b', 'fake_process'),
+                          ('host_b', 'another_fake_process')])
+        self.assertIsNone(
+            cli.view.processes[('host_b', 'another_fake_process')])
+
+        agent_b.stop()
+        cli.refresh_agents()
+        self.assertEqual(cli.view.agent_statuses['host_b'], 'OFFLINE')
+        self.assertEqual(cli.view.duplicates, {})
+
+        # last seen times are polled
+        self.assertFalse(cli.refresh_last_seen())
+        self.test_redis.hset(AGENTS_SEEN_KEY, 'host_a',
+                             time.time() - 60 * LOST_INTERVALS - 1)
+        self.assertTrue(cli.refresh_last_seen())
+        self.assertEqual(cli.view.agent_statuses['host_a'], 'LOST')
+
+    def test_watchdog_cli_keyspace_events(self):
+        with patch('arb_watchdog.cli.get_redis_client',
+                   return_value=MagicMock()):
+            cli = ProcessWatchdogCLI(config_file=self.config_file)
+
+        for current, expected in [('', 'Khl'), ('EA', 'EAK'), ('Kh', 'Khl'),
+                                  ('KEA', None)]:
+            cli.redis.reset_mock()
+            cli.redis.config_get.return_value = {
+                'notify-keyspace-events': current
+            }
+            self.assertTrue(cli.enable_keyspace_events())
+            if expected is None:
+                cli.redis.config_set.assert_not_called()
+            else:
+                cli.redis.config_set.assert_called_once_with(
+                    'notify-keyspace-events', expected)
+
+        # falls back to polling
+        cli.redis.config_set.side_effect = RedisError('CONFIG disabled')
+        cli.redis.config_get.return_value = {'notify-keyspace-events': ''}
+        self.assertFalse(cli.enable_keyspace_events())
+
+    def test_watcher_applies_config_changes(self):
+        process_watcher = ProcessWatcher(config_file=self.config_file,
+                                         redis_client=self.test_redis)
+        config = process_watcher.config
+        self.assertIs(process_watcher.apply_config(), config)
+        self.assertIsNotNone(process_watcher.telemetry)
+
+        updated_config_data = dict(config, telemetry=False)
+        process_watcher.config_obj.config_data = updated_config_data
+        try:
+            self.assertIs(process_watcher.apply_config(), updated_config_data)
+            self.assertIsNone(process_watcher.telemetry)
+        finally:
+            process_watcher.config_obj.config_data = config
+
+    @patch('arb_watchdog.process_tracker.get_pids', return_value={10, 11, 12})
+    def test_replicas_status(self, _):
+        process_watcher = ProcessWatcher(config_file=self.config_file,
+                                         redis_client=self.test_redis)
+        snapshot = [
+            ProcessEntry(10, 'python feed.py', 1., ('python', 'feed.py')),
+            ProcessEntry(11, 'python feed.py', 1., ('python', 'feed.py')),
+            ProcessEntry(12, 'python order.py', 1., ('python', 'order.py')),
+        ]
+        rules = [
+            {'name': 'feed', 'argv': 'feed.py', 'replicas': 2},
+            {'name': 'order', 'argv': 'order.py', 'replicas': 2},
+            {'name': 'risk', 'argv': 'risk.py', 'replicas': 1},
+            {'name': 'pnl', 'argv': 'feed.py', 'replicas': 1},
+        ]
+        with patch('arb_watchdog.process_tracker.get_process_snapshot',
+                   return_value=snapshot):
+            processes_info = process_watcher.get_processes_info(rules)
+
+        self.assertEqual(processes_info['feed'].status, 'UP')
+        self.assertEqual(processes_info['feed'].replicas, 2)
+        self.assertEqual(processes_info['order'].status, 'DEGRADED')
+        self.assertEqual(processes_info['risk'].status, 'DOWN')
+        self.assertEqual(processes_info['risk'].replicas, 0)
+        self.assertEqual(processes_info['pnl'].status, 'DUPLICATE')
+
+    @patch('arb_watchdog.process_tracker.get_pids', return_value={10})
+    def test_stale_heartbeat(self, _):
+        process_watcher = ProcessWatcher(config_file=self.config_file,
+                                         redis_client=self.test_redis)
+        snapshot = [
+            ProcessEntry(10, 'python feed.py', time.time() - 10,
+                         ('python', 'feed.py'))
+        ]
+        rules = [{'name': 'feed', 'argv': 'feed.py', 'heartbeat': 5}]
+        with tempfile.TemporaryDirectory() as heartbeat_dir, \
+                patch.object(heartbeat, 'HEARTBEAT_DIR', heartbeat_dir), \
+                patch('arb_watchdog.process_tracker.get_process_snapshot',
+                      return_value=snapshot):
+            # never beat, started 10s ago
+            processes_info = process_watcher.get_processes_info(rules)
+            self.assertEqual(processes_info['feed'].status, 'STALE')
+            self.assertEqual(process_watcher.get_heartbeat_period(), 2.5)
+
+            feed_heartbeat = Heartbeat('feed')
+            feed_heartbeat.beat()
+            process_watcher.check_heartbeats()
+            feed_heartbeat.close()
+        self.assertEqual(
+            self.test_redis.hget('arb_watchdog:test_host:feed', 'status'),
+            'UP')
+
+    def test_watcher_registers_agent(self):
+        process_watcher = ProcessWatcher(config_file=self.config_file,
+                                         redis_client=self.test_redis)
+        with patch('arb_watchdog.process_tracker.get_process_snapshot',
+                   return_value=[]):
+            process_watcher.check_processes()
+
+        agents = get_agents(self.test_redis)
+        self.assertEqual(list(agents), ['test_host'])
+        self.assertEqual(agents['test_host'].processes,
+                         ['fake_process', 'another_fake_process'])
+        self.assertEqual(agents['test_host'].get_status(), 'ONLINE')
+        self.assertEqual(
+            self.test_redis.hget('arb_watchdog:test_host:fake_process',
+                                 'status'), 'DOWN')
+
+        process_watcher.agent.stop()
+        self.assertEqual(
+            get_agents(self.test_redis)['test_host'].get_status(), 'OFFLINE')
+
+
+def start_process():
+    process = subprocess.Popen(['sleep', '30'])
+    entry = ProcessEntry(process.pid, 'sleep 30',
+                         psutil.Process(process.pid).create_time())
+    return process, entry
+
+
+@unittest.skipUnless(pidfd_supported(), 'pidfd_open not supported')
+class TestExitWatcher(unittest.TestCase):
+
+    def test_exit_is_reported(self):
+        process, entry = start_process()
+        exit_watcher = ExitWatcher()
+        exit_watcher.watch('sleep', entry)
+        self.assertEqual(exit_watcher.wait(0), [])
+
+        process.kill()
+        start = time.monotonic()
+        self.assertEqual(exit_watcher.wait(5), ['sleep'])
+        self.assertLess(time.monotonic() - start, 1)
+        process.wait()
+        exit_watcher.close()
+
+
+class TestHeartbeat(unittest.TestCase):
+
+    def setUp(self):
+        heartbeat_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(heartbeat_dir.cleanup)
+        patcher = patch.object(heartbeat, 'HEARTBEAT_DIR', heartbeat_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_shared_memory(self):
+        self.assertIsNone(read_heartbeat('feed'))
+        feed_heartbeat = Heartbeat('feed', interval_ms=60000)
+        self.addCleanup(feed_heartbeat.close)
+        feed_heartbeat.beat()
+        first_beat = read_heartbeat('feed')
+        self.assertAlmostEqual(first_beat, time.time(), delta=1)
+
+        # coalesced: not written again before interval_ms
+        time.sleep(0.05)
+        feed_heartbeat.beat()
+        self.assertAlmostEqual(read_heartbeat('feed'), first_beat, delta=0.01)
+
+    def test_redis(self):
+        redis = FakeRedis(decode_responses=True)
+        feed_heartbeat = Heartbeat('feed',
+                                   interval_ms=60000,
+                                   redis=redis,
+                                   host='test_host')
+        feed_heartbeat.beat()
+        self.assertEqual(get_heartbeats(redis, 'test_host', ['feed']), {})
+        feed_heartbeat.flush()
+        self.assertAlmostEqual(get_heartbeats(redis, 'test_host',
+                                              ['feed'])['feed'],
+                               time.time(),
+                               delta=1)
+        feed_heartbeat.close()
+
+
+class TestHosts(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis(decode_responses=True)
+        for host in ('host_a', 'host_b', 'host_c'):
+            Agent(self.redis, host, 60).beat(['feed', 'order'], 60)
+            for process_name in ('feed', 'order'):
+                self.redis.hset(get_process_key(host, process_name),
+                                mapping={
+                                    'name': process_name,
+                                    'status': 'DOWN'
+                                })
+
+    def set_status(self, host, process_name, status):
+        self.redis.hset(get_process_key(host, process_name), 'status', status)
+
+    def test_aggregated_view(self):
+        self.set_status('host_a', 'feed', 'UP')
+        self.set_status('host_b', 'feed', 'STALE')
+        self.set_status('host_a', 'order', 'UP')
+
+        view = get_aggregated_view(self.redis)
+        self.assertEqual(len(view.processes), 6)
+        self.assertEqual(view.processes[('host_a', 'order')].status, 'UP')
+        self.assertEqual(view.duplicates, {'feed': ['host_a', 'host_b']})
+
+    def test_agent_saved_only_when_changed(self):
+        agent = Agent(self.redis, 'host_d', 60)
+        agent.beat(['feed'], 60)
+        # an unchanged agent only refreshes its last seen time
+        self.redis.hset(AGENTS_KEY, 'host_d', 'unchanged')
+        agent.beat(['feed'], 60)
+        self.assertEqual(self.redis.hget(AGENTS_KEY, 'host_d'), 'unchanged')
+        self.assertEqual(float(self.redis.hget(AGENTS_SEEN_KEY, 'host_d')),
+                         agent.info.last_seen)
+
+        # registered again when the key was lost
+        self.redis.delete(AGENTS_KEY)
+        agent.beat(['feed'], 60)
+        self.assertEqual(get_agents(self.redis)['host_d'].processes, ['feed'])
+
+        agent.beat(['feed', 'order'], 60)
+        info = get_agents(self.redis)['host_d']
+        self.assertEqual(info.processes, ['feed', 'order'])
+        self.assertEqual(info.last_seen, agent.info.last_seen)
+
+    def test_offline_and_lost_agents(self):
+        self.set_status('host_a', 'feed', 'UP')
+        self.set_status('host_b', 'feed', 'UP')
+        self.set_status('host_c', 'feed', 'UP')
+        agent = get_agents(self.redis)['host_b']
+        agent.status = 'OFFLINE'
+        self.redis.hset(AGENTS_KEY, 'host_b', agent.to_json())
+
+        view = get_aggregated_view(self.redis)
+        self.assertEqual(view.agent_statuses['host_b'], 'OFFLINE')
+        self.assertEqual(view.duplicates, {'feed': ['host_a', 'host_c']})
+
+        # not seen for LOST_INTERVALS intervals
+        view = get_aggregated_view(self.redis,
+                                   now=time.time() + 60 * LOST_INTERVALS + 1)
+        self.assertEqual(view.agent_statuses['host_a'], 'LOST')
+        self.assertEqual(view.duplicates, {})
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_csv(self):
+        stats = ProcessStats(time=1700000000.25,
+                             cpu_percent=12.34,
+                             rss=123456,
+                             threads=4,
+                             ctx_switches=10)
+        line = stats.to_csv()
+        self.assertEqual(line, '1700000000.2,12.3,123456,4,,10,,')
+        self.assertEqual(ProcessStats.from_csv(line).rss, 123456)
+        self.assertIsNone(ProcessStats.from_csv(line).fds)
+
+    def test_downsampler(self):
+        downsampler = Downsampler(60)
+        self.assertIsNone(
+            downsampler.add(ProcessStats(0, cpu_percent=10, ctx_switches=1)))
+        self.assertIsNone(
+            downsampler.add(ProcessStats(30, cpu_percent=30, ctx_switches=5)))
+        averaged = downsampler.add(ProcessStats(61, cpu_percent=0))
+        self.assertEqual(averaged.time, 0)
+        self.assertEqual(averaged.cpu_percent, 20)
+        self.assertEqual(averaged.ctx_switches, 5)
+
+    def test_collect_and_publish(self):
+        process = psutil.Process()
+        entry = ProcessEntry(process.pid, 'test', process.create_time())
+        collector = TelemetryCollector('test_host')
+        redis = FakeRedis(decode_responses=True)
+
+        stats = collector.collect({'test': entry}, now=0)
+        self.assertIsNone(stats['test'].cpu_percent)
+        self.assertGreater(stats['test'].rss, 0)
+        self.assertGreater(stats['test'].threads, 0)
+        collector.publish(redis, stats)
+
+        stats = collector.collect({'test': entry}, now=60)
+        self.assertIsNotNone(stats['test'].cpu_percent)
+        collector.publish(redis, stats)
+
+        self.assertEqual(
+            redis.llen(telemetry.get_stats_key('test_host', 'test')), 2)
+        self.assertEqual(
+            redis.llen(telemetry.get_stats_key('test_host', 'test', '60')), 1)
+        latest = get_latest_stats(redis, 'test_host', ['test', 'missing'])
+        self.assertEqual(list(latest), ['test'])
+        self.assertEqual(latest['test'].time, 60)
+
+    def test_stats_attrs_unavailable(self):
+        # e.g: no io_counters on macOS
+        attrs = [a for a in telemetry.STATS_ATTRS if a != 'io_counters']
+        with patch.object(telemetry, 'STATS_ATTRS', attrs):
+            stats = ProcessStats.from_process(psutil.Process(), now=0)
+        self.assertGreater(stats.rss, 0)
+        self.assertIsNone(stats.read_bytes)
+
+    def test_collect_error_is_skipped(self):
+        process = psutil.Process()
+        entry = ProcessEntry(process.pid, 'test', process.create_time())
+        collector = TelemetryCollector('test_host')
+        with patch.object(ProcessStats,
+                          'from_process',
+                          side_effect=ValueError('invalid attr name')):
+            self.assertEqual(collector.collect({'test': entry}, now=0), {})
+
+
+class TestProcessTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshot = [
+            ProcessEntry(10, 'python -m feed', 1.),
+            ProcessEntry(11, 'python -m order', 1.)
+        ]
+        self.tracker = ProcessTracker(ProcessMatcher(['feed', 'order']),
+                                      full_scan_interval=60)
+        self.alive = {10, 11}
+        self.pids = {1, 10, 11}
+
+        patchers = [
+            patch('arb_watchdog.process_tracker.get_process_snapshot',
+                  side_effect=self._get_process_snapshot),
+            patch('arb_watchdog.process_tracker.get_pids',
+                  side_effect=lambda: set(self.pids)),
+            patch('arb_watchdog.process_tracker.is_process_alive',
+                  side_effect=lambda entry: entry.pid in self.alive),
+        ]
+        mocks = [patcher.start() for patcher in patchers]
+        self.get_snapshot = mocks[0]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def _get_process_snapshot(self, pids=None):
+        return [e for e in self.snapshot if pids is None or e.pid in pids]
+
+    def test_tracked_processes_are_not_rescanned(self):
+        tracked = self.tracker.update(now=0)
+        self.assertEqual(tracked['feed'].pid, 10)
+        self.assertEqual(tracked['order'].pid, 11)
+
+        self.tracker.update(now=1)
+        self.tracker.update(now=2)
+        self.assertEqual(self.get_snapshot.call_count, 1)
+
+    def test_missing_process_found_in_new_pids(self):
+        self.tracker.update(now=0)
+        self.alive.discard(10)
+        self.assertNotIn('feed', self.tracker.update(now=1))
+        # no new pid, no scan
+        self.assertEqual(self.get_snapshot.call_count, 1)
+
+        self.snapshot.append(ProcessEntry(12, 'python -m feed', 2.))
+        self.pids.add(12)
+        self.alive.add(12)
+        self.assertEqual(self.tracker.update(now=2)['feed'].pid, 12)
+        self.get_snapshot.assert_called_with({12})
+
+    def test_full_scan_interval(self):
+        self.snapshot = self.snapshot[1:]
+        self.tracker.update(now=0)
+        # feed exec'd its cmdline in an already scanned pid
+        self.snapshot.append(ProcessEntry(1, 'python -m feed', 1.))
+        self.assertNotIn('feed', self.tracker.update(now=30))
+        self.assertEqual(self.tracker.update(now=60)['feed'].pid, 1)
+        self.get_snapshot.assert_called_with()
+
+    def test_replicas(self):
+        self.tracker.set_matcher(
+            ProcessMatcher(['order', {
+                'name': 'feed',
+                'replicas': 2
+            }]))
+        self.snapshot.append(ProcessEntry(12, 'python -m feed', 2.))
+        self.pids.add(12)
+        self.alive.add(12)
+        self.tracker.update(now=0)
+        self.assertEqual([e.pid for e in self.tracker.replicas['feed']],
+                         [10, 12])
+        self.assertEqual(self.tracker.tracked['feed'].pid, 10)
+
+        # a new replica is found in the new pids even when feed is found
+        self.snapshot.append(ProcessEntry(13, 'python -m feed', 3.))
+        self.pids.add(13)
+        self.alive.add(13)
+        self.tracker.update(now=1)
+        self.get_snapshot.assert_called_with({13})
+        self.assertEqual(len(self.tracker.replicas['feed']), 3)
+
+        # the next replica takes over the exited one
+        self.tracker.forget('feed')
+        self.assertEqual(self.tracker.tracked['feed'].pid, 12)
+        self.alive.discard(12)
+        self.tracker.update(now=2)
+        self.assertEqual(self.tracker.tracked['feed'].pid, 13)
+        self.assertEqual(len(self.tracker.replicas['feed']), 1)
+
+
+class TestConfig(unittest.TestCase):
+
+    def test_validate_config(self):
+        validate_config({'processes': ['a'], 'interval': 0.5})
+        invalid_configs = [
+            [],
+            {},
+            {'processes': 'a'},
+            {'processes': ['']},
+            {'processes': ['a'], 'interval': 0},
+            {'processes': ['a'], 'redis_port': '6379'},
+            {'processes': ['a'], 'redis_port': True},
+            {'processes': ['a'], 'telemetry': 1},
+        ]
+        for config_data in invalid_configs:
+            with self.assertRaises(ConfigError):
+                validate_config(config_data)
+
+    def test_diff_configs(self):
+        old = {'processes': ['a', 'b'], 'interval': 60}
+        new = {'processes': ['b', 'c'], 'interval': 30, 'telemetry': False}
+        diff = diff_configs(old, new)
+        self.assertEqual(diff.added, ['c'])
+        self.assertEqual(diff.removed, ['a'])
+        self.assertEqual(diff.changed, ['interval', 'telemetry'])
+        self.assertTrue(diff.names_changed)
+        self.assertFalse(diff_configs(old, dict(old)))
+
+    def test_file_events_debounced_and_filtered(self):
+        config_file = Path(tempfile.gettempdir()) / 'arb_watchdog_config.json'
+        calls = []
+        handler = ConfigFileHandler(config_file, lambda: calls.append(1))
+        handler.DEBOUNCE = 0.05
+
+        other = MagicMock(is_directory=False,
+                          event_type='modified',
+                          src_path=str(config_file.parent / 'other.json'))
+        handler.on_any_event(other)
+        for _ in range(5):
+            handler.on_any_event(
+                MagicMock(is_directory=False,
+                          event_type='modified',
+                          src_path=str(config_file)))
+        # editors save to a temporary file renamed over the config
+        handler.on_any_event(
+            MagicMock(is_directory=False,
+                      event_type='moved',
+                      src_path=str(config_file) + '.swp',
+                      dest_path=str(config_file)))
+        time.sleep(0.2)
+        self.assertEqual(calls, [1])
+
+
+class TestProcessMatcher(unittest.TestCase):
+
+    def test_match(self):
+        matcher = ProcessMatcher(['feed', 'feed_binance', 'bin', 'order'])
+        self.assertEqual(matcher.match('python feed_binance.py'),
+                         {'feed', 'feed_binance', 'bin'})
+        self.assertEqual(matcher.match('python feed.py'), {'feed'})
+        self.assertEqual(matcher.match('python strategy.py'), set())
+
+    def test_match_special_characters(self):
+        matcher = ProcessMatcher(['strat.py --live', 'a+b'])
+        self.assertEqual(matcher.match('python strat.py --live'),
+                         {'strat.py --live'})
+        self.assertEqual(matcher.match('python stratxpy --live'), set())
+        self.assertEqual(matcher.match('run a+b'), {'a+b'})
+
+    def test_match_processes_first_wins(self):
+        matcher = ProcessMatcher(['feed', 'order'])
+        matches = matcher.match_processes([
+            ProcessEntry(1, 'feed'),
+            ProcessEntry(2, 'feed order'),
+            ProcessEntry(3, 'order')
+        ])
+        self.assertEqual(matches, {
+            'feed': ProcessEntry(1, 'feed'),
+            'order': ProcessEntry(2, 'feed order')
+        })
+
+    def test_rules(self):
+        matcher = ProcessMatcher([
+            {'name': 'feed', 'argv': 'feed.py'},
+            {'name': 'feed_live', 'argv': 'feed.py', 'regex': r'--live\b'},
+            {'name': 'redis', 'exe': 'redis-server', 'user': 'redis'},
+            {'name': 'order', 'regex': r'^python -m order( |$)'},
+        ])
+        self.assertEqual(matcher.extra_attrs, ('exe', 'username'))
+
+        def entry(*argv, exe=None, username=None):
+            return ProcessEntry(1, ' '.join(argv), 1., argv, exe, username)
+
+        self.assertEqual(matcher.match(entry('python', '/opt/arb/feed.py')),
+                         {'feed'})
+        self.assertEqual(
+            matcher.match(entry('python', 'feed.py', '--live')),
+            {'feed', 'feed_live'})
+        # no substring false positives
+        self.assertEqual(matcher.match(entry('grep', 'feed.py.bak')), set())
+        self.assertEqual(matcher.match(entry('python', '-m', 'order_v2')),
+                         set())
+        self.assertEqual(matcher.match(entry('python', '-m', 'order')),
+                         {'order'})
+        self.assertEqual(
+            matcher.match(
+                entry('redis-server', exe='/usr/bin/redis-server',
+                      username='redis')), {'redis'})
+        self.assertEqual(
+            matcher.match(
+                entry('redis-server', exe='/usr/bin/redis-server',
+                      username='root')), set())
+
+    def test_cgroup_rule(self):
+        matcher = ProcessMatcher([{
+            'name': 'feed',
+            'argv': 'feed.py',
+            'cgroup': 'arb_feed.service'
+        }])
+        entry = ProcessEntry(1, 'python feed.py', 1., ('python', 'feed.py'))
+        with patch('arb_watchdog.process_matcher.get_cgroup',
+                   return_value='0::/system.slice/arb_feed.service\n'):
+            self.assertEqual(matcher.match(entry), {'feed'})
+        with patch('arb_watchdog.process_matcher.get_cgroup',
+                   return_value='0::/user.slice\n') as get_cgroup:
+            self.assertEqual(matcher.match(entry), set())
+            # only read for the candidates of a cgroup rule
+            matcher.match(ProcessEntry(2, 'python order.py'))
+            get_cgroup.assert_called_once_with(1)
+
+    def test_match_all(self):
+        matcher = ProcessMatcher([{'name': 'feed', 'replicas': 2}])
+        self.assertEqual(matcher.counted, ['feed'])
+        matches = matcher.match_all([
+            ProcessEntry(1, 'feed'),
+            ProcessEntry(2, 'order'),
+            ProcessEntry(3, 'feed')
+        ])
+        self.assertEqual([e.pid for e in matches['feed']], [1, 3])
+
+    def test_rule_from_config(self):
+        self.assertEqual(ProcessRule.from_config('feed'),
+                         ProcessRule('feed', cmdline='feed'))
+        # only filters: the name is searched in the cmdline
+        self.assertEqual(ProcessRule.from_config({
+            'name': 'feed',
+            'user': 'arb'
+        }), ProcessRule('feed', cmdline='feed', user='arb'))
+        invalid_rules = [
+            '',
+            {'argv': 'feed.py'},
+            {'name': 'feed', 'unknown': 1},
+            {'name': 'feed', 'regex': '('},
+            {'name': 'feed', 'replicas': 0},
+            {'name': 'feed', 'exe': ''},
+            {'name': 'feed', 'heartbeat': 0},
+        ]
+        for rule in invalid_rules:
+            with self.assertRaises(ValueError):
+                ProcessRule.from_config(rule)